@@ -41,6 +41,27 @@ def create_app():
         REMEMBER_COOKIE_SECURE=True,
         SESSION_COOKIE_HTTPONLY=True,
         REMEMBER_COOKIE_HTTPONLY=True,
+        SQL_INSTRUMENTATION=bool(os.environ.get("SQL_INSTRUMENTATION")),
+        SLOW_REQUEST_QUERIES=int(os.environ.get("SLOW_REQUEST_QUERIES", 50)),
+        SLOW_REQUEST_DB_MS=int(os.environ.get("SLOW_REQUEST_DB_MS", 200)),
+        METRICS=bool(os.environ.get("METRICS")),
+        METRICS_DB=os.environ.get("METRICS_DB", "db/metrics.db"),
+        METRICS_FLUSH_SECONDS=int(os.environ.get("METRICS_FLUSH_SECONDS", 5)),
+        PROFILE_DIR=os.environ.get("PROFILE_DIR", "db/profiles"),
+        PROFILE_KEEP=int(os.environ.get("PROFILE_KEEP", 50)),
+        FRAGMENT_CACHE_MB=int(os.environ.get("FRAGMENT_CACHE_MB", 16)),
+        CHARIMG_PRELOAD=bool(os.environ.get("CHARIMG_PRELOAD")),
+        PORTRAIT_CACHE_DIR=os.environ.get("PORTRAIT_CACHE_DIR", "db/portraits"),
+        PORTRAIT_CACHE_MB=int(os.environ.get("PORTRAIT_CACHE_MB", 64)),
+        PORTRAIT_PREGENERATED_DIR=os.environ.get(
+            "PORTRAIT_PREGENERATED_DIR", "db/portraits-pregenerated"
+        ),
+        LIVE_UPDATES=bool(os.environ.get("LIVE_UPDATES")),
+        LIVE_DB=os.environ.get("LIVE_DB", "db/live.db"),
+        LIVE_POLL_SECONDS=float(os.environ.get("LIVE_POLL_SECONDS", 0.5)),
+        LIVE_STREAM_SECONDS=int(os.environ.get("LIVE_STREAM_SECONDS", 300)),
+        LIVE_KEEP_SECONDS=int(os.environ.get("LIVE_KEEP_SECONDS", 600)),
+        LIVE_MAX_STREAMS=int(os.environ.get("LIVE_MAX_STREAMS", 4)),
     )
     app.register_blueprint(main_routes)
     app.register_blueprint(error_routes)
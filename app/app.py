@@ -3,14 +3,38 @@ Simply initializes the app and registers all blueprints
 """
 from .blueprints import register_blueprints
 from .plugins import plugins
+from .instrumentation import sql_instrumentation
+from .metrics import metrics
+from .profiling import request_profiler
+from .character_data import character_data_cache
+from .cache import fragment_cache
+from .live import live_updates
+from .markup import srd_markdown, user_markdown
+from .blueprints.charimg import layer_atlas, portrait_cache, portraits_cli
 
 
 def init_app(app):
     db, migrate, bcrypt, login_manager = plugins
     for plugin in (db, bcrypt, login_manager):
         plugin.init_app(app)
-    migrate.init_app(app, db)
+    migrate.init_app(app, db, render_as_batch=True)
     register_blueprints(app)
+    sql_instrumentation.init_app(app)
+    # teardown hooks run in reverse, so metrics read g.sql_stats before it is popped
+    metrics.init_app(app)
+    metrics.register_cache("character_data", character_data_cache)
+    fragment_cache.init_app(app)
+    metrics.register_cache("fragments", fragment_cache)
+    metrics.register_cache("srd_markdown", srd_markdown)
+    metrics.register_cache("user_markdown", user_markdown)
+    request_profiler.init_app(app)
+    portrait_cache.init_app(app)
+    live_updates.init_app(app)
+    metrics.register_cache("portraits", portrait_cache)
+    app.cli.add_command(portraits_cli)
+    if app.config["CHARIMG_PRELOAD"]:
+        # before uWSGI forks, so the workers share the decoded layers
+        layer_atlas.load()
 
     """
     import flask_monitoringdashboard as monitor
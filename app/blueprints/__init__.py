@@ -9,6 +9,8 @@ from . import (
     scene_npc,
     spells,
     monsters,
+    admin,
+    metrics,
 )
 
 
@@ -24,5 +26,7 @@ def register_blueprints(app):
         scene_npc.blueprint,
         spells.blueprint,
         monsters.blueprint,
+        admin.blueprint,
+        metrics.blueprint,
     ):
         app.register_blueprint(blueprint, url_prefix=f"/{blueprint.name}")
@@ -0,0 +1,91 @@
+"""
+Pages for administrators to see what the server is doing
+"""
+from flask import Blueprint, render_template, current_app, abort, send_from_directory
+from tabletop_story.instrumentation import sql_instrumentation
+from tabletop_story.metrics import metrics, quantile
+from tabletop_story.profiling import request_profiler, PROFILE_NAME
+from .inventory import admin_required
+import os
+
+
+blueprint = Blueprint("admin", __name__, template_folder="../templates/admin")
+
+
+@blueprint.route("/sql")
+@admin_required
+def sql_stats():
+    """Statement counts and database time per endpoint in this worker process"""
+    return render_template(
+        "sql_stats.html",
+        logged_in=True,
+        enabled=current_app.config["SQL_INSTRUMENTATION"],
+        endpoints=sql_instrumentation.snapshot(),
+        slow_request_queries=current_app.config["SLOW_REQUEST_QUERIES"],
+        slow_request_db_ms=current_app.config["SLOW_REQUEST_DB_MS"],
+    )
+
+
+@blueprint.route("/metrics")
+@admin_required
+def latency():
+    """Request latency percentiles per endpoint across all worker processes"""
+    endpoints = []
+    if metrics.enabled:
+        metrics.flush()
+        counters, histograms = metrics.read()
+        for (name, labels), cumulative in histograms.items():
+            if name != "tabletop_request_duration_seconds":
+                continue
+            requests = cumulative[-1][1]
+            total = counters.get((f"{name}_sum", labels), 0)
+            endpoints.append(
+                (
+                    labels.split('"')[1],
+                    requests,
+                    total * 1000 / requests,
+                    quantile(0.5, cumulative) * 1000,
+                    quantile(0.95, cumulative) * 1000,
+                )
+            )
+        endpoints.sort(key=lambda endpoint: endpoint[4], reverse=True)
+    return render_template(
+        "metrics.html",
+        logged_in=True,
+        enabled=metrics.enabled,
+        endpoints=endpoints,
+    )
+
+
+@blueprint.route("/profiles")
+@admin_required
+def profiles():
+    """Recently profiled requests, from any worker process"""
+    return render_template(
+        "profiles.html",
+        logged_in=True,
+        profiles=request_profiler.recent(),
+        keep=request_profiler.keep,
+    )
+
+
+def profile_file(name, ext):
+    if not PROFILE_NAME.match(name):
+        abort(404)
+    return send_from_directory(
+        os.path.abspath(request_profiler.directory),
+        f"{name}{ext}",
+        as_attachment=ext != ".html",
+    )
+
+
+@blueprint.route("/profiles/<name>")
+@admin_required
+def profile_summary(name):
+    return profile_file(name, ".html")
+
+
+@blueprint.route("/profiles/<name>.<any(prof, pyisession):ext>")
+@admin_required
+def profile_download(name, ext):
+    return profile_file(name, f".{ext}")
@@ -1,15 +1,24 @@
-from flask import Blueprint, render_template, abort, redirect, url_for, flash
+from flask import (
+    Blueprint,
+    Response,
+    render_template,
+    abort,
+    redirect,
+    url_for,
+    flash,
+)
 from flask_login import login_required, current_user
 from werkzeug.datastructures import MultiDict
+from wtforms import BooleanField
 from tabletop_story.models import (
     GameCampaign,
     GameCharacter,
     CampaignLocation,
-    LocationScene,
-    SceneNPC,
 )
 from tabletop_story.forms import GenericCreateForm, EditCampaignForm
 from tabletop_story.plugins import db
+from tabletop_story.concurrency import retry_on_conflict
+from tabletop_story.live import live_updates
 from tabletop_story.blueprints import charimg
 import logging
 
@@ -45,6 +54,7 @@ def create_campaign():
 
 @blueprint.route("/edit/<campaign_id>/", methods=["GET", "POST"])
 @login_required
+@retry_on_conflict
 def edit_campaign(campaign_id):
     campaign = GameCampaign.query.get(campaign_id)
     if campaign is None:
@@ -53,130 +63,125 @@ def edit_campaign(campaign_id):
     if user_id != campaign.gamemaster:
         abort(403)
 
-    form = EditCampaignForm()
+    # subclass the edit form and add a removal checkbox for each player character
+    class ThisEditCampaignForm(EditCampaignForm):
+        pass
+
+    for character in campaign.members:
+        setattr(
+            ThisEditCampaignForm,
+            f"remove_member_{character.id}",
+            BooleanField(f"Remove {character.name} (#{character.id})"),
+        )
+
+    form = ThisEditCampaignForm()
     if form.validate_on_submit():
         campaign.name = form.name.data
-        char1 = GameCharacter.query.get(form.character1.data)
-        if char1 and str(char1.character.uid) == form.char1uid.data:
-            campaign.character1 = char1.id
-        else:
-            campaign.character1 = None
-        char2 = GameCharacter.query.get(form.character2.data)
-        if char2 and str(char2.character.uid) == form.char2uid.data:
-            campaign.character2 = char2.id
-        else:
-            campaign.character2 = None
-        char3 = GameCharacter.query.get(form.character3.data)
-        if char3 and str(char3.character.uid) == form.char3uid.data:
-            campaign.character3 = char3.id
-        else:
-            campaign.character3 = None
-        char4 = GameCharacter.query.get(form.character4.data)
-        if char4 and str(char4.character.uid) == form.char4uid.data:
-            campaign.character4 = char4.id
-        else:
-            campaign.character4 = None
-        char5 = GameCharacter.query.get(form.character5.data)
-        if char5 and str(char5.character.uid) == form.char5uid.data:
-            campaign.character5 = char5.id
-        else:
-            campaign.character5 = None
-        char6 = GameCharacter.query.get(form.character6.data)
-        if char6 and str(char6.character.uid) == form.char6uid.data:
-            campaign.character6 = char6.id
-        else:
-            campaign.character6 = None
+        campaign.members = [
+            character
+            for character in campaign.members
+            if not form._fields[f"remove_member_{character.id}"].data
+        ]
+        if form.new_character.data:
+            new_character = GameCharacter.query.get(form.new_character.data)
+            if (
+                new_character
+                and str(new_character.character.uid) == form.new_character_uid.data
+            ):
+                if new_character not in campaign.members:
+                    campaign.members.append(new_character)
+            else:
+                flash("That character ID and secret code don't match", "danger")
         db.session.add(campaign)
         db.session.commit()
         return redirect(url_for(".view_campaign", campaign_id=campaign_id))
 
-    filled_form = {
-        "name": campaign.name,
-        "character1": "" if campaign.character1 is None else campaign.character1,
-        "character2": "" if campaign.character2 is None else campaign.character2,
-        "character3": "" if campaign.character3 is None else campaign.character3,
-        "character4": "" if campaign.character4 is None else campaign.character4,
-        "character5": "" if campaign.character5 is None else campaign.character5,
-        "character6": "" if campaign.character6 is None else campaign.character6,
-    }
-    form = EditCampaignForm(formdata=MultiDict(filled_form))
+    form = ThisEditCampaignForm(formdata=MultiDict({"name": campaign.name}))
     return render_template(
         "edit_campaign.html",
         logged_in=True,
         form=form,
         campaign_id=campaign_id,
         campaign=campaign,
+        remove_members=[
+            form._fields[f"remove_member_{character.id}"]
+            for character in campaign.members
+        ],
     )
 
 
 @blueprint.route("/view/<campaign_id>")
 @login_required
 def view_campaign(campaign_id):
-    campaign = GameCampaign.query.get(campaign_id)
+    campaign = GameCampaign.query.options(db.selectinload(GameCampaign.members)).get(
+        campaign_id
+    )
     if campaign is None:
         abort(404)
     user_id = int(current_user.get_id())
     is_gamemaster = user_id == campaign.gamemaster
+    if not is_gamemaster and not campaign.has_member(user_id):
+        # none of this user's characters are invited to this campaign
+        abort(403)
 
     if is_gamemaster:
         # the gamemaster can edit every character
-        editable_characters = [
-            GameCharacter.query.get(char_id) if char_id is not None else char_id
-            for char_id in campaign.characters()
-        ]
+        editable_characters = campaign.members
         other_characters = []
     else:
-        # get list of characters belonging to this player
-        all_user_characters = GameCharacter.query.filter_by(user_id=user_id).all()
+        # split the party into characters belonging to this player and the rest
         editable_characters = []
-        other_characters = campaign.characters()
-        for db_character in all_user_characters:
-            if db_character.id in campaign.characters():
+        other_characters = []
+        for db_character in campaign.members:
+            if db_character.user_id == user_id:
                 editable_characters.append(db_character)
-                other_characters.remove(db_character.id)
-        if not editable_characters:
-            # none of this user's characters are invited to this campaign
-            abort(403)
-        other_characters = [
-            GameCharacter.query.get(char_id) if char_id is not None else char_id
-            for char_id in other_characters[:]
-        ]
+            else:
+                other_characters.append(db_character)
 
     characters = []
     for db_character in editable_characters:
-        if db_character is not None:
-            character = db_character.character
-            character.image = charimg.charimg(*list(db_character.design.values()))
-            character.dbid = db_character.id
-            characters.append(character)
+        character = db_character.character
+        character.image = charimg.charimg(*list(db_character.design.values()))
+        character.dbid = db_character.id
+        characters.append(character)
 
     for db_character in other_characters:
-        if db_character is not None:
-            db_character.image = charimg.charimg(*list(db_character.design.values()))
+        db_character.image = charimg.charimg(*list(db_character.design.values()))
 
     locations = []
     scenes = {}
     npcs = {}
     if is_gamemaster:
-        locations = CampaignLocation.query.filter_by(campaign_id=campaign_id).all()
-        scenes = {
-            location.id: LocationScene.query.filter_by(location_id=location.id).all()
-            for location in locations
-        }
+        locations = campaign.location_tree()
+        scenes = {location.id: location.scenes for location in locations}
         for scene_list in scenes.values():
             for scene in scene_list:
-                npcs[scene.id] = SceneNPC.query.filter_by(scene_id=scene.id).all()
+                npcs[scene.id] = scene.npcs
     next_page = f"?next={url_for('.view_campaign', campaign_id=campaign_id)}"
-    active_location = CampaignLocation.query.get(campaign.active_location)
     combat = campaign.get_combat()
-    combatants = [
-        SceneNPC.query.get(combatant.id)
-        if combatant.type == 1
-        else GameCharacter.query.get(combatant.id)
-        for combatant in combat.turn_sequence
-    ]
-    combat.turn_sequence = combatants
-    active_scene = LocationScene.query.get(combat.scene_id)
+    combat.turn_sequence = campaign.combatants(combat)
+    if is_gamemaster:
+        # the active location and scene are already loaded as part of the tree
+        active_location = next(
+            (
+                location
+                for location in locations
+                if location.id == campaign.active_location
+            ),
+            None,
+        )
+        active_scene = next(
+            (
+                scene
+                for scene_list in scenes.values()
+                for scene in scene_list
+                if scene.id == combat.scene_id
+            ),
+            None,
+        )
+    else:
+        active_location = CampaignLocation.query.get(campaign.active_location)
+        active_scene = None
 
     return render_template(
         "view_campaign.html",
@@ -192,11 +197,46 @@ def view_campaign(campaign_id):
         next_page=next_page,
         characters=characters,
         other_characters=other_characters,
+        portrait_sheet=charimg.SpriteSheet.for_page(
+            [character.image for character in characters]
+            + [character.image for character in other_characters]
+        ),
+        live_url=url_for(".live_campaign", campaign_id=campaign.id)
+        if live_updates.enabled
+        else None,
     )
 
 
+@blueprint.route("/live/<campaign_id>")
+@login_required
+def live_campaign(campaign_id):
+    """Streams the campaign's combat and active location/scene as Server-Sent Events"""
+    if not live_updates.enabled:
+        abort(404)
+    campaign = GameCampaign.query.get(campaign_id)
+    if campaign is None:
+        abort(404)
+    user_id = int(current_user.get_id())
+    if user_id != campaign.gamemaster and not campaign.has_member(user_id):
+        abort(403)
+    # anything published after this is sent after the current state
+    since = live_updates.last_id()
+    state = campaign.live_state()
+    if not live_updates.open_stream():
+        # the browser reconnects after its retry delay
+        return Response(status=503, headers={"Retry-After": "5"})
+    response = Response(
+        live_updates.stream(campaign.id, since, state),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(live_updates.close_stream)
+    return response
+
+
 @blueprint.route("/combat/<campaign_id>/toggle")
 @login_required
+@retry_on_conflict
 def toggle_combat(campaign_id):
     campaign = GameCampaign.query.get(campaign_id)
     if campaign is None:
@@ -208,9 +248,10 @@ def toggle_combat(campaign_id):
     if combat.scene_id == 0:
         abort(400)
     new_state = not combat.active
-    combat.active = new_state
-    campaign.combat_data = str(combat)
-    db.session.add(campaign)
+    if new_state:
+        campaign.start_combat(combat)
+    else:
+        campaign.end_combat(combat)
     db.session.commit()
     flash(
         "Combat has ended."
@@ -223,6 +264,7 @@ def toggle_combat(campaign_id):
 
 @blueprint.route("/combat/<campaign_id>/next")
 @login_required
+@retry_on_conflict
 def next_combat(campaign_id):
     campaign = GameCampaign.query.get(campaign_id)
     if campaign is None:
@@ -230,11 +272,101 @@ def next_combat(campaign_id):
     user_id = int(current_user.get_id())
     if user_id != campaign.gamemaster:
         abort(403)
-    combat = campaign.get_combat()
-    if combat.scene_id == 0 or not combat.active:
+    if not campaign.next_turn():
         abort(400)
-    combat.next()
-    campaign.combat_data = str(combat)
-    db.session.add(campaign)
     db.session.commit()
     return redirect(url_for(".view_campaign", campaign_id=campaign_id))
+
+
+@blueprint.route("/combat/<campaign_id>/undo")
+@login_required
+@retry_on_conflict
+def undo_combat(campaign_id):
+    campaign = GameCampaign.query.get(campaign_id)
+    if campaign is None:
+        abort(404)
+    user_id = int(current_user.get_id())
+    if user_id != campaign.gamemaster:
+        abort(403)
+    if not campaign.undo_combat():
+        flash("There is nothing to undo.", "info")
+    db.session.commit()
+    return redirect(url_for(".view_campaign", campaign_id=campaign_id))
+
+
+@blueprint.route("/combat/<campaign_id>/redo")
+@login_required
+@retry_on_conflict
+def redo_combat(campaign_id):
+    campaign = GameCampaign.query.get(campaign_id)
+    if campaign is None:
+        abort(404)
+    user_id = int(current_user.get_id())
+    if user_id != campaign.gamemaster:
+        abort(403)
+    if not campaign.redo_combat():
+        flash("There is nothing to redo.", "info")
+    db.session.commit()
+    return redirect(url_for(".view_campaign", campaign_id=campaign_id))
+
+
+@blueprint.route("/combat/<campaign_id>/replay", defaults={"round": 1})
+@blueprint.route("/combat/<campaign_id>/replay/<int:round>")
+@login_required
+def replay_combat(campaign_id, round):
+    """Replays a round of the campaign's latest combat, event by event"""
+    campaign = GameCampaign.query.get(campaign_id)
+    if campaign is None:
+        abort(404)
+    user_id = int(current_user.get_id())
+    if user_id != campaign.gamemaster and not campaign.has_member(user_id):
+        abort(403)
+    replay = campaign.combat_round(round)
+    if replay is None:
+        abort(404)
+    start, frames, rounds = replay
+    rows = campaign.combatant_rows(
+        {
+            (combatant.type, combatant.id)
+            for log in [start] + [log for event, log in frames]
+            for combatant in log.combat.turn_sequence
+        }
+    )
+    names = {key: row.name for key, row in rows.items()}
+    return render_template(
+        "replay_combat.html",
+        logged_in=True,
+        campaign=campaign,
+        round=round,
+        rounds=rounds,
+        start=start,
+        frames=[
+            (describe_combat_event(event.kind, event.as_dict(), names), log)
+            for event, log in frames
+        ],
+        names=names,
+    )
+
+
+def describe_combat_event(kind, data, names):
+    """Returns a sentence about an event in a combat log, for the replay"""
+
+    def name(combatant_type, combatant_id):
+        return names.get((combatant_type, combatant_id), "Someone who was deleted")
+
+    if kind in ("undo", "redo"):
+        action = describe_combat_event(data["kind"], data["data"], names)
+        return f"{kind.capitalize()}: {action}"
+    if kind == "start":
+        return "Combat began and initiative was rolled"
+    if kind == "end":
+        return "Combat ended"
+    if kind == "next":
+        return "Next turn"
+    if kind == "add":
+        return f"{name(data['type'], data['id'])} joined the combat"
+    if kind == "remove":
+        return f"{name(data['type'], data['id'])} left the combat"
+    if kind == "hp":
+        return f"{name(data['type'], data['id'])} went from {data['old']} to {data['new']} HP"
+    return "The scene changed"
@@ -6,10 +6,10 @@ from tabletop_story.models import (
     GameCampaign,
     CampaignLocation,
     LocationScene,
-    SceneNPC,
 )
 from tabletop_story.forms import GenericCreateForm, GenericEditForm, GenericForm
 from tabletop_story.plugins import db
+from tabletop_story.concurrency import retry_on_conflict
 from is_safe_url import is_safe_url
 
 
@@ -20,13 +20,23 @@ blueprint = Blueprint(
 
 @blueprint.route("/<campaign_id>/activate/<location_id>")
 @login_required
+@retry_on_conflict
 def activate_campaign_location_post(campaign_id, location_id):
-    return activate_campaign_location(campaign_id, location_id)
+    return change_campaign_location(campaign_id, location_id)
 
 
 @blueprint.route("/<campaign_id>/activate", methods=["GET", "POST"])
 @login_required
+@retry_on_conflict
 def activate_campaign_location(campaign_id, location_id=None):
+    return change_campaign_location(campaign_id, location_id)
+
+
+def change_campaign_location(campaign_id, location_id=None):
+    """
+    The body of the activate_campaign_location views, without their retries,
+    so views which call it are retried as a whole rather than within each other
+    """
     campaign = GameCampaign.query.get(campaign_id)
     user_id = int(current_user.get_id())
     if campaign is None:
@@ -188,6 +198,7 @@ def view_campaign_location(location_id):
 
 @blueprint.route("/delete/<location_id>", methods=["GET", "POST"])
 @login_required
+@retry_on_conflict
 def delete_campaign_location(location_id):
     location = CampaignLocation.query.get(location_id)
     if location is None:
@@ -202,12 +213,9 @@ def delete_campaign_location(location_id):
     if form.validate_on_submit():
         combat = campaign.get_combat()
         if campaign.active_location == location_id:
-            activate_campaign_location_post(campaign.id, location_id)
+            change_campaign_location(campaign.id, location_id)
+        # its scenes and their NPCs are deleted with it
         db.session.delete(location)
-        for scene in LocationScene.query.filter_by(location_id=location_id).all():
-            for npc in SceneNPC.query.filter_by(scene_id=scene.id).all():
-                db.session.delete(npc)
-            db.session.delete(scene)
         db.session.commit()
         return redirect(url_for("campaign.view_campaign", campaign_id=campaign.id))
 
@@ -9,6 +9,7 @@ from flask import (
     abort,
     make_response,
     jsonify,
+    send_from_directory,
 )
 import flask_login
 from wtforms import BooleanField, SelectField, IntegerField
@@ -17,7 +18,7 @@ from werkzeug.datastructures import MultiDict
 import logging
 from is_safe_url import is_safe_url
 
-from tabletop_story.models import User, GameCharacter, GameCampaign
+from tabletop_story.models import User, GameCharacter, GameCampaign, campaign_member
 from tabletop_story.forms import (
     EditCharacterForm,
     DeleteCharacterForm,
@@ -27,14 +28,31 @@ from tabletop_story.forms import (
 )
 from tabletop_story.routes import ability_modifier
 from tabletop_story.plugins import db
-from .charimg import charimg
+from tabletop_story.concurrency import retry_on_conflict
+from tabletop_story.dnd_campaign import CHARACTER_TYPE
+from tabletop_story.srd import (
+    SPELLS,
+    EQUIPMENT,
+    thaw,
+    spell_keys,
+    spell_choices,
+    spell_name,
+)
+from .charimg import (
+    charimg,
+    design_from_portrait_name,
+    portrait_cache,
+    PORTRAIT_SIZES,
+    ENCODINGS,
+    SpriteSheet,
+)
 from dnd_character import Character
 from dnd_character.classes import CLASSES
-from dnd_character.spellcasting import spells_for_class_level, SRD_spells
-from dnd_character.equipment import SRD_equipment
 
 
 LOG = logging.getLogger(__package__)
+# for responses whose URL changes whenever their content does
+IMMUTABLE = "public, max-age=31536000, immutable"
 
 
 blueprint = Blueprint(
@@ -66,23 +84,14 @@ def validate_character_view(character_id, allow_gamemaster=True, abort=abort):
     elif db_character.user_id != user_id:
         if not allow_gamemaster:
             abort(403)
-        campaigns = GameCampaign.query.filter_by(gamemaster=user_id).all()
-        if not campaigns:
-            abort(403)
         # This user does not own the character. Check if the user is a relevant gamemaster
-        for campaign in campaigns:
-            if any(
-                [
-                    campaign.character1 == character_id,
-                    campaign.character2 == character_id,
-                    campaign.character3 == character_id,
-                    campaign.character4 == character_id,
-                    campaign.character5 == character_id,
-                    campaign.character6 == character_id,
-                ]
-            ):
-                break
-        else:
+        campaign = (
+            GameCampaign.query.filter_by(gamemaster=user_id)
+            .join(campaign_member)
+            .filter(campaign_member.c.character_id == character_id)
+            .first()
+        )
+        if campaign is None:
             abort(403)
     return user_id, db_character
 
@@ -114,8 +123,7 @@ def create_character_chosen(class_key):
     db_char = GameCharacter(
         user_id=int(flask_login.current_user.get_id()),
         name=new_char.name,
-        data_keys=str(new_char.keys()),
-        data_vals=str(new_char.values()),
+        data=dict(new_char),
     )
     db.session.add(db_char)
     db.session.commit()
@@ -125,6 +133,7 @@ def create_character_chosen(class_key):
 
 @blueprint.route("/delete/<character_id>", methods=["GET", "POST"])
 @flask_login.login_required
+@retry_on_conflict
 def delete_character(character_id):
     user_id, db_character = validate_character_view(
         character_id, allow_gamemaster=False
@@ -150,6 +159,7 @@ def delete_character(character_id):
 )
 @blueprint.route("/edit/<character_id>/<selected_field>", methods=["GET", "POST"])
 @flask_login.login_required
+@retry_on_conflict
 def edit_character(character_id, selected_field, autosubmit=False):
     user_id, db_character = validate_character_view(character_id)
 
@@ -180,18 +190,12 @@ def edit_character(character_id, selected_field, autosubmit=False):
             if "cantrips_known" in data["class_spellcasting"]:
                 cantrips = data["class_spellcasting"]["cantrips_known"]
                 for i in range(cantrips):
-                    available_cantrips = list(
-                        spells_for_class_level(data["class_index"], 0)
-                    )
                     setattr(
                         ThisEditCharacterForm,
                         f"spells_known_lvl0_{i}",
                         SelectField(
                             f"Cantrip #{str(i+1)}",
-                            choices=[
-                                (spell_name, SRD_spells[spell_name]["name"])
-                                for spell_name in available_cantrips
-                            ],
+                            choices=spell_choices(data["class_index"], 0),
                         ),
                     )
             for spell_level in range(1, 10):
@@ -210,12 +214,7 @@ def edit_character(character_id, selected_field, autosubmit=False):
                         label,
                         SelectField(
                             f"Level {spell_level} Spell Slot #{str(spell_num+1)}",
-                            choices=[
-                                (spell_name, SRD_spells[spell_name]["name"])
-                                for spell_name in spells_for_class_level(
-                                    data["class_index"], spell_level
-                                )
-                            ],
+                            choices=spell_choices(data["class_index"], spell_level),
                         ),
                     )
         return ThisEditCharacterForm, cantrips, spell_slots
@@ -346,24 +345,21 @@ def edit_character(character_id, selected_field, autosubmit=False):
                 chosen_spell = character.spells_known[int(spell_level)][int(spell_num)]
             except (KeyError, TypeError, IndexError):
                 # default value for blank spell slots
-                chosen_spell = list(
-                    spells_for_class_level(character.class_index, int(spell_level))
-                )[int(spell_num)]
+                chosen_spell = spell_keys(character.class_index, int(spell_level))[
+                    int(spell_num)
+                ]
 
-            filled_form[spell_slot] = (chosen_spell, SRD_spells[chosen_spell]["name"])
+            filled_form[spell_slot] = (chosen_spell, spell_name(chosen_spell))
         if cantrips:
-            available_cantrips = list(spells_for_class_level(data["class_index"], 0))
+            available_cantrips = spell_choices(data["class_index"], 0)
             filled_form.update(
                 {
-                    f"spells_known_lvl0_{i}": (
-                        available_cantrips[i],
-                        SRD_spells[available_cantrips[i]]["name"],
-                    )
+                    f"spells_known_lvl0_{i}": available_cantrips[i]
                     if character.spells_known is None
                     or i >= len(character.spells_known[0])
                     else (
                         character.spells_known[0][i],
-                        SRD_spells[character.spells_known[0][i]]["name"],
+                        spell_name(character.spells_known[0][i]),
                     )
                     for i in range(cantrips)
                 }
@@ -389,11 +385,15 @@ def edit_character(character_id, selected_field, autosubmit=False):
         is_safe_url(next_page, url_for("dashboard.index"))
     if autosubmit or (request.method == "POST" and form.validate_on_submit()):
         # Now we have a valid dict to make a new Character
+        old_hp = data["hp"]
         data, design = extract_and_apply_edit_character_form(
             form, data, autosubmit=True
         )
         db_character.name = form.name.data
         db_character.update_data(data)
+        GameCampaign.record_hp_change(
+            CHARACTER_TYPE, db_character.id, old_hp, data["hp"]
+        )
         db_character.visual_design = str(design)
         db.session.add(db_character)
         db.session.commit()
@@ -435,8 +435,82 @@ def edit_character(character_id, selected_field, autosubmit=False):
 
 @blueprint.route("/img", methods=["POST"])
 def get_charimg():
-    data = request.get_json()
-    response = make_response(jsonify(charimg(*data)), 200)
+    """Returns URL of the portrait for a visual design which is being edited"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        abort(400)
+    try:
+        name = charimg(*data)
+    except ValueError:
+        abort(400)
+    response = make_response(
+        jsonify(url_for("character.view_portrait", name=name, size="medium")), 200
+    )
+    return response
+
+
+@blueprint.route("/portrait/<name>")
+def view_portrait(name):
+    """
+    Serves a portrait in the ?size= requested, as WebP if the browser says it
+    accepts WebP. The name changes with the design and the artwork, so the
+    response can be cached forever
+    """
+    design = design_from_portrait_name(name)
+    size = request.args.get("size", "full")
+    if design is None or size not in PORTRAIT_SIZES:
+        abort(404)
+    encoding = accepted_image_encoding()
+    return send_image(*portrait_cache.get(design, size, encoding), encoding)
+
+
+@blueprint.route("/portraits")
+@flask_login.login_required
+def view_sprite_sheet():
+    """
+    Serves the portraits of the sprite sheet signed into ?sheet= side by side
+    in one image, negotiated and cached like view_portrait
+    """
+    sheet = requested_sprite_sheet()
+    encoding = accepted_image_encoding()
+    return send_image(*portrait_cache.get_sprite_sheet(sheet, encoding), encoding)
+
+
+@blueprint.route("/portraits.json")
+@flask_login.login_required
+def get_sprite_sheet_offsets():
+    """Returns the URL of a sprite sheet and each portrait's rectangle in it"""
+    sheet = requested_sprite_sheet()
+    response = jsonify(url=sheet.url(), offsets=sheet.offsets())
+    response.headers["Cache-Control"] = IMMUTABLE
+    return response
+
+
+def requested_sprite_sheet():
+    try:
+        return SpriteSheet.from_token(request.args.get("sheet", ""))
+    except ValueError:
+        abort(404)
+
+
+def accepted_image_encoding():
+    """Returns "webp" if the request explicitly accepts WebP, otherwise "png" """
+    # not */*, because that is sent by browsers which can't show WebP
+    return (
+        "webp"
+        if any(
+            mimetype == ENCODINGS["webp"] and quality > 0
+            for mimetype, quality in request.accept_mimetypes
+        )
+        else "png"
+    )
+
+
+def send_image(directory, filename, encoding):
+    """Sends an image whose URL changes with its content, so it's cached forever"""
+    response = send_from_directory(directory, filename, mimetype=ENCODINGS[encoding])
+    response.headers["Cache-Control"] = IMMUTABLE
+    response.vary.add("Accept")
     return response
 
 
@@ -470,7 +544,7 @@ def view_character(character_id):
         can_edit=can_edit,
         character_id=character_id,
         character_img=charimg(*list(db_character.design.values())),
-        spells=SRD_spells,
+        spells=SPELLS,
         spell_levels=0
         if character.spells_known is None
         else len(character.spells_known)
@@ -568,6 +642,7 @@ def view_character(character_id):
 
 @blueprint.route("/edit/<character_id>/inventory", methods=["GET", "POST"])
 @flask_login.login_required
+@retry_on_conflict
 def edit_character_inventory(character_id):
     user_id, db_character = validate_character_view(character_id)
     character = db_character.character
@@ -596,7 +671,7 @@ def edit_character_inventory(character_id):
             processed = True
 
         if add_form.submit_add.data and add_form.validate_on_submit():
-            character.giveItem(SRD_equipment[add_form.new_item.data])
+            character.giveItem(thaw(EQUIPMENT[add_form.new_item.data]))
             processed = True
 
         if processed:
@@ -628,11 +703,12 @@ def edit_character_inventory(character_id):
 
 @blueprint.route("/edit/<character_id>/exp", methods=["GET", "POST"])
 @flask_login.login_required
+@retry_on_conflict
 def edit_character_choose_experience(character_id):
     user_id, db_character = validate_character_view(character_id)
     form = EditCharacterExperienceForm()
     if form.validate_on_submit():
-        return edit_character_experience(character_id, form.experience.data)
+        return change_character_experience(character_id, form.experience.data)
 
     return render_template(
         "edit_character_exp.html",
@@ -644,7 +720,13 @@ def edit_character_choose_experience(character_id):
 
 @blueprint.route("/edit/<character_id>/exp/<number>")
 @flask_login.login_required
+@retry_on_conflict
 def edit_character_experience(character_id, number):
+    return change_character_experience(character_id, number)
+
+
+def change_character_experience(character_id, number):
+    """The body of the experience views, without their retries"""
     user_id, db_character = validate_character_view(character_id)
     char = db_character.character
     difference = char.max_hp - char.hp
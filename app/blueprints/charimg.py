@@ -1,40 +1,530 @@
+"""
+Character portraits composited from the layers in static/img/character,
+and a bounded cache of the results on disk which is shared by every worker
+"""
 from PIL import Image
-from functools import lru_cache
+from flask import url_for, current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+from flask.cli import AppGroup
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from tabletop_story.metrics import metrics
+import click
+import fcntl
+import hashlib
+import itertools
+import json
+import logging
 import os
+import re
+import tempfile
+import time
+
+
+LOG = logging.getLogger(__package__)
 
 
 path = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "..", "static", "img", "character"
 )
+# the layers exported from character.svg, as opposed to generated portraits
+LAYER_FILENAME = re.compile(r"(body[0-9]+|(head|face|hair|hat)[a-z]+)\.png")
+# the order of a visual design's values, and of the layers from bottom to top
+LAYER_SLOTS = ("body", "head", "face", "hair", "hat")
+# (width, height) of each size of portrait, chosen with ?size= in their URL
+PORTRAIT_SIZES = {"full": (480, 640), "medium": (240, 320), "small": (120, 160)}
+# mimetype of each encoding, in order of preference
+ENCODINGS = {"webp": "image/webp", "png": "image/png"}
+PORTRAIT_NAME = re.compile(
+    r"([0-9]+)-([a-z]+|None)-([a-z]+|None)-([a-z]+|None)-([a-z]+|None)"
+    r"-([0-9a-f]{10})\.png"
+)
 
 
-def open_image(name):
-    return Image.open(
-        os.path.join(
-            path,
-            name,
-        )
+class LayerAtlas:
+    """
+    Every layer of the character portraits decoded into RGBA once per process,
+    so portraits are composited in memory. Loading it in init_app
+    (CHARIMG_PRELOAD) lets uWSGI's workers share the pixels after forking
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.version = None
+        self._layers = None
+        self._lock = Lock()
+
+    def load(self):
+        """Returns dict of layer name to Image, decoding the PNGs the first time"""
+        with self._lock:
+            if self._layers is None:
+                layers = {}
+                digest = hashlib.sha1()
+                for filename in sorted(os.listdir(self.directory)):
+                    if LAYER_FILENAME.fullmatch(filename):
+                        with open(os.path.join(self.directory, filename), "rb") as f:
+                            digest.update(filename.encode("utf-8") + f.read())
+                            f.seek(0)
+                            with Image.open(f) as image:
+                                layers[filename[:-4]] = image.convert("RGBA")
+                # changes when the artwork does, so it's part of portrait names
+                self.version = digest.hexdigest()[:10]
+                self._layers = layers
+        return self._layers
+
+    def __getitem__(self, name):
+        return self.load()[name]
+
+    def __contains__(self, name):
+        return name in self.load()
+
+    def composite(self, names):
+        """Returns new Image of the named layers pasted over the first in order"""
+        image = self[names[0]].copy()
+        for name in names[1:]:
+            layer = self[name]
+            image.paste(layer, (0, 0), layer)
+        return image
+
+
+layer_atlas = LayerAtlas(path)
+
+
+def design_values(values):
+    """
+    Receives the values of a visual design (body, head, face, hair and hat)
+    and returns them as a tuple of strings, raising ValueError if any of them
+    isn't a layer of that kind. Only the body is required
+    """
+    values = tuple(values)
+    if len(values) != len(LAYER_SLOTS):
+        raise ValueError(f"A design has {len(LAYER_SLOTS)} values, not {len(values)}")
+    checked = []
+    for slot, value in zip(LAYER_SLOTS, values):
+        if value is None:
+            value = "None"
+        if type(value) not in (str, int):
+            raise ValueError(f"Invalid {slot}: {value!r}")
+        value = str(value)
+        if slot == "body":
+            valid = value.isdigit() and f"body{value}" in layer_atlas
+        else:
+            valid = value == "None" or (value.startswith(slot) and value in layer_atlas)
+        if not valid:
+            raise ValueError(f"Invalid {slot}: {value!r}")
+        checked.append(value)
+    return tuple(checked)
+
+
+def portrait_name(values):
+    """Receives values from design_values and returns the portrait's filename"""
+    layer_atlas.load()
+    return f"{'-'.join(values)}-{layer_atlas.version}.png"
+
+
+def design_from_portrait_name(name):
+    """Returns design_values of a current portrait's filename, or None"""
+    match = PORTRAIT_NAME.fullmatch(name)
+    if match is None or match.group(6) != layer_atlas.version:
+        return None
+    try:
+        return design_values(match.groups()[:5])
+    except ValueError:
+        return None
+
+
+def composite_portrait(values):
+    """Returns new Image of the portrait of values from design_values"""
+    return layer_atlas.composite(
+        [f"body{values[0]}", *(value for value in values[1:] if value != "None")]
     )
 
 
-@lru_cache
+def variant_filename(name, size, encoding):
+    """Returns filename of a portrait in one of PORTRAIT_SIZES and ENCODINGS"""
+    return f"{name[: -len('.png')]}-{size}.{encoding}"
+
+
+def render_portrait(values, size):
+    """Returns new palette Image of the portrait of values from design_values"""
+    image = composite_portrait(values)
+    if size != "full":
+        image = image.resize(PORTRAIT_SIZES[size], Image.Resampling.LANCZOS)
+    # the artwork is flat colours, so a palette is barely different and
+    # makes files a quarter of the size
+    return image.quantize(256, method=Image.Quantize.FASTOCTREE)
+
+
+def render_sprite_sheet(designs, size):
+    """Returns new Image of the portraits of the designs side by side"""
+    width, height = PORTRAIT_SIZES[size]
+    sheet = Image.new("RGBA", (width * len(designs), height))
+    for i, values in enumerate(designs):
+        sheet.paste(render_portrait(values, size).convert("RGBA"), (width * i, 0))
+    return sheet
+
+
+def encode_image(image, encoding, f):
+    """Writes an image from render_portrait or render_sprite_sheet into the file"""
+    if encoding == "webp":
+        image.convert("RGBA").save(f, format="WEBP", lossless=True)
+    else:
+        if image.mode != "P":
+            image = image.quantize(256, method=Image.Quantize.FASTOCTREE)
+        image.save(f, format="PNG", optimize=True)
+
+
+def save_file(directory, name, write):
+    """
+    Calls write() with a temporary file in the directory, then renames it to
+    name, so nothing ever reads a file which is only partly written
+    """
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, os.path.join(directory, name))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class PortraitCache:
+    """
+    Portraits saved in PORTRAIT_CACHE_DIR, named after their layers, the
+    version of the artwork, their size and encoding. Each file is written to a
+    temporary file and renamed into place while holding a file lock for its
+    name, so workers never encode the same file at once or serve half of one.
+    The oldest files are deleted when the total passes PORTRAIT_CACHE_MB;
+    a file's mtime is bumped when it's used, at most once per TOUCH_SECONDS.
+    Portraits in the manifest of PORTRAIT_PREGENERATED_DIR are never composited
+    """
+
+    MANIFEST = "manifest.json"
+
+    # lock files are shared by names with the same hash prefix, to bound them
+    LOCK_STRIPES = 256
+    TOUCH_SECONDS = 3600
+
+    def __init__(self, directory=None, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.pregenerated_directory = None
+        self.pregenerated = frozenset()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        # absolute, because Flask sends relative paths from the package
+        self.directory = os.path.abspath(app.config["PORTRAIT_CACHE_DIR"])
+        self.max_bytes = app.config["PORTRAIT_CACHE_MB"] * 1024 * 1024
+        self.pregenerated_directory = os.path.abspath(
+            app.config["PORTRAIT_PREGENERATED_DIR"]
+        )
+        self.load_manifest()
+
+    def load_manifest(self):
+        """Reads the names of the pregenerated portraits of the current artwork"""
+        try:
+            with open(os.path.join(self.pregenerated_directory, self.MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            self.pregenerated = frozenset()
+            return
+        layer_atlas.load()
+        if manifest["version"] != layer_atlas.version:
+            LOG.warning("Pregenerated portraits are out of date with the artwork")
+            self.pregenerated = frozenset()
+            return
+        self.pregenerated = frozenset(manifest["portraits"])
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def lock_path(self, filename):
+        stripe = int(hashlib.sha1(filename.encode("utf-8")).hexdigest(), 16)
+        return os.path.join(
+            self.directory, ".locks", f"{stripe % self.LOCK_STRIPES}.lock"
+        )
+
+    def get(self, values, size="full", encoding="png"):
+        """
+        Receives values from design_values and returns tuple of the directory
+        and filename of their portrait, compositing it first if needed
+        """
+        name = portrait_name(values)
+        filename = variant_filename(name, size, encoding)
+        if name in self.pregenerated:
+            self.hits += 1
+            return self.pregenerated_directory, filename
+        self._get_file(
+            filename,
+            lambda f: encode_image(render_portrait(values, size), encoding, f),
+        )
+        return self.directory, filename
+
+    def get_sprite_sheet(self, sheet, encoding="png"):
+        """
+        Receives a SpriteSheet and returns tuple of the directory and filename
+        of its image, compositing it first if needed
+        """
+        filename = f"{sheet.key}.{encoding}"
+        self._get_file(
+            filename,
+            lambda f: encode_image(
+                render_sprite_sheet(sheet.designs, sheet.size), encoding, f
+            ),
+        )
+        return self.directory, filename
+
+    def _get_file(self, filename, write):
+        """Calls write() with a new file of this name unless it's already saved"""
+        if self._touch(filename):
+            self.hits += 1
+            return
+        os.makedirs(os.path.join(self.directory, ".locks"), exist_ok=True)
+        with open(self.lock_path(filename), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # another worker may have made it while this one waited
+                if self._touch(filename):
+                    self.hits += 1
+                    return
+                self.misses += 1
+                save_file(self.directory, filename, write)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        metrics.increment("tabletop_charimg_generated_total")
+        self.evict()
+
+    def _touch(self, filename):
+        """Returns True if the file exists, marking it as recently used"""
+        try:
+            mtime = os.stat(self.path(filename)).st_mtime
+        except FileNotFoundError:
+            return False
+        if time.time() - mtime > self.TOUCH_SECONDS:
+            try:
+                os.utime(self.path(filename))
+            except FileNotFoundError:
+                return False
+        return True
+
+    def evict(self):
+        """
+        Deletes the least recently used files until the cache fits in
+        max_bytes, and temporary files abandoned by a worker that died
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".tmp"):
+                    if time.time() - stat.st_mtime > 60:
+                        self._remove(entry.name)
+                    continue
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+                total += stat.st_size
+        entries.sort()
+        for _, filename, size in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(filename)
+            total -= size
+
+    def _remove(self, filename):
+        try:
+            os.remove(self.path(filename))
+        except FileNotFoundError:
+            pass
+
+
+portrait_cache = PortraitCache()
+
+
+class SpriteSheet:
+    """
+    Portraits side by side in one image, so a page with many characters makes
+    one request for all of them. Its key is a hash of the portraits' names,
+    which already change with the artwork, so the sheet can be cached forever.
+    Its URL has the names signed by the server, so only sheets which a page
+    chose are ever composited
+    """
+
+    # portraits in one sheet, which keeps sheets narrower than WebP's limit
+    LIMIT = 32
+
+    def __init__(self, names, size="medium"):
+        """Receives names from portrait_name, raising ValueError if any are invalid"""
+        # each portrait once, in the order they first appear
+        self.names = tuple(dict.fromkeys(names))
+        if not self.names or len(self.names) > self.LIMIT:
+            raise ValueError(f"A sprite sheet has 1 to {self.LIMIT} portraits")
+        if size not in PORTRAIT_SIZES:
+            raise ValueError(f"Invalid size: {size!r}")
+        self.size = size
+        self.designs = []
+        for name in self.names:
+            values = design_from_portrait_name(name)
+            if values is None:
+                raise ValueError(f"Invalid portrait: {name!r}")
+            self.designs.append(values)
+        digest = hashlib.sha1("/".join(self.names).encode("utf-8")).hexdigest()
+        self.key = f"sheet-{digest[:20]}-{size}"
+
+    def offsets(self):
+        """Returns dict of each portrait's name to its rectangle in the sheet"""
+        width, height = PORTRAIT_SIZES[self.size]
+        return {
+            name: {"x": width * i, "y": 0, "width": width, "height": height}
+            for i, name in enumerate(self.names)
+        }
+
+    def style(self, name):
+        """
+        Returns CSS to show one portrait from the sheet as the background of
+        an element with the portrait's aspect ratio, at any width
+        """
+        i = self.names.index(name)
+        count = len(self.names)
+        position = 0 if count == 1 else i * 100 / (count - 1)
+        return (
+            f"background-image: url({self.url()}); "
+            f"background-size: {count * 100}% 100%; "
+            f"background-position: {position:g}% 0"
+        )
+
+    @classmethod
+    def for_page(cls, names, size="medium"):
+        """Returns SpriteSheet of the names, or None if there are none or too many"""
+        try:
+            return cls(names, size)
+        except ValueError:
+            return None
+
+    @classmethod
+    def from_token(cls, token):
+        """Receives a token from SpriteSheet.token, raising ValueError if it's invalid"""
+        try:
+            names, size = sprite_sheet_serializer().loads(token)
+            return cls(names, size)
+        except (BadSignature, TypeError, ValueError):
+            raise ValueError("Invalid sprite sheet")
+
+    def token(self):
+        """Returns the signed names and size of this sheet, the same every time"""
+        return sprite_sheet_serializer().dumps([list(self.names), self.size])
+
+    def url(self, endpoint="character.view_sprite_sheet"):
+        return url_for(endpoint, sheet=self.token())
+
+
+def sprite_sheet_serializer():
+    return URLSafeSerializer(current_app.secret_key, salt="sprite-sheet")
+
+
 def charimg(*args):
-    args = list(args)
-    save_path = (
-        f"{''.join([arg if type(arg) != int else f'body{arg}' for arg in args])}.png"
+    """
+    Receives the values of a visual design and returns the name of its
+    portrait for the character.view_portrait URL, which makes the portrait
+    when it's first requested. Raises ValueError for an invalid design
+    """
+    return portrait_name(design_values(args))
+
+
+def all_designs():
+    """Returns iterator of design_values of every design the character form offers"""
+    layers = layer_atlas.load()
+
+    def named(slot):
+        return sorted(name for name in layers if name.startswith(slot))
+
+    return itertools.product(
+        sorted((name[len("body") :] for name in named("body")), key=int),
+        named("head"),
+        named("face"),
+        named("hair") + ["None"],
+        named("hat") + ["None"],
+    )
+
+
+def all_variants(name):
+    """Returns list of the filenames of every size and encoding of a portrait"""
+    return [
+        variant_filename(name, size, encoding)
+        for size in PORTRAIT_SIZES
+        for encoding in ENCODINGS
+    ]
+
+
+def pregenerate_portrait(values, directory):
+    name = portrait_name(values)
+    for size in PORTRAIT_SIZES:
+        for encoding in ENCODINGS:
+            save_file(
+                directory,
+                variant_filename(name, size, encoding),
+                lambda f: encode_image(render_portrait(values, size), encoding, f),
+            )
+    return name
+
+
+def pregenerate(directory, processes=None, force=False):
+    """
+    Composites every design from all_designs() in every size and encoding into
+    the directory across a process pool, deletes portraits of older artwork
+    and writes the manifest. Returns tuple of the number of portraits made
+    and the number in total
+    """
+    # loaded before the pool forks, so its processes start with the layers
+    layer_atlas.load()
+    os.makedirs(directory, exist_ok=True)
+    designs = {portrait_name(values): values for values in all_designs()}
+    filenames = {filename for name in designs for filename in all_variants(name)}
+    existing = set(os.listdir(directory))
+    todo = [
+        values
+        for name, values in designs.items()
+        if force or not existing.issuperset(all_variants(name))
+    ]
+    with ProcessPoolExecutor(processes) as pool:
+        for _ in pool.map(
+            pregenerate_portrait,
+            todo,
+            itertools.repeat(directory),
+            chunksize=16,
+        ):
+            pass
+    for filename in os.listdir(directory):
+        if filename != PortraitCache.MANIFEST and filename not in filenames:
+            os.remove(os.path.join(directory, filename))
+    manifest = {"version": layer_atlas.version, "portraits": sorted(designs)}
+    save_file(
+        directory,
+        PortraitCache.MANIFEST,
+        lambda f: f.write(json.dumps(manifest, indent=0).encode("utf-8")),
+    )
+    return len(todo), len(designs)
+
+
+portraits_cli = AppGroup("portraits", help="Manage the character portraits")
+
+
+@portraits_cli.command("pregenerate")
+@click.option("--processes", type=int, help="defaults to the number of CPUs")
+@click.option("--force", is_flag=True, help="composite existing portraits again")
+def pregenerate_command(processes, force):
+    """Composite every portrait into PORTRAIT_PREGENERATED_DIR"""
+    start = time.perf_counter()
+    made, total = pregenerate(portrait_cache.pregenerated_directory, processes, force)
+    click.echo(
+        f"Made {made} of {total} portraits in {time.perf_counter() - start:.1f}s. "
+        "Restart the server to use them"
     )
-    if os.path.exists(os.path.join(path, save_path)):
-        return save_path
-
-    # make image if it doesn't exist yet
-    images = []
-    for arg in args:
-        if arg is not None and arg != "None":
-            if arg.isdigit():
-                body_image = open_image(f"body{arg}.png")
-            else:
-                images.append(open_image(f"{arg}.png"))
-    for image in images:
-        body_image.paste(image, (0, 0), image)
-    body_image.save(os.path.join(path, save_path))
-    return save_path
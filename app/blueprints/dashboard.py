@@ -51,24 +51,14 @@ def index():
         for i, character in enumerate(characters):
             character.image = charimg.charimg(*list(db_characters[i].design.values()))
             character.dbid = db_characters[i].id
-        for character in db_characters:
-            campaigns_ = (
-                GameCampaign.query.filter_by(character1=character.id).first(),
-                GameCampaign.query.filter_by(character2=character.id).first(),
-                GameCampaign.query.filter_by(character3=character.id).first(),
-                GameCampaign.query.filter_by(character4=character.id).first(),
-                GameCampaign.query.filter_by(character5=character.id).first(),
-                GameCampaign.query.filter_by(character6=character.id).first(),
-            )
-            for campaign in campaigns_:
-                if campaign is not None:
-                    campaigns.append(campaign)
-        gm_campaigns = GameCampaign.query.filter_by(gamemaster=user_id).all()
-        campaigns.extend([] if gm_campaigns is None else gm_campaigns)
+        campaigns = GameCampaign.query_for_user(user_id).all()
 
     return render_template(
         "dashboard.html",
         logged_in=is_logged_in,
         characters=characters,
-        campaigns=set(campaigns),
+        campaigns=campaigns,
+        portrait_sheet=charimg.SpriteSheet.for_page(
+            [character.image for character in characters]
+        ),
     )
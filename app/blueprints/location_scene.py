@@ -10,7 +10,8 @@ from tabletop_story.models import (
 )
 from tabletop_story.forms import GenericCreateForm, GenericEditForm, GenericForm
 from tabletop_story.plugins import db
-from .campaign_location import activate_campaign_location_post
+from tabletop_story.concurrency import retry_on_conflict
+from .campaign_location import change_campaign_location
 from is_safe_url import is_safe_url
 
 
@@ -21,7 +22,16 @@ blueprint = Blueprint(
 
 @blueprint.route("/<location_id>/activate/<scene_id>")
 @login_required
+@retry_on_conflict
 def activate_location_scene_post(location_id, scene_id):
+    return change_scene_and_location(location_id, scene_id)
+
+
+def change_scene_and_location(location_id, scene_id):
+    """
+    The body of activate_location_scene_post without its retries, which also
+    makes the scene's location active (see change_campaign_location)
+    """
     location = CampaignLocation.query.get(location_id)
     if location is not None:
         campaign = GameCampaign.query.get(location.campaign_id)
@@ -29,13 +39,19 @@ def activate_location_scene_post(location_id, scene_id):
             scene = LocationScene.query.get(scene_id)
             scene = 0 if scene is None else scene.location_id
             if campaign.active_location != scene:
-                activate_campaign_location_post(campaign.id, location_id)
-    return activate_location_scene(location_id, scene_id)
+                change_campaign_location(campaign.id, location_id)
+    return change_location_scene(location_id, scene_id)
 
 
 @blueprint.route("/<location_id>/activate", methods=["GET", "POST"])
 @login_required
+@retry_on_conflict
 def activate_location_scene(location_id, scene_id=None):
+    return change_location_scene(location_id, scene_id)
+
+
+def change_location_scene(location_id, scene_id=None):
+    """The body of the activate_location_scene views, without their retries"""
     location = CampaignLocation.query.get(location_id)
     if location is None:
         abort(404)
@@ -70,17 +86,7 @@ def activate_location_scene(location_id, scene_id=None):
     if scene_id is not None or form.validate_on_submit():
         if request.method == "POST":
             scene_id = form.scene.data
-        characters = []
-        for c in (
-            campaign.character1,
-            campaign.character2,
-            campaign.character3,
-            campaign.character4,
-            campaign.character5,
-            campaign.character6,
-        ):
-            if c is not None:
-                characters.append(c)
+        characters = campaign.characters()
         combat = campaign.get_combat()
         if combat.active:
             flash("Combat ended because the active scene changed.", "danger")
@@ -213,6 +219,7 @@ def view_location_scene(scene_id):
 
 @blueprint.route("/delete/<scene_id>", methods=["GET", "POST"])
 @login_required
+@retry_on_conflict
 def delete_location_scene(scene_id):
     scene = LocationScene.query.get(scene_id)
     if scene is None:
@@ -230,10 +237,9 @@ def delete_location_scene(scene_id):
     if form.validate_on_submit():
         combat = campaign.get_combat()
         if combat.scene_id == scene_id:
-            activate_location_scene_post(scene.location_id, scene_id)
+            change_scene_and_location(scene.location_id, scene_id)
+        # its NPCs are deleted with it
         db.session.delete(scene)
-        for npc in SceneNPC.query.filter_by(scene_id=scene_id).all():
-            db.session.delete(npc)
         db.session.commit()
         return redirect(
             url_for("campaign/location.view_campaign_location", location_id=location.id)
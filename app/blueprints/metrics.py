@@ -0,0 +1,24 @@
+"""
+Prometheus endpoint for the metrics shared by all worker processes
+"""
+from flask import Blueprint, abort, make_response, request
+from flask_login import current_user
+from tabletop_story.metrics import metrics
+
+
+blueprint = Blueprint("metrics", __name__)
+
+LOOPBACK = ("127.0.0.1", "::1")
+
+
+@blueprint.route("")
+def prometheus():
+    """Scrapeable from the server itself, or by an administrator"""
+    if not metrics.enabled:
+        abort(404)
+    if request.remote_addr not in LOOPBACK and not current_user.is_admin_authenticated:
+        abort(403)
+    response = make_response(metrics.render(), 200)
+    response.mimetype = "text/plain"
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
@@ -1,33 +1,38 @@
 from flask import Blueprint, render_template, abort, jsonify
 from flask_login import current_user
-from dnd_character.monsters import SRD_monsters
+from tabletop_story.srd import MONSTERS, thaw
+from tabletop_story.cache import card_response
+from tabletop_story.http_caching import srd_cacheable
 
 
 blueprint = Blueprint("monsters", __name__, template_folder="../templates/monsters")
 
 
 @blueprint.route("/view/<monster>")
+@srd_cacheable(html=True)
 def view_monster(monster):
-    if monster not in SRD_monsters:
+    if monster not in MONSTERS:
         abort(404)
     return render_template(
         "view_monster.html",
         logged_in=current_user.is_authenticated,
         SRD_disclaimer=True,
-        monster=SRD_monsters[monster],
+        monster=MONSTERS[monster],
     )
 
 
 @blueprint.route("/get/<monster>/<attr>")
+@srd_cacheable(html=False)
 def get_monster(monster, attr):
+    if monster not in MONSTERS:
+        abort(404)
     if attr == "card":
-        monster_json = SRD_monsters[monster]
-        monster_json["html"] = render_template(
+        return card_response(
+            ("monster", monster),
             "view_monster.html",
-            monster=SRD_monsters[monster],
-            embedded_card=True,
+            MONSTERS[monster],
+            monster=MONSTERS[monster],
         )
-        return monster_json
-    elif attr not in monster:
+    elif attr not in MONSTERS[monster]:
         abort(400)
-    return jsonify(SRD_monsters[monster][attr])
+    return jsonify(thaw(MONSTERS[monster][attr]))
@@ -1,4 +1,12 @@
-from flask import Blueprint, render_template, abort, redirect, url_for, request
+from flask import (
+    Blueprint,
+    render_template,
+    abort,
+    redirect,
+    url_for,
+    request,
+    jsonify,
+)
 from flask_login import login_required, current_user
 from wtforms import SelectField
 from werkzeug.datastructures import MultiDict
@@ -10,16 +18,51 @@ from tabletop_story.models import (
 )
 from tabletop_story.forms import GenericForm, GenericCreateForm, EditNPCForm
 from tabletop_story.plugins import db
-from tabletop_story.dnd_campaign import NPC
+from tabletop_story.concurrency import retry_on_conflict
+from tabletop_story.dnd_campaign import NPC, NPC_TYPE
 from is_safe_url import is_safe_url
-from dnd_character.monsters import SRD_monsters
+from tabletop_story.srd import MONSTERS
+from tabletop_story.cache import render_card, cached_card_response
+from tabletop_story.http_caching import (
+    content_version,
+    conditional_response,
+    make_etag,
+    PRIVATE_CACHE_CONTROL,
+)
 
 
 blueprint = Blueprint("scene/npc", __name__, template_folder="../templates/campaign")
 
 
+def npc_card_key(npc):
+    """Saving the NPC changes its data hash, so an edited card is rendered again"""
+    return ("npc", npc.id, npc.data_hash)
+
+
+def render_npc_card(npc):
+    NPC = npc.npc
+    NPC.id = npc.id
+    return render_card("view_npc.html", npc.as_dict(), npc=NPC)
+
+
+def join_combat(campaign, combat, npc):
+    """Receives the campaign's Combat and adds an NPC which is in its scene"""
+    if combat.scene_id == npc.scene_id:
+        # a late joiner rolls initiative without re-rolling everyone else
+        campaign.add_combatant(
+            combat, npc.id, NPC_TYPE, npc.npc.dexterity, npc.npc.hit_points
+        )
+
+
+def leave_combat(campaign, combat, npc):
+    """Receives the campaign's Combat and removes an NPC which leaves its scene"""
+    if combat.scene_id == npc.scene_id:
+        campaign.remove_combatant(combat, npc.id, NPC_TYPE)
+
+
 @blueprint.route("/<scene_id>/create", methods=["GET", "POST"])
 @login_required
+@retry_on_conflict
 def create_scene_npc(scene_id):
     scene = LocationScene.query.get(scene_id)
     if scene is None:
@@ -43,21 +86,23 @@ def create_scene_npc(scene_id):
         SelectField(
             "Template to base NPC on:",
             choices=[
-                (monster["index"], monster["name"]) for monster in SRD_monsters.values()
+                (monster["index"], monster["name"]) for monster in MONSTERS.values()
             ],
         ),
     )
 
     form = CreateNPCForm()
     if form.validate_on_submit():
-        data = NPC.from_template(SRD_monsters[form.template.data]).as_dict()
+        data = NPC.from_template(MONSTERS[form.template.data]).as_dict()
         data["name"] = form.name.data
         npc = SceneNPC(
             name=form.name.data,
-            scene_id=scene_id,
+            scene_id=scene.id,
             data=str(data),
         )
         db.session.add(npc)
+        db.session.flush()
+        join_combat(campaign, campaign.get_combat(), npc)
         db.session.commit()
         next_page = request.args.get("next")
         return (
@@ -76,6 +121,7 @@ def create_scene_npc(scene_id):
 
 @blueprint.route("/edit/<npc_id>/", methods=["GET", "POST"])
 @login_required
+@retry_on_conflict
 def edit_scene_npc(npc_id):
     npc = SceneNPC.query.get(npc_id)
     if npc is None:
@@ -101,9 +147,10 @@ def edit_scene_npc(npc_id):
         npc.name = form.name.data
         # Most fields match up with attributes of Character
         data = npc.as_dict()
+        old_hp = data["hit_points"]
         for field in form._fields:
             data[field] = form._fields[field].data
-        del data["csrf_token"]
+        data.pop("csrf_token", None)
         del data["submit"]
         data["actions"] = [line for line in data["actions"].split("\n")]
         data["proficiencies"] = [line for line in data["proficiencies"].split("\n")]
@@ -111,6 +158,7 @@ def edit_scene_npc(npc_id):
 
         npc.data = str(data)
         db.session.add(npc)
+        GameCampaign.record_hp_change(NPC_TYPE, npc.id, old_hp, data["hit_points"])
         db.session.commit()
         return (
             redirect(next_page)
@@ -169,19 +217,17 @@ def get_npc(npc_id, attr):
     if campaign.gamemaster != int(current_user.get_id()):
         abort(403)
 
-    NPC = npc.npc
-    NPC.id = npc.id
-    html = render_template(
-        "view_npc.html",
-        npc=NPC,
-        embedded_card=True,
-    )
-    data = npc.as_dict()
     if attr == "card":
-        monster_json = data
-        monster_json["html"] = html
-        return monster_json
-    elif attr not in data:
+        key = npc_card_key(npc)
+        return conditional_response(
+            make_etag(*key, content_version()),
+            lambda: cached_card_response(
+                key, "view_npc.html", lambda: render_npc_card(npc)
+            ),
+            PRIVATE_CACHE_CONTROL,
+        )
+    data = npc.as_dict()
+    if attr not in data:
         abort(400)
     return jsonify(data[attr])
 
@@ -218,6 +264,7 @@ def view_scene_npc(npc_id):
 
 @blueprint.route("/delete/<npc_id>", methods=["GET", "POST"])
 @login_required
+@retry_on_conflict
 def delete_scene_npc(npc_id):
     npc = SceneNPC.query.get(npc_id)
     if npc is None:
@@ -236,6 +283,7 @@ def delete_scene_npc(npc_id):
 
     form = GenericForm()
     if form.validate_on_submit():
+        leave_combat(campaign, campaign.get_combat(), npc)
         db.session.delete(npc)
         db.session.commit()
         return redirect(
@@ -253,8 +301,37 @@ def delete_scene_npc(npc_id):
     )
 
 
+def scene_choice_form(campaign):
+    """Returns a GenericForm with a SelectField of every scene in the campaign"""
+
+    class SceneChoiceForm(GenericForm):
+        pass
+
+    scenes = (
+        db.session.query(LocationScene.id, LocationScene.name, CampaignLocation.name)
+        .join(CampaignLocation, CampaignLocation.id == LocationScene.location_id)
+        .filter(CampaignLocation.campaign_id == campaign.id)
+        .order_by(CampaignLocation.id, LocationScene.id)
+        .all()
+    )
+    setattr(
+        SceneChoiceForm,
+        "scene",
+        SelectField(
+            "Choose a Scene",
+            choices=[
+                (scene_id, f"{location_name}: {scene_name}")
+                for scene_id, scene_name, location_name in scenes
+            ],
+            coerce=int,
+        ),
+    )
+    return SceneChoiceForm()
+
+
 @blueprint.route("/copy/<npc_id>", methods=["GET", "POST"])
 @login_required
+@retry_on_conflict
 def copy_scene_npc(npc_id):
     npc = SceneNPC.query.get(npc_id)
     if npc is None:
@@ -271,18 +348,28 @@ def copy_scene_npc(npc_id):
     if campaign.gamemaster != int(current_user.get_id()):
         abort(403)
 
+    form = scene_choice_form(campaign)
+    if form.validate_on_submit():
+        copy = SceneNPC(name=npc.name, scene_id=form.scene.data, data=npc.data)
+        db.session.add(copy)
+        db.session.flush()
+        join_combat(campaign, campaign.get_combat(), copy)
+        db.session.commit()
+        return redirect(url_for(".view_scene_npc", npc_id=copy.id))
+
     return render_template(
-        "view_npc.html",
+        "move_npc.html",
         logged_in=True,
-        campaign=campaign,
-        location=location,
+        action="Copy",
+        form=form,
         scene=scene,
-        npc=npc.npc,
+        npc=npc,
     )
 
 
 @blueprint.route("/move/<npc_id>", methods=["GET", "POST"])
 @login_required
+@retry_on_conflict
 def move_scene_npc(npc_id):
     npc = SceneNPC.query.get(npc_id)
     if npc is None:
@@ -299,11 +386,21 @@ def move_scene_npc(npc_id):
     if campaign.gamemaster != int(current_user.get_id()):
         abort(403)
 
+    form = scene_choice_form(campaign)
+    if form.validate_on_submit():
+        if form.scene.data != npc.scene_id:
+            combat = campaign.get_combat()
+            leave_combat(campaign, combat, npc)
+            npc.scene_id = form.scene.data
+            join_combat(campaign, combat, npc)
+            db.session.commit()
+        return redirect(url_for(".view_scene_npc", npc_id=npc.id))
+
     return render_template(
-        "view_npc.html",
+        "move_npc.html",
         logged_in=True,
-        campaign=campaign,
-        location=location,
+        action="Move",
+        form=form,
         scene=scene,
-        npc=npc.npc,
+        npc=npc,
     )
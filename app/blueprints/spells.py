@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template, abort
 from flask_login import current_user
-from dnd_character.spellcasting import SRD_spells, spells_for_class_level
+from tabletop_story.srd import SPELLS, SPELL_LEVELS, spell_keys
+from tabletop_story.cache import card_response
+from tabletop_story.http_caching import srd_cacheable
 
 
 blueprint = Blueprint("spells", __name__, template_folder="../templates/spells")
@@ -30,10 +32,9 @@ def list_spells(classs):
         "wizard",
     ):
         abort(404)
-    spell_levels = [spells_for_class_level(classs, i) for i in range(10)]
-    spells = []
-    for i, spell_levels_ in enumerate(spell_levels):
-        spells.append([SRD_spells[spell] for spell in spell_levels_])
+    spells = [
+        [SPELLS[spell] for spell in spell_keys(classs, level)] for level in SPELL_LEVELS
+    ]
     return render_template(
         "list_spells.html",
         logged_in=current_user.is_authenticated,
@@ -44,25 +45,23 @@ def list_spells(classs):
 
 
 @blueprint.route("/view/<spell>")
+@srd_cacheable(html=True)
 def view_spell(spell):
-    if spell not in SRD_spells:
+    if spell not in SPELLS:
         abort(404)
     return render_template(
         "view_spell.html",
         logged_in=current_user.is_authenticated,
         SRD_disclaimer=True,
-        spell=SRD_spells[spell],
+        spell=SPELLS[spell],
     )
 
 
 @blueprint.route("/get/<spell>")
+@srd_cacheable(html=False)
 def get_spell(spell):
-    if spell not in SRD_spells:
+    if spell not in SPELLS:
         abort(400)
-    spell_json = SRD_spells[spell]
-    spell_json["html"] = render_template(
-        "view_spell.html",
-        spell=spell_json,
-        embedded_card=True,
+    return card_response(
+        ("spell", spell), "view_spell.html", SPELLS[spell], spell=SPELLS[spell]
     )
-    return spell_json
@@ -0,0 +1,115 @@
+"""
+Per-process cache of rendered fragments (e.g. the JSON bodies of cards),
+evicted in LRU order once their total size passes FRAGMENT_CACHE_MB.
+Keys should include whatever the fragment depends on, such as a hash of the
+row's data and template_version(), so changed data is never served stale
+"""
+from flask import current_app, render_template, json
+from .srd import thaw
+from collections import OrderedDict
+from threading import Lock
+import zlib
+
+
+class FragmentCache:
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._template_versions = {}
+        self._lock = Lock()
+
+    def init_app(self, app):
+        self.max_bytes = app.config["FRAGMENT_CACHE_MB"] * 1024 * 1024
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, fragment):
+        """Stores a str or bytes fragment, unless it alone is bigger than the cap"""
+        size = len(fragment.encode("utf-8") if isinstance(fragment, str) else fragment)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (fragment, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def get_or_render(self, key, render):
+        """Returns the cached fragment, or calls render() and caches its result"""
+        fragment = self.get(key)
+        if fragment is None:
+            fragment = render()
+            self.set(key, fragment)
+        return fragment
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._template_versions.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def template_version(self, template):
+        """
+        Returns checksum of a template's source, computed once per process
+        (or on every call when templates are auto-reloaded, while debugging)
+        """
+        version = self._template_versions.get(template)
+        if version is None or current_app.templates_auto_reload:
+            source = current_app.jinja_env.loader.get_source(
+                current_app.jinja_env, template
+            )[0]
+            version = zlib.crc32(source.encode("utf-8"))
+            self._template_versions[template] = version
+        return version
+
+
+fragment_cache = FragmentCache()
+
+
+def render_card(template, data, **context):
+    """Returns JSON body of a copy of `data` with the rendered card under "html" """
+    card = thaw(data)
+    card["html"] = render_template(template, embedded_card=True, **context)
+    return json.dumps(card).encode("utf-8")
+
+
+def cached_card_response(key, template, render):
+    """
+    Returns a new JSON response with the body from render(), which is
+    cached on (*key, template version) so it is only called the first time
+    """
+    body = fragment_cache.get_or_render(
+        (*key, fragment_cache.template_version(template)), render
+    )
+    return current_app.response_class(body, mimetype="application/json")
+
+
+def card_response(key, template, data, **context):
+    """Returns a new JSON response of a cached card (see render_card)"""
+    return cached_card_response(
+        key, template, lambda: render_card(template, data, **context)
+    )
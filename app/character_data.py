@@ -0,0 +1,70 @@
+"""
+Serialization of dnd_character.Character data for the GameCharacter model,
+and a per-process cache so each row version is only decoded once
+"""
+import json
+import pickle
+from collections import OrderedDict
+from threading import Lock
+
+
+# JSON object keys are always strings, but these dicts are keyed by spell level
+INT_KEYED_FIELDS = ("cantrips_known", "spells_known", "spell_slots")
+
+
+def encode_character_data(data):
+    """Receives a dict of a Character and returns a JSON string"""
+    return json.dumps(data, separators=(",", ":"))
+
+
+def decode_character_data(string):
+    """Receives a JSON string from encode_character_data and returns a dict"""
+    data = json.loads(string)
+    for key in INT_KEYED_FIELDS:
+        if isinstance(data.get(key), dict):
+            data[key] = {int(level): val for level, val in data[key].items()}
+    return data
+
+
+class CharacterDataCache:
+    """
+    LRU cache of decoded character data keyed on (row id, row version).
+    Entries are stored pickled so that every caller receives its own copy
+    to mutate; unpickling is roughly twice as fast as json.loads.
+    The encoded string is kept too, because SQLite can reuse the id of a
+    deleted row and the new row would start again at version 1
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, row_id, version, string):
+        if row_id is None or version is None:
+            # this row hasn't been flushed yet, so it has no stable key
+            return decode_character_data(string)
+        key = (row_id, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == string:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return pickle.loads(entry[1])
+            self.misses += 1
+        data = decode_character_data(string)
+        entry = (string, pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+character_data_cache = CharacterDataCache()
@@ -0,0 +1,41 @@
+"""
+Optimistic concurrency for campaign and character writes. GameCampaign,
+CampaignCombat and GameCharacter rows have a version which SQLAlchemy compares
+and increments on every UPDATE, so a write based on an outdated read fails with
+StaleDataError instead of overwriting a newer one. Views retry the whole request
+when that happens, which reads the newer state, rather than locking rows
+against each other
+"""
+from flask import abort, session
+from sqlalchemy.orm.exc import StaleDataError
+from functools import wraps
+from .plugins import db
+import logging
+
+
+LOG = logging.getLogger(__package__)
+# a request which loses this many races in a row gets 409 Conflict
+MAX_ATTEMPTS = 3
+
+
+def retry_on_conflict(view):
+    """
+    Decorates a view which writes to a campaign or character,
+    to run it again if a write conflicts
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # messages flashed by an attempt which is rolled back are discarded
+        flashes = list(session.get("_flashes", []))
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                return view(*args, **kwargs)
+            except StaleDataError:
+                db.session.rollback()
+                session["_flashes"] = list(flashes)
+                LOG.info("Write conflict in %s (attempt %s)", view.__name__, attempt)
+        LOG.warning("Gave up on %s after %s write conflicts", view.__name__, attempt)
+        abort(409)
+
+    return wrapper
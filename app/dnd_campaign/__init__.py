@@ -5,5 +5,6 @@ but for things that are outside the scope of D&D characters yet inside the scope
 dnd_campaign is not big enough for its own repo yet, but it could be in the future.
 """
 
-from .combat import Combat
+from .combat import Combat, CHARACTER_TYPE, NPC_TYPE
+from .combat_log import CombatLog
 from .npc import NPC
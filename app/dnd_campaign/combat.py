@@ -1,16 +1,43 @@
 from collections import namedtuple
-from random import randint
+from random import randint, random
 from math import floor
+from bisect import bisect_right
 
 
-roll_data = namedtuple("roll_data", ["id", "type"])
+# initiative, dex and tiebreak default to 0 for turn sequences saved with only id and type
+roll_data = namedtuple(
+    "roll_data",
+    ["id", "type", "initiative", "dex", "tiebreak"],
+    defaults=(0, 0, 0),
+)
 character_data = namedtuple("character_data", ["id", "dex"])
 
+# roll_data.type of each kind of combatant
+CHARACTER_TYPE = 0
+NPC_TYPE = 1
+
 
 def dex_modifier(number):
     return floor((number - 10) / 2)
 
 
+def roll_initiative(combatant_id, combatant_type, dex):
+    """Returns roll_data of a new initiative roll for a combatant with this dexterity"""
+    modifier = dex_modifier(dex)
+    return roll_data(
+        combatant_id, combatant_type, randint(1, 20) + modifier, modifier, random()
+    )
+
+
+def turn_order(combatant):
+    """
+    Sort key for roll_data: highest initiative first, then highest dex modifier,
+    then the random tiebreak rolled with the initiative, so a tie is broken the
+    same way every time the sequence is sorted
+    """
+    return (-combatant.initiative, -combatant.dex, combatant.tiebreak)
+
+
 class Combat:
     def __init__(
         self,
@@ -20,6 +47,7 @@ class Combat:
         npcs=None,
         turn_sequence=None,
         turn_index=0,
+        round=1,
     ):
         self.scene_id = int(scene_id)
         self._active = active
@@ -28,6 +56,7 @@ class Combat:
         )
         self.npcs = [] if npcs is None else [character_data(*npc) for npc in npcs]
         self.turn_index = turn_index
+        self.round = round
         if turn_sequence is None:
             self.turn_sequence = [] if not active else self.create_turn_sequence()
         else:
@@ -47,28 +76,65 @@ class Combat:
 
     def create_turn_sequence(self):
         """
-        The turn sequence is a list of roll_data namedtuples
+        The turn sequence is a list of roll_data namedtuples, sorted by turn_order.
+        Every combatant gets a turn, even if the same one is listed twice
         """
         self.turn_index = 0
-        rolls = {
-            character_data(each.id, 0): randint(1, 20) + dex_modifier(each.dex)
-            for each in self.characters
-        }
-        rolls.update(
-            {
-                character_data(each.id, 1): randint(1, 20) + dex_modifier(each.dex)
-                for each in self.npcs
-            }
+        self.round = 1
+        self.turn_sequence = sorted(
+            [
+                roll_initiative(each.id, CHARACTER_TYPE, each.dex)
+                for each in self.characters
+            ]
+            + [roll_initiative(each.id, NPC_TYPE, each.dex) for each in self.npcs],
+            key=turn_order,
         )
-        final_order = {}
-        for char, roll in rolls.items():
-            while roll in final_order:
-                roll += 1
-            final_order[roll] = char
-        sorted_final_order = {
-            k: final_order[k] for k in reversed(sorted(final_order.keys()))
-        }
-        self.turn_sequence = list(sorted_final_order.values())
+        return self.turn_sequence
+
+    def add_combatant(self, combatant_id, combatant_type, dex):
+        """
+        Rolls initiative for a late joiner and inserts them into the turn sequence
+        without rolling again for anyone else. Returns their roll_data
+        """
+        combatant = roll_initiative(combatant_id, combatant_type, dex)
+        self.insert_roll(combatant, dex)
+        return combatant
+
+    def insert_roll(self, combatant, dex):
+        """
+        Adds a combatant who already rolled initiative (a roll_data) to the
+        combat, and to the turn sequence if the combat is active
+        """
+        combatant = roll_data(*combatant)
+        (self.characters if combatant.type == CHARACTER_TYPE else self.npcs).append(
+            character_data(combatant.id, dex)
+        )
+        if not self._active:
+            return
+        keys = [turn_order(each) for each in self.turn_sequence]
+        i = bisect_right(keys, turn_order(combatant))
+        self.turn_sequence.insert(i, combatant)
+        if i <= self.turn_index and len(self.turn_sequence) > 1:
+            # whoever's turn it is keeps their turn
+            self.turn_index += 1
+
+    def remove_combatant(self, combatant_id, combatant_type):
+        """
+        Removes a combatant (e.g., a defeated NPC) from the combat and its turn
+        sequence. If it was their turn, the next combatant's turn begins
+        """
+        roster = self.characters if combatant_type == CHARACTER_TYPE else self.npcs
+        roster[:] = [each for each in roster if each.id != combatant_id]
+        sequence = []
+        for i, combatant in enumerate(self.turn_sequence):
+            if combatant.id == combatant_id and combatant.type == combatant_type:
+                if i < self.turn_index:
+                    self.turn_index -= 1
+            else:
+                sequence.append(combatant)
+        self.turn_sequence = sequence
+        if self.turn_index >= len(self.turn_sequence):
+            self.turn_index = 0
 
     def set_characters(self, characters: list):
         """Receives a list of dnd_character.Character objects"""
@@ -96,7 +162,24 @@ class Combat:
     def __str__(self):
         return str(self.as_dict())
 
+    def resume(self, turn_sequence, turn_index=0, round=1):
+        """Makes the combat active with initiative that was already rolled"""
+        self._active = True
+        self.turn_sequence = sorted(
+            (roll_data(*each) for each in turn_sequence), key=turn_order
+        )
+        self.turn_index = turn_index
+        self.round = round
+
     def next(self):
         self.turn_index += 1
-        if self.turn_index == len(self.turn_sequence):
+        if self.turn_index >= len(self.turn_sequence):
             self.turn_index = 0
+            self.round += 1
+
+    def previous(self):
+        """Goes back a turn, undoing next"""
+        self.turn_index -= 1
+        if self.turn_index < 0:
+            self.turn_index = max(len(self.turn_sequence) - 1, 0)
+            self.round = max(self.round - 1, 1)
@@ -0,0 +1,178 @@
+"""
+A combat as an append-only log of events. The state after any event is the
+latest snapshot before it with the events since then applied, so the log
+never has to be read from the beginning.
+
+Events are (kind, data) where data is a dict of JSON values:
+    scene   a new scene: scene_id, characters and npcs as [id, dex]
+    start   combat begins: turn_sequence as roll_data lists, hp of each combatant
+    end     combat ends: the turn_sequence, turn_index and round it had
+    next    the next turn
+    add     a late joiner: roll (a roll_data list), dex, hp
+    remove  a combatant leaves: id, type, their rolls and roster entries,
+            and the turn_index from before
+    hp      id, type, old and new HP
+    undo    undoes the event whose id, kind and data it has, then removes the
+            combatants in its gone list: [type, id] of those it would bring
+            back whose rows were deleted since
+    redo    does that event again, with a gone list like undo's
+"""
+from .combat import Combat, roll_data, character_data, CHARACTER_TYPE
+
+
+# events which can be undone; a scene can't be, and clears the history
+UNDOABLE = ("start", "end", "next", "add", "remove", "hp")
+# the undo stack drops its oldest events beyond this many
+UNDO_LIMIT = 100
+# events between snapshots, which is the most that's replayed to read the state
+SNAPSHOT_INTERVAL = 25
+
+
+def hp_key(combatant_type, combatant_id):
+    return f"{combatant_type}:{combatant_id}"
+
+
+class CombatLog:
+    """
+    The state of a combat after some event in its log: the Combat, the HP
+    recorded for each combatant, and the ids of events which can be undone
+    or redone (most recent last)
+    """
+
+    def __init__(self, combat=None, hp=None, undo=None, redo=None, event_id=0):
+        self.combat = Combat() if combat is None else combat
+        self.hp = {} if hp is None else hp
+        self.undo = [] if undo is None else undo
+        self.redo = [] if redo is None else redo
+        # the last event applied to this state
+        self.event_id = event_id
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Receives a dict from CombatLog.snapshot"""
+        return cls(
+            combat=Combat(
+                scene_id=snapshot["scene_id"],
+                active=snapshot["active"],
+                characters=snapshot["characters"],
+                npcs=snapshot["npcs"],
+                turn_sequence=snapshot["turn_sequence"],
+                turn_index=snapshot["turn_index"],
+                round=snapshot["round"],
+            ),
+            hp=snapshot["hp"],
+            undo=snapshot["undo"],
+            redo=snapshot["redo"],
+            event_id=snapshot["event_id"],
+        )
+
+    def snapshot(self):
+        """Returns dict of JSON values which from_snapshot makes into this state"""
+        return {
+            "event_id": self.event_id,
+            "scene_id": self.combat.scene_id,
+            "active": self.combat.active,
+            "characters": [list(each) for each in self.combat.characters],
+            "npcs": [list(each) for each in self.combat.npcs],
+            "turn_sequence": [list(each) for each in self.combat.turn_sequence],
+            "turn_index": self.combat.turn_index,
+            "round": self.combat.round,
+            "hp": self.hp,
+            "undo": self.undo,
+            "redo": self.redo,
+        }
+
+    def apply(self, event_id, kind, data):
+        """Applies the next event in the log to this state. Returns self"""
+        if kind == "undo":
+            self.undo.pop()
+            self.redo.append(data["event"])
+            self._undo(data["kind"], data["data"])
+            self.remove_gone(data)
+        elif kind == "redo":
+            self.redo.pop()
+            self.undo.append(data["event"])
+            self._do(data["kind"], data["data"])
+            self.remove_gone(data)
+        else:
+            self._do(kind, data)
+            if kind in UNDOABLE:
+                self.undo = self.undo[-UNDO_LIMIT + 1 :] + [event_id]
+                self.redo = []
+            else:
+                self.undo = []
+                self.redo = []
+        self.event_id = event_id
+        return self
+
+    def remove_gone(self, data):
+        """Removes the combatants in the gone list of an undo or redo event's data"""
+        for combatant_type, combatant_id in data.get("gone", ()):
+            self.combat.remove_combatant(combatant_id, combatant_type)
+            self.hp.pop(hp_key(combatant_type, combatant_id), None)
+
+    def _do(self, kind, data):
+        combat = self.combat
+        if kind == "scene":
+            self.combat = Combat(
+                scene_id=data["scene_id"],
+                characters=data["characters"],
+                npcs=data["npcs"],
+            )
+            self.hp = {}
+        elif kind == "start":
+            combat.resume(data["turn_sequence"])
+            self.hp.update(data["hp"])
+        elif kind == "end":
+            combat.active = False
+        elif kind == "next":
+            combat.next()
+        elif kind == "add":
+            if data["roll"] is None:
+                combat.insert_roll((data["id"], data["type"]), data["dex"])
+            else:
+                combat.insert_roll(data["roll"], data["dex"])
+            if data.get("hp") is not None:
+                self.hp[hp_key(data["type"], data["id"])] = data["hp"]
+        elif kind == "remove":
+            combat.remove_combatant(data["id"], data["type"])
+        elif kind == "hp":
+            self.hp[hp_key(data["type"], data["id"])] = data["new"]
+        else:
+            raise ValueError(f"Unknown combat event: {kind!r}")
+
+    def _undo(self, kind, data):
+        combat = self.combat
+        if kind == "start":
+            combat.active = False
+            for key in data["hp"]:
+                self.hp.pop(key, None)
+        elif kind == "end":
+            combat.resume(data["turn_sequence"], data["turn_index"], data["round"])
+        elif kind == "next":
+            combat.previous()
+        elif kind == "add":
+            combat.remove_combatant(data["id"], data["type"])
+            if data.get("hp") is not None:
+                self.hp.pop(hp_key(data["type"], data["id"]), None)
+        elif kind == "remove":
+            roster = (
+                combat.characters if data["type"] == CHARACTER_TYPE else combat.npcs
+            )
+            roster.extend(character_data(*each) for each in data["roster"])
+            if combat.active:
+                combat.resume(
+                    combat.turn_sequence + [roll_data(*each) for each in data["rolls"]],
+                    data["turn_index"],
+                    combat.round,
+                )
+        elif kind == "hp":
+            self.hp[hp_key(data["type"], data["id"])] = data["old"]
+        else:
+            raise ValueError(f"Can't undo combat event: {kind!r}")
+
+    def replay(self, events):
+        """Receives iterable of (id, kind, data) and applies them in order"""
+        for event_id, kind, data in events:
+            self.apply(event_id, kind, data)
+        return self
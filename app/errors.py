@@ -1,6 +1,12 @@
 import flask_login
 from flask import Blueprint, render_template, flash, request, abort
-from werkzeug.exceptions import NotFound, Forbidden, InternalServerError, BadRequest
+from werkzeug.exceptions import (
+    NotFound,
+    Forbidden,
+    InternalServerError,
+    BadRequest,
+    Conflict,
+)
 from time import sleep
 import os
 import logging
@@ -32,6 +38,17 @@ def page_forbidden(error):
     )
 
 
+@error_routes.app_errorhandler(Conflict)
+def edit_conflict(error):
+    flash("Someone else changed this at the same time. Please try again", "danger")
+    return (
+        render_template(
+            "index.html", logged_in=flask_login.current_user.is_authenticated, err=True
+        ),
+        409,
+    )
+
+
 @error_routes.app_errorhandler(InternalServerError)
 def critical_error(error):
     flash("The server experienced an error", "danger")
@@ -16,7 +16,7 @@ from wtforms.validators import (
     NumberRange,
     Optional,
 )
-from dnd_character.equipment import SRD_equipment
+from .srd import EQUIPMENT
 
 
 class EditCharacterExperienceForm(FlaskForm):
@@ -50,30 +50,10 @@ class EditNPCForm(FlaskForm):
 
 class EditCampaignForm(FlaskForm):
     name = StringField("Name", validators=[Length(min=1, max=127)])
-    character1 = IntegerField(
-        "First Character ID", validators=[NumberRange(min=1), Optional()]
+    new_character = IntegerField(
+        "New Character ID", validators=[NumberRange(min=1), Optional()]
     )
-    char1uid = StringField("Secret")
-    character2 = IntegerField(
-        "Second Character ID", validators=[NumberRange(min=1), Optional()]
-    )
-    char2uid = StringField("Secret")
-    character3 = IntegerField(
-        "Third Character ID", validators=[NumberRange(min=1), Optional()]
-    )
-    char3uid = StringField("Secret")
-    character4 = IntegerField(
-        "Fourth Character ID", validators=[NumberRange(min=1), Optional()]
-    )
-    char4uid = StringField("Secret")
-    character5 = IntegerField(
-        "Fifth Character ID", validators=[NumberRange(min=1), Optional()]
-    )
-    char5uid = StringField("Secret")
-    character6 = IntegerField(
-        "Sixth Character ID", validators=[NumberRange(min=1), Optional()]
-    )
-    char6uid = StringField("Secret")
+    new_character_uid = StringField("Secret")
     submit = SubmitField("💾 Save Changes")
 
 
@@ -112,7 +92,7 @@ class EditCharacterAddInventoryForm(FlaskForm):
     # custom_item = StringField("Item Name:", validator=[Length(min=1, max=24)])
     new_item = SelectField(
         "Add New Item: ",
-        choices=[(item["index"], item["name"]) for item in SRD_equipment.values()],
+        choices=[(item["index"], item["name"]) for item in EQUIPMENT.values()],
     )
     submit_add = SubmitField("Add Item ➕")
 
@@ -0,0 +1,91 @@
+"""
+HTTP conditional caching: ETags, Cache-Control and 304 Not Modified responses
+for content which only changes on deploy (the SRD and templates) or with a
+row's data. A matching If-None-Match skips rendering entirely
+"""
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from jinja2 import TemplateNotFound
+from functools import wraps
+import importlib.metadata
+import hashlib
+
+
+try:
+    SRD_VERSION = importlib.metadata.version("dnd_character")
+except importlib.metadata.PackageNotFoundError:
+    SRD_VERSION = "unknown"
+
+# JSON which is the same for everyone, so browsers needn't ask again for a day
+SRD_CACHE_CONTROL = "public, max-age=86400"
+# pages which depend on who is logged in, or data which can be edited
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+_content_version = None
+
+
+def content_version():
+    """
+    Returns checksum of the installed SRD version and every template,
+    computed once per process (or every time when templates are auto-reloaded)
+    """
+    global _content_version
+    if _content_version is None or current_app.templates_auto_reload:
+        digest = hashlib.sha1(SRD_VERSION.encode("utf-8"))
+        env = current_app.jinja_env
+        for template in sorted(env.list_templates()):
+            try:
+                source = env.loader.get_source(env, template)[0]
+            except TemplateNotFound:
+                # e.g. a dangling symlink, which could never be rendered anyway
+                continue
+            digest.update(template.encode("utf-8") + source.encode("utf-8"))
+        _content_version = digest.hexdigest()
+    return _content_version
+
+
+def make_etag(*parts):
+    return hashlib.sha1("\0".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def conditional_response(etag, build, cache_control):
+    """
+    Returns 304 Not Modified if the request's If-None-Match has the etag,
+    otherwise the response from build()
+    """
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def srd_cacheable(html):
+    """
+    Decorates a view of SRD content with an ETag of the content version and
+    URL. HTML pages also depend on whether the user is logged in (for the
+    navbar), so they are private and revalidated on every request
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if session.get("_flashes"):
+                # a flashed message has to be rendered, so this page must be too
+                return view(*args, **kwargs)
+            etag = make_etag(
+                content_version(),
+                request.full_path,
+                current_user.is_authenticated if html else None,
+            )
+            return conditional_response(
+                etag,
+                lambda: view(*args, **kwargs),
+                PRIVATE_CACHE_CONTROL if html else SRD_CACHE_CONTROL,
+            )
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,136 @@
+"""
+Opt-in instrumentation of the SQL issued by each request.
+Counts statements and database time per endpoint using SQLAlchemy engine events
+and logs requests which cross the configured thresholds.
+Set SQL_INSTRUMENTATION in .env to enable it. METRICS also enables it,
+so that database time can be exported per endpoint.
+"""
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from threading import Lock
+import time
+import logging
+
+
+LOG = logging.getLogger(__package__)
+
+
+class EndpointStats:
+    """Aggregated SQL statistics for one endpoint in this worker process"""
+
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.db_time = 0.0
+        self.max_statements = 0
+        self.slowest_time = 0.0
+        self.slowest_statement = ""
+
+    def add(self, request_stats):
+        self.requests += 1
+        self.statements += request_stats.statements
+        self.db_time += request_stats.db_time
+        self.max_statements = max(self.max_statements, request_stats.statements)
+        if request_stats.slowest_time > self.slowest_time:
+            self.slowest_time = request_stats.slowest_time
+            self.slowest_statement = request_stats.slowest_statement
+
+    @property
+    def mean_statements(self):
+        return self.statements / self.requests if self.requests else 0
+
+    @property
+    def mean_db_ms(self):
+        return self.db_time * 1000 / self.requests if self.requests else 0
+
+
+class RequestStats:
+    """SQL statistics for the request currently being handled"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = ""
+
+    def add(self, statement, duration):
+        self.statements += 1
+        self.db_time += duration
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+
+
+class SQLInstrumentation:
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = Lock()
+        self._listening = False
+
+    def init_app(self, app):
+        if not (app.config.get("SQL_INSTRUMENTATION") or app.config.get("METRICS")):
+            return
+        LOG.info("SQL instrumentation is enabled")
+        if not self._listening:
+            # listen on the Engine class so it works before the engine exists
+            event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+            self._listening = True
+
+        @app.before_request
+        def start_request_stats():
+            g.sql_stats = RequestStats()
+
+        @app.teardown_request
+        def finish_request_stats(exc):
+            stats = g.pop("sql_stats", None)
+            if stats is None:
+                return
+            self.record(request.endpoint, stats)
+            duration = (time.perf_counter() - stats.start) * 1000
+            if (
+                stats.statements >= app.config["SLOW_REQUEST_QUERIES"]
+                or stats.db_time * 1000 >= app.config["SLOW_REQUEST_DB_MS"]
+            ):
+                LOG.warning(
+                    f"{request.method} {request.path} ({request.endpoint}) took "
+                    f"{duration:.1f}ms with {stats.statements} SQL statements in "
+                    f"{stats.db_time * 1000:.1f}ms. Slowest statement "
+                    f"({stats.slowest_time * 1000:.1f}ms): {stats.slowest_statement}"
+                )
+
+    def record(self, endpoint, request_stats):
+        with self._lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = EndpointStats()
+            self.endpoints[endpoint].add(request_stats)
+
+    def snapshot(self):
+        """Returns list of (endpoint, EndpointStats) sorted by total database time"""
+        with self._lock:
+            return sorted(
+                self.endpoints.items(),
+                key=lambda item: item[1].db_time,
+                reverse=True,
+            )
+
+    def reset(self):
+        with self._lock:
+            self.endpoints.clear()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "sql_stats" in g:
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "sql_stats" in g:
+        start_times = conn.info.get("query_start_time")
+        if start_times:
+            g.sql_stats.add(statement, time.perf_counter() - start_times.pop())
+
+
+sql_instrumentation = SQLInstrumentation()
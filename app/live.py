@@ -0,0 +1,212 @@
+"""
+Opt-in live updates of campaigns, pushed to their viewers as Server-Sent Events.
+A commit which changes a campaign's combat or active location/scene publishes
+the campaign's new state, once, into a small SQLite side-database which every
+uWSGI worker shares. Each open stream polls that database for its campaign,
+so viewers don't reload the whole campaign page to see whose turn it is.
+Set LIVE_UPDATES in .env to enable it. Each open stream holds a worker thread
+for up to LIVE_STREAM_SECONDS, after which the browser reconnects, so uWSGI must
+run with threads (see setup/website.uwsgi) or gevent: under uWSGI without either,
+live updates stay off. At most LIVE_MAX_STREAMS streams are open in each worker
+process, which leaves its other threads for ordinary requests
+"""
+from flask import json
+from sqlalchemy import event
+from .plugins import db
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+
+LOG = logging.getLogger(__package__)
+# seconds between comments sent to keep an idle stream from being closed
+KEEPALIVE_SECONDS = 15
+
+
+def server_is_concurrent():
+    """
+    Returns False when running under uWSGI with neither threads nor gevent,
+    where every request (and so every open stream) takes a whole process
+    """
+    try:
+        import uwsgi
+    except ImportError:
+        # Flask's development server runs each request in its own thread
+        return True
+    return bool(uwsgi.opt.get("threads") or uwsgi.opt.get("gevent"))
+
+
+def format_event(event_id, data, kind="campaign"):
+    """Returns an SSE message from a str of JSON"""
+    return f"id: {event_id}\nevent: {kind}\ndata: {data}\n\n"
+
+
+class LiveUpdates:
+    def __init__(self):
+        self.path = None
+        self.poll_interval = 0.5
+        self.stream_seconds = 300
+        self.keep_seconds = 600
+        self.max_streams = 4
+        self._open_streams = 0
+        self._lock = threading.Lock()
+        self._listening = False
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def init_app(self, app):
+        self.path = app.config["LIVE_DB"] if app.config.get("LIVE_UPDATES") else None
+        if not self.enabled:
+            return
+        if not server_is_concurrent():
+            LOG.error(
+                "LIVE_UPDATES needs uWSGI with threads or gevent: "
+                "each stream would hold a whole worker process, so they stay off"
+            )
+            self.path = None
+            return
+        self.poll_interval = app.config["LIVE_POLL_SECONDS"]
+        self.stream_seconds = app.config["LIVE_STREAM_SECONDS"]
+        self.keep_seconds = app.config["LIVE_KEEP_SECONDS"]
+        self.max_streams = app.config["LIVE_MAX_STREAMS"]
+        self.create_tables()
+        if not self._listening:
+            # every app shares the scoped session, so listen to it only once
+            event.listen(db.session, "before_commit", self._before_commit)
+            event.listen(db.session, "after_commit", self._after_commit)
+            event.listen(db.session, "after_rollback", self._after_rollback)
+            self._listening = True
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def create_tables(self):
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with self.connect() as connection:
+            # AUTOINCREMENT so ids are never reused once old rows are deleted
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS notification "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, campaign_id INTEGER, "
+                "data TEXT, created REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS notification_campaign "
+                "ON notification (campaign_id, id)"
+            )
+        connection.close()
+
+    def changed(self, campaign):
+        """Publishes the GameCampaign's state when the current transaction commits"""
+        if not self.enabled:
+            return
+        db.session.info.setdefault("live_campaigns", {})[campaign.id] = campaign
+
+    def _before_commit(self, session):
+        campaigns = session.info.pop("live_campaigns", None)
+        if not self.enabled or not campaigns:
+            return
+        # the state is read once here, rather than by every stream
+        session.flush()
+        session.info["live_updates"] = [
+            (campaign_id, json.dumps(campaign.live_state()))
+            for campaign_id, campaign in campaigns.items()
+        ]
+
+    def _after_commit(self, session):
+        updates = session.info.pop("live_updates", None)
+        if updates:
+            self.publish(updates)
+
+    def _after_rollback(self, session):
+        session.info.pop("live_campaigns", None)
+        session.info.pop("live_updates", None)
+
+    def publish(self, updates):
+        """Receives list of (campaign id, str of JSON) and notifies their streams"""
+        now = time.time()
+        try:
+            connection = self.connect()
+            with connection:
+                connection.executemany(
+                    "INSERT INTO notification (campaign_id, data, created) "
+                    "VALUES (?, ?, ?)",
+                    [(campaign_id, data, now) for campaign_id, data in updates],
+                )
+                connection.execute(
+                    "DELETE FROM notification WHERE created < ?",
+                    (now - self.keep_seconds,),
+                )
+            connection.close()
+        except sqlite3.Error as e:
+            LOG.error(f"Failed to publish live updates to {self.path}: {str(e)}")
+
+    def last_id(self):
+        """Returns id of the latest notification, which a new stream starts after"""
+        connection = self.connect()
+        (event_id,) = connection.execute(
+            "SELECT coalesce(max(id), 0) FROM notification"
+        ).fetchone()
+        connection.close()
+        return event_id
+
+    def updates(self, campaign_id, since, connection=None):
+        """Returns list of (id, str of JSON) of a campaign's notifications after `since`"""
+        own_connection = connection is None
+        if own_connection:
+            connection = self.connect()
+        rows = connection.execute(
+            "SELECT id, data FROM notification "
+            "WHERE campaign_id = ? AND id > ? ORDER BY id",
+            (campaign_id, since),
+        ).fetchall()
+        if own_connection:
+            connection.close()
+        return rows
+
+    def open_stream(self):
+        """Returns True if this worker may open another stream, which must be closed"""
+        with self._lock:
+            if self._open_streams >= self.max_streams:
+                return False
+            self._open_streams += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self._open_streams -= 1
+
+    def stream(self, campaign_id, since, state):
+        """
+        Generates SSE messages: the campaign's current state (a dict), then its
+        state after each notification after id `since`, until LIVE_STREAM_SECONDS
+        """
+        yield f"retry: {int(self.poll_interval * 1000) + 1000}\n"
+        yield format_event(since, json.dumps(state))
+        deadline = time.monotonic() + self.stream_seconds
+        last_message = time.monotonic()
+        connection = self.connect()
+        try:
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                rows = self.updates(campaign_id, since, connection)
+                if rows:
+                    # every message has the whole state, so only the latest matters
+                    since, data = rows[-1]
+                    yield format_event(since, data)
+                    last_message = time.monotonic()
+                elif time.monotonic() - last_message >= KEEPALIVE_SECONDS:
+                    yield ": keepalive\n\n"
+                    last_message = time.monotonic()
+        finally:
+            connection.close()
+
+
+live_updates = LiveUpdates()
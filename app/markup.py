@@ -0,0 +1,79 @@
+"""
+Markdown renderers shared by the whole process, since mistune builds its
+parser and plugins whenever one is created, and LRU memos of their output
+keyed by a hash of the text, so unchanged text is never parsed twice
+"""
+from mistune import create_markdown
+from mistune.renderers import HTMLRenderer
+from collections import OrderedDict
+from threading import Lock
+from urllib.parse import unquote
+from html import unescape
+import hashlib
+import re
+
+
+PLUGINS = ["strikethrough", "table"]
+# stored with HTML rendered by user_markdown, which is rendered again
+# when it was stored by another version; increment when its output changes
+USER_MARKDOWN_VERSION = 2
+# URL schemes which links and images in text written by users may have
+SAFE_URL_SCHEMES = ("http", "https", "mailto")
+SCHEME = re.compile(r"^([^/?#]*):")
+# browsers ignore these characters in a URL, e.g. "java\nscript:"
+IGNORED_URL_CHARS = re.compile(r"[\x00-\x20\x7f]+")
+
+
+class SafeHTMLRenderer(HTMLRenderer):
+    """Renders links and images whose URL has an unsafe scheme as #harmful-link"""
+
+    def _safe_url(self, url):
+        url = super()._safe_url(url)
+        scheme = SCHEME.match(IGNORED_URL_CHARS.sub("", unquote(unescape(url))))
+        if scheme is not None and scheme.group(1).lower() not in SAFE_URL_SCHEMES:
+            return "#harmful-link"
+        return url
+
+
+class MarkdownMemo:
+    """Callable which renders markdown, remembering the most recent results"""
+
+    def __init__(self, markdown, maxsize=1024):
+        self.markdown = markdown
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __call__(self, text):
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = self.markdown(text)
+        with self._lock:
+            self._entries[key] = html
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# for the SRD, which contains HTML of its own
+srd_markdown = MarkdownMemo(
+    create_markdown(escape=False, renderer="html", plugins=PLUGINS)
+)
+# for text written by users, whose HTML is escaped
+user_markdown = MarkdownMemo(
+    create_markdown(
+        escape=True, renderer=SafeHTMLRenderer(escape=True), plugins=PLUGINS
+    )
+)
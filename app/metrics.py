@@ -0,0 +1,286 @@
+"""
+Opt-in metrics shared by every uWSGI worker process.
+Each worker counts in memory and periodically adds its counts into a small
+SQLite side-database, which the /metrics endpoint reads back and renders in
+the Prometheus text format. Set METRICS in .env to enable it.
+"""
+from flask import g, request
+from collections import defaultdict
+from threading import Lock
+import atexit
+import os
+import sqlite3
+import time
+import logging
+
+
+LOG = logging.getLogger(__package__)
+
+# upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+INF = float("inf")
+
+HELP = {
+    "tabletop_request_duration_seconds": ("histogram", "Request latency by endpoint"),
+    "tabletop_db_seconds_total": ("counter", "Time spent in SQL statements"),
+    "tabletop_db_statements_total": ("counter", "Number of SQL statements"),
+    "tabletop_cache_hits_total": ("counter", "Cache hits by cache name"),
+    "tabletop_cache_misses_total": ("counter", "Cache misses by cache name"),
+    "tabletop_charimg_generated_total": (
+        "counter",
+        "Character portraits composited from layers",
+    ),
+}
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value):
+    """Prints integers exactly, since counters must never appear to go backwards"""
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(**labels):
+    """Returns Prometheus label syntax, e.g. endpoint="dashboard.index" """
+    return ",".join(
+        f'{key}="{escape_label(val)}"' for key, val in sorted(labels.items())
+    )
+
+
+class Metrics:
+    def __init__(self):
+        self.path = None
+        self.flush_interval = 5
+        self.caches = {}
+        self._counters = defaultdict(float)
+        self._buckets = defaultdict(int)
+        self._cache_totals = {}
+        self._last_flush = time.monotonic()
+        self._lock = Lock()
+        self._exit_handler = False
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def init_app(self, app):
+        if not app.config.get("METRICS"):
+            return
+        self.path = app.config["METRICS_DB"]
+        self.flush_interval = app.config["METRICS_FLUSH_SECONDS"]
+        self.create_tables()
+        self.reset()
+        if not self._exit_handler:
+            atexit.register(self.flush)
+            self._exit_handler = True
+
+        @app.before_request
+        def start_request_timer():
+            g.metrics_start = time.perf_counter()
+
+        @app.teardown_request
+        def observe_request(exc):
+            start = g.pop("metrics_start", None)
+            if start is None:
+                return
+            endpoint = request.endpoint or "none"
+            self.observe(
+                "tabletop_request_duration_seconds",
+                time.perf_counter() - start,
+                endpoint=endpoint,
+            )
+            sql_stats = g.get("sql_stats")
+            if sql_stats is not None:
+                self.increment(
+                    "tabletop_db_seconds_total", sql_stats.db_time, endpoint=endpoint
+                )
+                self.increment(
+                    "tabletop_db_statements_total",
+                    sql_stats.statements,
+                    endpoint=endpoint,
+                )
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def create_tables(self):
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with self.connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS counter "
+                "(name TEXT, labels TEXT, value REAL, PRIMARY KEY (name, labels))"
+            )
+            # the +Inf bucket's le is stored as infinity, since a NULL never
+            # conflicts with the primary key, so its rows would never be added up
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS bucket "
+                "(name TEXT, labels TEXT, le REAL, value INTEGER, "
+                "PRIMARY KEY (name, labels, le))"
+            )
+        connection.close()
+
+    def reset(self):
+        """Forgets counts which were not flushed yet"""
+        with self._lock:
+            self._counters.clear()
+            self._buckets.clear()
+            self._last_flush = time.monotonic()
+
+    def register_cache(self, name, cache):
+        """Receives an object with `hits` and `misses` attributes to export"""
+        self.caches[name] = cache
+
+    def increment(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[(name, format_labels(**labels))] += value
+
+    def observe(self, name, value, **labels):
+        """Adds one observation to a histogram"""
+        if not self.enabled:
+            return
+        le = next((bound for bound in LATENCY_BUCKETS if value <= bound), INF)
+        labels = format_labels(**labels)
+        with self._lock:
+            self._buckets[(name, labels, le)] += 1
+            self._counters[(f"{name}_sum", labels)] += value
+            self._counters[(f"{name}_count", labels)] += 1
+
+    def _collect_caches(self):
+        for name, cache in self.caches.items():
+            for attr in ("hits", "misses"):
+                total = getattr(cache, attr)
+                previous = self._cache_totals.get((name, attr), 0)
+                self._cache_totals[(name, attr)] = total
+                if total > previous:
+                    self.increment(
+                        f"tabletop_cache_{attr}_total", total - previous, cache=name
+                    )
+
+    def flush(self):
+        """Adds this worker's counts into the shared database and resets them"""
+        if not self.enabled:
+            return
+        self._collect_caches()
+        with self._lock:
+            counters, self._counters = self._counters, defaultdict(float)
+            buckets, self._buckets = self._buckets, defaultdict(int)
+            self._last_flush = time.monotonic()
+        if not counters and not buckets:
+            return
+        try:
+            connection = self.connect()
+            with connection:
+                connection.executemany(
+                    "INSERT INTO counter VALUES (?, ?, ?) ON CONFLICT (name, labels) "
+                    "DO UPDATE SET value = value + excluded.value",
+                    [(name, labels, val) for (name, labels), val in counters.items()],
+                )
+                connection.executemany(
+                    "INSERT INTO bucket VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (name, labels, le) "
+                    "DO UPDATE SET value = value + excluded.value",
+                    [
+                        (name, labels, le, val)
+                        for (name, labels, le), val in buckets.items()
+                    ],
+                )
+            connection.close()
+        except sqlite3.Error as e:
+            LOG.error(f"Failed to flush metrics to {self.path}: {str(e)}")
+
+    def read(self):
+        """
+        Returns tuple of dicts from the shared database: counters keyed by
+        (name, labels) and cumulative histograms keyed by (name, labels),
+        which are lists of (upper bound, count) ending with +Inf
+        """
+        connection = self.connect()
+        counters = {
+            (name, labels): value
+            for name, labels, value in connection.execute(
+                "SELECT name, labels, value FROM counter ORDER BY name, labels"
+            )
+        }
+        buckets = defaultdict(dict)
+        for name, labels, le, value in connection.execute(
+            "SELECT name, labels, le, value FROM bucket"
+        ):
+            buckets[(name, labels)][le] = value
+        connection.close()
+        histograms = {}
+        for key, counts in sorted(buckets.items()):
+            total = 0
+            histograms[key] = []
+            for le in (*LATENCY_BUCKETS, INF):
+                total += counts.get(le, 0)
+                histograms[key].append((le, total))
+        return counters, histograms
+
+    def render(self):
+        """Returns the shared metrics in the Prometheus text exposition format"""
+        self.flush()
+        counters, histograms = self.read()
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name in described or name not in HELP:
+                return
+            described.add(name)
+            kind, text = HELP[name]
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), cumulative in histograms.items():
+            describe(name)
+            for le, count in cumulative:
+                le = "+Inf" if le == INF else repr(le)
+                bucket_labels = f'{labels},le="{le}"' if labels else f'le="{le}"'
+                lines.append(f"{name}_bucket{{{bucket_labels}}} {count}")
+            for suffix in ("_sum", "_count"):
+                value = counters.pop((f"{name}{suffix}", labels), 0)
+                lines.append(f"{name}{suffix}{{{labels}}} {format_value(value)}")
+        for (name, labels), value in counters.items():
+            describe(name)
+            labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def quantile(q, cumulative):
+    """
+    Estimates a quantile from a cumulative histogram the same way as
+    Prometheus' histogram_quantile, by interpolating inside the bucket
+    """
+    total = cumulative[-1][1]
+    if total == 0:
+        return None
+    rank = q * total
+    lower_bound, lower_count = 0.0, 0
+    for le, count in cumulative:
+        if count >= rank:
+            if le == INF:
+                return lower_bound
+            if count == lower_count:
+                return le
+            return lower_bound + (le - lower_bound) * (rank - lower_count) / (
+                count - lower_count
+            )
+        lower_bound, lower_count = le, count
+    return lower_bound
+
+
+metrics = Metrics()
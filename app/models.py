@@ -1,9 +1,22 @@
 from .plugins import plugins
 from itsdangerous import TimedJSONWebSignatureSerializer
 import os
+import hashlib
+import json
+import copy
 from dnd_character import Character
-from .dnd_campaign import Combat, NPC
+from .dnd_campaign import Combat, NPC, CHARACTER_TYPE, NPC_TYPE
+from .dnd_campaign.combat import roll_data, turn_order
+from .dnd_campaign.combat_log import CombatLog, SNAPSHOT_INTERVAL, hp_key
+from .live import live_updates
 from ast import literal_eval
+from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import flag_modified
+from .character_data import (
+    encode_character_data,
+    character_data_cache,
+)
+from .markup import user_markdown, USER_MARKDOWN_VERSION
 
 # plugins = create_plugins()
 db, migrate, bcrypt, login_manager = plugins
@@ -64,7 +77,9 @@ class User(db.Model):
 
 class SceneNPC(db.Model):
     id = db.Column(db.Integer, primary_key=True, nullable=False)
-    scene_id = db.Column(db.Integer, db.ForeignKey("location_scene.id"), nullable=False)
+    scene_id = db.Column(
+        db.Integer, db.ForeignKey("location_scene.id"), nullable=False, index=True
+    )
     name = db.Column(db.String(127), nullable=False)
     # string literal for a dict
     data = db.Column(db.String(2048), nullable=False)
@@ -72,105 +87,766 @@ class SceneNPC(db.Model):
     def as_dict(self):
         return literal_eval(self.data)
 
+    @property
+    def data_hash(self):
+        """Changes whenever the data is edited, so it can key cached cards"""
+        return hashlib.sha1(self.data.encode("utf-8")).hexdigest()
+
     @property
     def npc(self):
         return NPC(**self.as_dict())
 
 
-class LocationScene(db.Model):
+class RenderedDescription:
+    """
+    Mixin for a model with a markdown description, which keeps the rendered
+    HTML in description_html whenever the description is set
+    """
+
+    description_html = db.Column(db.Text, nullable=True)
+    # USER_MARKDOWN_VERSION which rendered description_html
+    description_html_version = db.Column(db.Integer, nullable=True)
+
+    @validates("description")
+    def render_description(self, key, description):
+        self.description_html = (
+            None if description is None else user_markdown(description)
+        )
+        self.description_html_version = USER_MARKDOWN_VERSION
+        return description
+
+    @property
+    def rendered_description(self):
+        """
+        Returns HTML of the description, rendering it if it was never saved
+        or was saved by another version of user_markdown
+        """
+        if self.description is not None and (
+            self.description_html is None
+            or self.description_html_version != USER_MARKDOWN_VERSION
+        ):
+            return user_markdown(self.description)
+        return self.description_html
+
+
+class LocationScene(RenderedDescription, db.Model):
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     location_id = db.Column(
-        db.Integer, db.ForeignKey("campaign_location.id"), nullable=False
+        db.Integer, db.ForeignKey("campaign_location.id"), nullable=False, index=True
     )
     name = db.Column(db.String(127), nullable=False)
     description = db.Column(db.String(2048), nullable=True)
-
-    @property
-    def npcs(self):
-        npcs = SceneNPC.query.filter_by(scene_id=self.id).all()
-        if None in npcs:
-            npcs.pop(npcs.index(None))
-        return npcs
+    npcs = db.relationship(
+        "SceneNPC", order_by="SceneNPC.id", cascade="all, delete-orphan"
+    )
 
 
-class CampaignLocation(db.Model):
+class CampaignLocation(RenderedDescription, db.Model):
     """
     A location within a GameCampaign which has a name, description, and scenes
     """
 
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     campaign_id = db.Column(
-        db.Integer, db.ForeignKey("game_campaign.id"), nullable=False
+        db.Integer, db.ForeignKey("game_campaign.id"), nullable=False, index=True
     )
     name = db.Column(db.String(127), nullable=False)
     description = db.Column(db.String(2048), nullable=True)
+    scenes = db.relationship(
+        "LocationScene", order_by="LocationScene.id", cascade="all, delete-orphan"
+    )
+
+
+campaign_member = db.Table(
+    "campaign_member",
+    db.Column(
+        "campaign_id",
+        db.Integer,
+        db.ForeignKey("game_campaign.id"),
+        primary_key=True,
+    ),
+    db.Column(
+        "character_id",
+        db.Integer,
+        db.ForeignKey("game_character.id"),
+        primary_key=True,
+        index=True,
+    ),
+)
 
 
 class GameCampaign(db.Model):
     """
-    A campaign of D&D with 1 gamemaster (User) and 2-6 GameCharacters
+    A campaign of D&D with 1 gamemaster (User) and any number of GameCharacters
     """
 
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     name = db.Column(db.String(127), nullable=False)
-    gamemaster = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    gamemaster = db.Column(
+        db.Integer, db.ForeignKey("user.id"), nullable=False, index=True
+    )
     active_location = db.Column(
         db.Integer, db.ForeignKey("campaign_location.id"), nullable=False
     )
     # the gamemaster is a user, but the players are characters
-    character1 = db.Column(
-        db.Integer, db.ForeignKey("game_character.id"), nullable=True
-    )
-    character2 = db.Column(
-        db.Integer, db.ForeignKey("game_character.id"), nullable=True
-    )
-    character3 = db.Column(
-        db.Integer, db.ForeignKey("game_character.id"), nullable=True
-    )
-    character4 = db.Column(
-        db.Integer, db.ForeignKey("game_character.id"), nullable=True
+    members = db.relationship(
+        "GameCharacter",
+        secondary=campaign_member,
+        order_by="GameCharacter.id",
+        backref="campaigns",
     )
-    character5 = db.Column(
-        db.Integer, db.ForeignKey("game_character.id"), nullable=True
+    locations = db.relationship(
+        "CampaignLocation",
+        foreign_keys="CampaignLocation.campaign_id",
+        order_by="CampaignLocation.id",
     )
-    character6 = db.Column(
-        db.Integer, db.ForeignKey("game_character.id"), nullable=True
-    )
-    # string literal for a dict which creates a Combat object
-    combat_data = db.Column(db.String(1024), nullable=False)
+    combat_state = db.relationship("CampaignCombat", uselist=False)
+    # incremented by SQLAlchemy on every UPDATE, which only matches the row
+    # if nobody else updated it since it was read (compare-and-swap)
+    version = db.Column(db.Integer, nullable=False)
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __init__(self, **kwargs):
-        if "combat_data" not in kwargs:
-            kwargs["combat_data"] = str(Combat())
+        kwargs.setdefault("combat_state", CampaignCombat())
         super().__init__(**kwargs)
 
     def get_combat(self):
-        return Combat(**literal_eval(self.combat_data))
+        """Returns a Combat made from this campaign's CampaignCombat and its combatants"""
+        return self.combat_state.combat(
+            CampaignCombatant.query.filter_by(campaign_id=self.id)
+            .order_by(CampaignCombatant.id)
+            .all()
+        )
+
+    def save_combat(self, combat):
+        """
+        Replaces this campaign's combat rows with the state of a Combat.
+        The flush raises StaleDataError if the combat changed since get_combat
+        """
+        header = self.combat_state
+        header.scene_id = combat.scene_id
+        header.active = combat.active
+        header.turn_index = combat.turn_index
+        header.round = combat.round
+        header.claim()
+        CampaignCombatant.query.filter_by(campaign_id=self.id).delete()
+        db.session.add_all(CampaignCombatant.from_combat(self.id, combat))
 
     def set_combat(self, scene_id, characters):
         scene = LocationScene.query.get(scene_id)
         characters = [GameCharacter.query.get(char_id) for char_id in characters]
-        self.combat_data = str(
-            Combat(
-                scene_id=scene_id,
-                characters=[
-                    (character.id, character.character.dexterity)
-                    for character in characters
-                ],
-                npcs=[]
-                if scene is None
-                else [(npc.id, npc.npc.dexterity) for npc in scene.npcs],
+        combat = Combat(
+            scene_id=scene_id,
+            characters=[
+                (character.id, character.character.dexterity)
+                for character in characters
+            ],
+            npcs=[]
+            if scene is None
+            else [(npc.id, npc.npc.dexterity) for npc in scene.npcs],
+        )
+        self.save_combat(combat)
+        self.record_combat_event(
+            "scene",
+            {
+                "scene_id": combat.scene_id,
+                "characters": [list(each) for each in combat.characters],
+                "npcs": [list(each) for each in combat.npcs],
+            },
+            combat.round,
+        )
+
+    def start_combat(self, combat):
+        """Receives this campaign's Combat, then rolls initiative and starts it"""
+        combat.active = True
+        self.save_combat(combat)
+        hp = {
+            hp_key(*key): combatant_hp(row)
+            for key, row in self.combatant_rows(
+                (each.type, each.id) for each in combat.turn_sequence
+            ).items()
+        }
+        self.record_combat_event(
+            "start",
+            {
+                "turn_sequence": [list(each) for each in combat.turn_sequence],
+                "hp": hp,
+            },
+            combat.round,
+        )
+
+    def end_combat(self, combat):
+        """Receives this campaign's Combat and ends it"""
+        data = {
+            "turn_sequence": [list(each) for each in combat.turn_sequence],
+            "turn_index": combat.turn_index,
+            "round": combat.round,
+        }
+        combat.active = False
+        self.save_combat(combat)
+        self.record_combat_event("end", data, combat.round)
+
+    def add_combatant(self, combat, combatant_id, combatant_type, dex, hp=None):
+        """
+        Receives this campaign's Combat and adds a late joiner to it
+        with one INSERT, without rolling initiative again for anyone else
+        """
+        roll = combat.add_combatant(combatant_id, combatant_type, dex)
+        db.session.add(
+            CampaignCombatant(
+                campaign_id=self.id,
+                combatant_type=combatant_type,
+                combatant_id=combatant_id,
+                dex=dex,
+                **(CampaignCombatant.initiative_of(roll) if combat.active else {}),
+            )
+        )
+        self.combat_state.turn_index = combat.turn_index
+        self.record_combat_event(
+            "add",
+            {
+                "id": combatant_id,
+                "type": combatant_type,
+                "roll": list(roll) if combat.active else None,
+                "dex": dex,
+                "hp": hp,
+            },
+            combat.round,
+        )
+
+    def remove_combatant(self, combat, combatant_id, combatant_type):
+        """Receives this campaign's Combat and removes a combatant's rows from it"""
+        roster = combat.characters if combatant_type == CHARACTER_TYPE else combat.npcs
+        data = {
+            "id": combatant_id,
+            "type": combatant_type,
+            "rolls": [
+                list(each)
+                for each in combat.turn_sequence
+                if each.id == combatant_id and each.type == combatant_type
+            ],
+            "roster": [list(each) for each in roster if each.id == combatant_id],
+            "turn_index": combat.turn_index,
+        }
+        combat.remove_combatant(combatant_id, combatant_type)
+        CampaignCombatant.query.filter_by(
+            campaign_id=self.id,
+            combatant_type=combatant_type,
+            combatant_id=combatant_id,
+        ).delete(synchronize_session=False)
+        self.combat_state.turn_index = combat.turn_index
+        self.record_combat_event("remove", data, combat.round)
+
+    def next_turn(self):
+        """
+        Advances this campaign's active combat to the next turn with a single
+        UPDATE, which reads the turn in SQL so concurrent advances all count.
+        Returns False if the campaign is not in combat
+        """
+        turns = (
+            db.select([db.func.count(CampaignCombatant.id)])
+            .where(CampaignCombatant.campaign_id == self.id)
+            .where(CampaignCombatant.initiative.isnot(None))
+            .as_scalar()
+        )
+        next_index = CampaignCombat.turn_index + 1
+        updated = (
+            CampaignCombat.query.filter_by(campaign_id=self.id, active=True)
+            .filter(CampaignCombat.scene_id != 0)
+            .update(
+                {
+                    "turn_index": db.case([(next_index >= turns, 0)], else_=next_index),
+                    "round": db.case(
+                        [(next_index >= turns, CampaignCombat.round + 1)],
+                        else_=CampaignCombat.round,
+                    ),
+                    "version": CampaignCombat.version + 1,
+                },
+                synchronize_session=False,
+            )
+        )
+        if updated != 1:
+            return False
+        live_updates.changed(self)
+        # the event's round is copied from the row, which still isn't parsed
+        db.session.execute(
+            CombatEvent.__table__.insert().from_select(
+                ["campaign_id", "kind", "data", "round"],
+                db.select(
+                    [
+                        CampaignCombat.campaign_id,
+                        db.literal("next"),
+                        db.literal("{}"),
+                        CampaignCombat.round,
+                    ]
+                ).where(CampaignCombat.campaign_id == self.id),
+            )
+        )
+        self.snapshot_combat_log()
+        return True
+
+    def record_combat_event(self, kind, data, round):
+        """
+        Appends an event to this campaign's combat log. Claims the combat, so the
+        event is only committed if nobody else changed the combat in the meantime
+        """
+        self.combat_state.claim()
+        db.session.add(
+            CombatEvent(
+                campaign_id=self.id,
+                kind=kind,
+                data=json.dumps(data, separators=(",", ":")),
+                round=round,
+            )
+        )
+        db.session.flush()
+        self.snapshot_combat_log()
+        live_updates.changed(self)
+
+    def snapshot_combat_log(self):
+        """Writes a snapshot of the combat log if SNAPSHOT_INTERVAL events followed the last one"""
+        latest = (
+            db.select([db.func.coalesce(db.func.max(CombatSnapshot.event_id), 0)])
+            .where(CombatSnapshot.campaign_id == self.id)
+            .as_scalar()
+        )
+        events = (
+            CombatEvent.query.filter_by(campaign_id=self.id)
+            .filter(CombatEvent.id > latest)
+            .count()
+        )
+        if events >= SNAPSHOT_INTERVAL:
+            log = self.combat_log()
+            db.session.add(
+                CombatSnapshot(
+                    campaign_id=self.id,
+                    event_id=log.event_id,
+                    data=json.dumps(log.snapshot(), separators=(",", ":")),
+                )
+            )
+
+    def combat_log(self, until=None):
+        """
+        Returns the CombatLog of this campaign after its latest event (or after
+        event id `until`), from the latest snapshot and the events since it
+        """
+        snapshots = CombatSnapshot.query.filter_by(campaign_id=self.id)
+        if until is not None:
+            snapshots = snapshots.filter(CombatSnapshot.event_id <= until)
+        snapshot = snapshots.order_by(CombatSnapshot.event_id.desc()).first()
+        log = (
+            CombatLog()
+            if snapshot is None
+            else CombatLog.from_snapshot(snapshot.as_dict())
+        )
+        events = CombatEvent.query.filter_by(campaign_id=self.id).filter(
+            CombatEvent.id > log.event_id
+        )
+        if until is not None:
+            events = events.filter(CombatEvent.id <= until)
+        return log.replay(
+            event.entry() for event in events.order_by(CombatEvent.id).all()
+        )
+
+    def undo_combat(self):
+        """Undoes the latest combat event. Returns False if there is nothing to undo"""
+        return self._revisit_combat_event("undo")
+
+    def redo_combat(self):
+        """Redoes the latest undone combat event. Returns False if there is none"""
+        return self._revisit_combat_event("redo")
+
+    def _revisit_combat_event(self, kind):
+        log = self.combat_log()
+        stack = log.undo if kind == "undo" else log.redo
+        if not stack:
+            return False
+        event = CombatEvent.query.get(stack[-1])
+        data = {"event": event.id, "kind": event.kind, "data": event.as_dict()}
+        log.apply(None, kind, data)
+        # e.g., undoing the removal of an NPC which was then deleted
+        combat = log.combat
+        keys = {(each.type, each.id) for each in combat.turn_sequence}
+        keys.update((CHARACTER_TYPE, each.id) for each in combat.characters)
+        keys.update((NPC_TYPE, each.id) for each in combat.npcs)
+        rows = self.combatant_rows(keys)
+        gone = sorted(key for key in keys if key not in rows)
+        if gone:
+            data["gone"] = [list(key) for key in gone]
+            log.remove_gone(data)
+        self.save_combat(log.combat)
+        self.record_combat_event(kind, data, log.combat.round)
+        if event.kind == "hp":
+            # the HP which the log now has is written back to the character or NPC
+            change = data["data"]
+            key = (change["type"], change["id"])
+            row = self.combatant_rows([key]).get(key)
+            if row is not None:
+                set_combatant_hp(row, change["old" if kind == "undo" else "new"])
+        return True
+
+    def combat_round(self, round):
+        """
+        Returns the CombatLog from before a round of this campaign's latest combat,
+        list of (CombatEvent, CombatLog after it) for each event in the round,
+        and the number of rounds in the combat. Replays from the latest snapshot
+        before the round, so earlier rounds aren't read. Returns None if there
+        is no such round
+        """
+        start = (
+            db.session.query(db.func.max(CombatEvent.id))
+            .filter_by(campaign_id=self.id, kind="start")
+            .scalar()
+        )
+        if start is None:
+            return None
+        # the combat lasts until the scene changes
+        end = (
+            db.session.query(db.func.min(CombatEvent.id))
+            .filter_by(campaign_id=self.id, kind="scene")
+            .filter(CombatEvent.id > start)
+            .scalar()
+        )
+        events = CombatEvent.query.filter_by(campaign_id=self.id).filter(
+            CombatEvent.id >= start
+        )
+        if end is not None:
+            events = events.filter(CombatEvent.id < end)
+        first, last, rounds = (
+            events.with_entities(
+                db.func.min(db.case([(CombatEvent.round == round, CombatEvent.id)])),
+                db.func.max(db.case([(CombatEvent.round == round, CombatEvent.id)])),
+                db.func.max(CombatEvent.round),
             )
+            .order_by(None)
+            .one()
+        )
+        if first is None:
+            return None
+        log = self.combat_log(until=first - 1)
+        start = copy.deepcopy(log)
+        frames = []
+        for event in (
+            events.filter(CombatEvent.id.between(first, last))
+            .order_by(CombatEvent.id)
+            .all()
+        ):
+            log.apply(*event.entry())
+            frames.append((event, copy.deepcopy(log)))
+        return start, frames, rounds
+
+    @staticmethod
+    def record_hp_change(combatant_type, combatant_id, old, new):
+        """Records an HP change in the log of every active combat which the combatant is in"""
+        if old == new:
+            return
+        campaign_ids = (
+            db.session.query(CampaignCombatant.campaign_id)
+            .filter_by(combatant_type=combatant_type, combatant_id=combatant_id)
+            .filter(CampaignCombatant.initiative.isnot(None))
+            .distinct()
         )
+        for campaign in GameCampaign.query.filter(
+            GameCampaign.id.in_(campaign_ids)
+        ).all():
+            campaign.record_combat_event(
+                "hp",
+                {"id": combatant_id, "type": combatant_type, "old": old, "new": new},
+                campaign.combat_state.round,
+            )
+
+    def live_state(self):
+        """
+        Returns dict of JSON values which live updates push to this campaign's
+        viewers: the active location and scene, and the combat's turn order
+        """
+        # next_turn doesn't update the loaded row, so it's read again
+        CampaignCombat.query.populate_existing().get(self.id)
+        combat = self.get_combat()
+        rows = self.combatants(combat)
+        return {
+            "location_id": int(self.active_location),
+            "scene_id": combat.scene_id,
+            "active": combat.active,
+            "round": combat.round,
+            "turn_index": combat.turn_index,
+            "turn_sequence": [
+                {
+                    "type": combatant.type,
+                    "id": combatant.id,
+                    "name": None if row is None else row.name,
+                    "initiative": combatant.initiative,
+                }
+                for combatant, row in zip(combat.turn_sequence, rows)
+            ],
+        }
+
+    def location_tree(self):
+        """
+        Returns this campaign's CampaignLocations with their scenes and the
+        scenes' NPCs already loaded, in three queries no matter the campaign size
+        """
+        return (
+            CampaignLocation.query.filter_by(campaign_id=self.id)
+            .options(
+                db.selectinload(CampaignLocation.scenes).selectinload(
+                    LocationScene.npcs
+                )
+            )
+            .order_by(CampaignLocation.id)
+            .all()
+        )
+
+    def combatants(self, combat):
+        """
+        Receives this campaign's Combat object and returns the database rows
+        of its turn sequence in order (None for rows which were deleted)
+        Uses at most one query for NPCs and one for characters
+        """
+        rows = self.combatant_rows(
+            (combatant.type, combatant.id) for combatant in combat.turn_sequence
+        )
+        return [
+            rows.get((combatant.type, combatant.id))
+            for combatant in combat.turn_sequence
+        ]
+
+    @staticmethod
+    def combatant_rows(keys):
+        """
+        Receives iterable of (combatant type, id) and returns dict of them to their
+        GameCharacter or SceneNPC rows (missing if deleted), in at most two queries
+        """
+        ids = {CHARACTER_TYPE: set(), NPC_TYPE: set()}
+        for combatant_type, combatant_id in keys:
+            ids[combatant_type].add(combatant_id)
+        rows = {}
+        for combatant_type, model in (
+            (CHARACTER_TYPE, GameCharacter),
+            (NPC_TYPE, SceneNPC),
+        ):
+            if ids[combatant_type]:
+                rows.update(
+                    ((combatant_type, row.id), row)
+                    for row in model.query.filter(model.id.in_(ids[combatant_type]))
+                )
+        return rows
 
     def characters(self):
+        """Returns list of the ids of GameCharacters playing in this campaign"""
+        return [character.id for character in self.members]
+
+    def has_member(self, user_id):
+        """
+        Checks if the user plays in this campaign with any of their characters,
+        with one indexed join instead of loading the members
+        """
+        return (
+            db.session.query(campaign_member)
+            .join(GameCharacter, GameCharacter.id == campaign_member.c.character_id)
+            .filter(
+                campaign_member.c.campaign_id == self.id,
+                GameCharacter.user_id == user_id,
+            )
+            .first()
+            is not None
+        )
+
+    @staticmethod
+    def query_for_user(user_id):
+        """
+        Query for every campaign which the user is either gamemastering
+        or playing in with one of their characters
+        """
+        playing = (
+            db.session.query(campaign_member.c.campaign_id)
+            .join(GameCharacter, GameCharacter.id == campaign_member.c.character_id)
+            .filter(GameCharacter.user_id == user_id)
+        )
+        return GameCampaign.query.filter(
+            db.or_(
+                GameCampaign.gamemaster == user_id,
+                GameCampaign.id.in_(playing),
+            )
+        )
+
+
+def combatant_hp(row):
+    """Returns the current HP of a GameCharacter or SceneNPC row"""
+    if isinstance(row, GameCharacter):
+        return row.as_dict()["hp"]
+    return row.as_dict()["hit_points"]
+
+
+def set_combatant_hp(row, hp):
+    """Changes the current HP of a GameCharacter or SceneNPC row"""
+    data = row.as_dict()
+    if isinstance(row, GameCharacter):
+        data["hp"] = hp
+        row.update_data(data)
+    else:
+        data["hit_points"] = hp
+        row.data = str(data)
+    db.session.add(row)
+
+
+class CombatEvent(db.Model):
+    """
+    An event in the append-only log of a campaign's combats, which is replayed
+    by dnd_campaign.CombatLog. Rows are never updated or deleted
+    """
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    campaign_id = db.Column(
+        db.Integer, db.ForeignKey("game_campaign.id"), nullable=False, index=True
+    )
+    kind = db.Column(db.String(16), nullable=False)
+    # JSON object of the event's data
+    data = db.Column(db.Text, nullable=False)
+    # the combat's round after this event, which the replay is grouped by
+    round = db.Column(db.Integer, nullable=False)
+
+    def as_dict(self):
+        return json.loads(self.data)
+
+    def entry(self):
+        """Returns (id, kind, data) for CombatLog.apply"""
+        return self.id, self.kind, self.as_dict()
+
+
+class CombatSnapshot(db.Model):
+    """The CombatLog of a campaign after one of its events"""
+
+    campaign_id = db.Column(
+        db.Integer, db.ForeignKey("game_campaign.id"), primary_key=True
+    )
+    # 0 for the state from before the log was kept
+    event_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # JSON object from CombatLog.snapshot
+    data = db.Column(db.Text, nullable=False)
+
+    def as_dict(self):
+        return json.loads(self.data)
+
+
+class CampaignCombat(db.Model):
+    """
+    The combat in a campaign's active scene. Each combatant is a
+    CampaignCombatant row, so advancing a turn only updates this row
+    """
+
+    campaign_id = db.Column(
+        db.Integer, db.ForeignKey("game_campaign.id"), primary_key=True
+    )
+    scene_id = db.Column(db.Integer, nullable=False, default=0)
+    active = db.Column(db.Boolean, nullable=False, default=False)
+    turn_index = db.Column(db.Integer, nullable=False, default=0)
+    round = db.Column(db.Integer, nullable=False, default=1)
+    # compared and incremented by every write, like GameCampaign.version
+    version = db.Column(db.Integer, nullable=False)
+
+    __mapper_args__ = {"version_id_col": version}
+
+    def claim(self):
+        """
+        Makes the next flush UPDATE this row even if no column changed, so
+        rows written with it (e.g., its combatants) are only committed if
+        this combat wasn't changed by anyone else in the meantime
+        """
+        flag_modified(self, "turn_index")
+
+    def combat(self, combatants):
+        """Receives this combat's CampaignCombatants and returns a Combat object"""
+        return Combat(
+            scene_id=self.scene_id,
+            active=self.active,
+            characters=[
+                (row.combatant_id, row.dex)
+                for row in combatants
+                if row.combatant_type == CHARACTER_TYPE
+            ],
+            npcs=[
+                (row.combatant_id, row.dex)
+                for row in combatants
+                if row.combatant_type == NPC_TYPE
+            ],
+            turn_sequence=sorted(
+                (
+                    roll_data(
+                        row.combatant_id,
+                        row.combatant_type,
+                        row.initiative,
+                        row.dex_modifier,
+                        row.tiebreak,
+                    )
+                    for row in combatants
+                    if self.active and row.initiative is not None
+                ),
+                key=turn_order,
+            ),
+            turn_index=self.turn_index,
+            round=self.round,
+        )
+
+
+class CampaignCombatant(db.Model):
+    """
+    A character or NPC in a campaign's combat, and their initiative roll
+    while the combat is active (otherwise the roll is null)
+    """
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    campaign_id = db.Column(
+        db.Integer, db.ForeignKey("game_campaign.id"), nullable=False, index=True
+    )
+    # CHARACTER_TYPE for a GameCharacter id, NPC_TYPE for a SceneNPC id
+    combatant_type = db.Column(db.Integer, nullable=False)
+    combatant_id = db.Column(db.Integer, nullable=False)
+    dex = db.Column(db.Integer, nullable=False)
+    initiative = db.Column(db.Integer, nullable=True)
+    dex_modifier = db.Column(db.Integer, nullable=True)
+    tiebreak = db.Column(db.Float, nullable=True)
+
+    @staticmethod
+    def initiative_of(roll):
+        """Returns dict of the columns of a roll_data"""
+        return {
+            "initiative": roll.initiative,
+            "dex_modifier": roll.dex,
+            "tiebreak": roll.tiebreak,
+        }
+
+    @classmethod
+    def from_combat(cls, campaign_id, combat):
+        """Returns list of new rows for every combatant in a Combat"""
+        dex = {
+            **{(CHARACTER_TYPE, each.id): each.dex for each in combat.characters},
+            **{(NPC_TYPE, each.id): each.dex for each in combat.npcs},
+        }
+        if not combat.active:
+            return [
+                cls(
+                    campaign_id=campaign_id,
+                    combatant_type=combatant_type,
+                    combatant_id=each.id,
+                    dex=each.dex,
+                )
+                for combatant_type, roster in (
+                    (CHARACTER_TYPE, combat.characters),
+                    (NPC_TYPE, combat.npcs),
+                )
+                for each in roster
+            ]
         return [
-            self.character1,
-            self.character2,
-            self.character3,
-            self.character4,
-            self.character5,
-            self.character6,
+            cls(
+                campaign_id=campaign_id,
+                combatant_type=roll.type,
+                combatant_id=roll.id,
+                dex=dex.get((roll.type, roll.id), 10),
+                **cls.initiative_of(roll),
+            )
+            for roll in combat.turn_sequence
         ]
 
 
@@ -180,12 +856,18 @@ class GameCharacter(db.Model):
     """
 
     id = db.Column(db.Integer, primary_key=True, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("user.id"), nullable=False, index=True
+    )
     name = db.Column(db.String(127), nullable=False)
-    data_keys = db.Column(db.String(1024), nullable=False)
-    data_vals = db.Column(db.String(4096), nullable=False)
+    # JSON object of a Character's keys and values
+    data = db.Column(db.Text, nullable=False)
+    # incremented by SQLAlchemy on every UPDATE; keys the decoded data cache
+    version = db.Column(db.Integer, nullable=False)
     visual_design = db.Column(db.String(512), nullable=False)
 
+    __mapper_args__ = {"version_id_col": version}
+
     def __init__(self, **kwargs):
         if "visual_design" not in kwargs:
             kwargs["visual_design"] = str(
@@ -197,6 +879,8 @@ class GameCharacter(db.Model):
                     "hat": "None",
                 }
             )
+        if isinstance(kwargs.get("data"), dict):
+            kwargs["data"] = encode_character_data(kwargs["data"])
         super().__init__(**kwargs)
 
     @property
@@ -204,26 +888,22 @@ class GameCharacter(db.Model):
         """Returns dict of visual design configuration for this character"""
         return literal_eval(self.visual_design)
 
-    def keys(self):
-        return self.data_keys[2:-2].split("', '")
-
-    def values(self):
-        return literal_eval(self.data_vals)
-
     def as_dict(self):
-        return dict(zip(self.keys(), self.values()))
+        """
+        Returns a private copy of this character's data, decoded at most once
+        per row version in this process
+        """
+        return character_data_cache.get(self.id, self.version, self.data)
 
     def update_data(self, data):
         # remove armour class so it will be recalculated properly
         del data["armour_class"]
         new = Character(**data)
-        self.data_keys = str(new.keys())
-        self.data_vals = str(new.values())
+        self.data = encode_character_data(dict(new))
 
     @property
     def character(self):
         """
         Return a real Character object using the data in this database row
         """
-        i = 0
         return Character(**self.as_dict())
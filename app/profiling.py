@@ -0,0 +1,177 @@
+"""
+On-demand profiling of single requests for administrators.
+Add ?profile=1 or an X-Profile header to any request while logged in as an
+administrator to run it under a profiler. Uses pyinstrument's sampling profiler
+when it is installed, otherwise cProfile. Results are saved into PROFILE_DIR
+and listed at /admin/profiles, with an HTML summary and the profiler's own file
+to download: a .prof for pstats or snakeviz, or a .pyisession which
+`pyinstrument --load` opens (pyinstrument 4 or newer)
+"""
+from flask import g, request, render_template
+from flask_login import current_user
+import cProfile
+import pstats
+import json
+import os
+import re
+import time
+import logging
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+
+LOG = logging.getLogger(__package__)
+
+# names of saved profiles, which are used in URLs
+PROFILE_NAME = re.compile(r"^[0-9]+-[0-9]+$")
+
+
+class CProfileRun:
+    kind = "cProfile"
+    extension = ".prof"
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, path, meta):
+        """Saves a .prof file and returns the HTML summary"""
+        self.profile.dump_stats(f"{path}.prof")
+        stats = pstats.Stats(self.profile)
+        total = max(stats.total_tt, 1e-9)
+        rows = []
+        for (filename, line, function), (
+            primitive_calls,
+            calls,
+            own_time,
+            cumulative_time,
+            callers,
+        ) in stats.stats.items():
+            rows.append(
+                {
+                    "function": function,
+                    "location": f"{filename}:{line}",
+                    "calls": calls,
+                    "own_ms": own_time * 1000,
+                    "cumulative_ms": cumulative_time * 1000,
+                    "percent": min(100, cumulative_time * 100 / total),
+                }
+            )
+        rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+        return render_template("profile_summary.html", meta=meta, rows=rows[:100])
+
+
+class SamplingRun:
+    kind = "pyinstrument"
+    extension = ".pyisession"
+
+    def __init__(self):
+        self.profiler = SamplingProfiler()
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+
+    def save(self, path, meta):
+        """Saves a .pyisession file; pyinstrument makes its own HTML summary"""
+        self.profiler.last_session.save(f"{path}.pyisession")
+        return self.profiler.output_html()
+
+
+class RequestProfiler:
+    def __init__(self):
+        self.directory = None
+        self.keep = 50
+
+    def init_app(self, app):
+        self.directory = app.config["PROFILE_DIR"]
+        self.keep = app.config["PROFILE_KEEP"]
+
+        @app.before_request
+        def start_profile():
+            # only two lookups unless profiling is requested
+            if not (request.args.get("profile") or request.headers.get("X-Profile")):
+                return
+            if not current_user.is_admin_authenticated:
+                return
+            g.profile_start = time.perf_counter()
+            g.profile_run = SamplingRun() if SamplingProfiler else CProfileRun()
+
+        @app.after_request
+        def finish_profile(response):
+            run = g.pop("profile_run", None)
+            if run is None:
+                return response
+            run.stop()
+            duration = (time.perf_counter() - g.pop("profile_start")) * 1000
+            try:
+                response.headers["X-Profile-Id"] = self.save(run, duration, response)
+            except OSError as e:
+                LOG.error(f"Failed to save profile into {self.directory}: {str(e)}")
+            return response
+
+        @app.teardown_request
+        def stop_profile(exc):
+            # after_request is skipped if the view raised an exception
+            run = g.pop("profile_run", None)
+            if run is not None:
+                run.stop()
+
+    def save(self, run, duration, response):
+        """Writes the profile and its summary, returns the new profile's name"""
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        name = f"{time.time_ns()}-{os.getpid()}"
+        path = os.path.join(self.directory, name)
+        meta = {
+            "name": name,
+            "method": request.method,
+            "url": request.full_path.rstrip("?"),
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "duration_ms": duration,
+            "profiler": run.kind,
+            "user": current_user.username,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "download": run.extension,
+        }
+        with open(f"{path}.html", "w") as f:
+            f.write(run.save(path, meta))
+        with open(f"{path}.json", "w") as f:
+            json.dump(meta, f)
+        self.prune()
+        return name
+
+    def recent(self):
+        """Returns list of metadata dicts for saved profiles, newest first"""
+        if not self.directory or not os.path.exists(self.directory):
+            return []
+        profiles = []
+        for filename in sorted(os.listdir(self.directory), reverse=True):
+            name, ext = os.path.splitext(filename)
+            if ext != ".json" or not PROFILE_NAME.match(name):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def prune(self):
+        """Deletes the oldest profiles beyond the configured number to keep"""
+        for meta in self.recent()[self.keep :]:
+            for ext in (".json", ".html", CProfileRun.extension, SamplingRun.extension):
+                try:
+                    os.remove(os.path.join(self.directory, meta["name"] + ext))
+                except FileNotFoundError:
+                    pass
+
+
+request_profiler = RequestProfiler()
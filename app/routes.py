@@ -1,8 +1,23 @@
 import math
 import flask_login
-from flask import Blueprint, render_template, flash, redirect, url_for
+from flask import (
+    Blueprint,
+    render_template,
+    flash,
+    redirect,
+    url_for,
+    abort,
+    current_app,
+    get_flashed_messages,
+    stream_with_context,
+    Response,
+)
 from dnd_character.SRD import SRD_rules
-from mistune import create_markdown
+from collections import namedtuple
+from threading import Lock
+from types import MappingProxyType
+from .http_caching import srd_cacheable
+from .markup import srd_markdown, user_markdown
 
 
 main_routes = Blueprint("main", __name__)
@@ -10,9 +25,13 @@ main_routes = Blueprint("main", __name__)
 
 @main_routes.app_template_filter("markdown")
 def md_to_html(string):
-    return create_markdown(
-        escape=False, renderer="html", plugins=["strikethrough", "table"]
-    )(string)
+    return srd_markdown(string)
+
+
+@main_routes.app_template_filter("user_markdown")
+def user_md_to_html(string):
+    """Jinja filter to render markdown written by users, with HTML escaped"""
+    return "" if string is None else user_markdown(string)
 
 
 @main_routes.app_template_filter("index_to_name")
@@ -49,16 +68,82 @@ def about_page():
     )
 
 
+def stream_template(template_name, **context):
+    """
+    Like render_template, but returns a response which sends the page in chunks
+    as it's rendered, so the browser can start on the head of a long page
+    """
+    current_app.update_template_context(context)
+    # the session is saved before the body is streamed, so flashed messages
+    # have to be taken out of it now (the template gets them from the request)
+    get_flashed_messages()
+    stream = current_app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(size=20)
+    return Response(stream_with_context(stream))
+
+
+RulesSection = namedtuple("RulesSection", ("anchor", "name", "html", "lazy"))
+# sections longer than this are fetched by the rules page when they're opened
+LAZY_SECTION_LENGTH = 8000
+_rules = None
+_rules_lock = Lock()
+
+
+def rendered_rules():
+    """
+    Returns read-only dict mapping each category of SRD rules to a tuple of
+    RulesSections, rendered from markdown once per process
+    """
+    global _rules
+    with _rules_lock:
+        if _rules is None:
+            _rules = MappingProxyType(
+                {
+                    category: tuple(
+                        RulesSection(
+                            url_safe(name),
+                            name,
+                            srd_markdown.markdown(section),
+                            len(section) > LAZY_SECTION_LENGTH,
+                        )
+                        for name, section in sections.items()
+                    )
+                    for category, sections in SRD_rules.items()
+                }
+            )
+    return _rules
+
+
+def rules_section(anchor):
+    """Returns the RulesSection with this anchor, or None"""
+    for sections in rendered_rules().values():
+        for section in sections:
+            if section.anchor == anchor:
+                return section
+    return None
+
+
 @main_routes.route("/rules")
+@srd_cacheable(html=True)
 def rules_page():
-    return render_template(
+    return stream_template(
         "rules.html",
         logged_in=flask_login.current_user.is_authenticated,
         SRD_disclaimer=True,
-        rules=SRD_rules,
+        rules=rendered_rules(),
     )
 
 
+@main_routes.route("/rules/<anchor>")
+@srd_cacheable(html=False)
+def rules_section_fragment(anchor):
+    """The HTML of one section of the rules, for the rules page to lazy-load"""
+    section = rules_section(anchor)
+    if section is None:
+        abort(404)
+    return section.html
+
+
 @main_routes.route("/license/ogl")
 def license_ogl():
     return render_template(
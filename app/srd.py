@@ -0,0 +1,82 @@
+"""
+Read-only views and process-wide indexes of the SRD, built once when this
+module is imported (before uWSGI forks its workers) and never modified afterwards.
+Use these instead of dnd_character's dicts, which are shared by every consumer
+in the process; thaw() makes a private copy when something needs to mutate one
+"""
+from dnd_character.spellcasting import (
+    SRD_spells,
+    SRD_spells_by_class,
+    SRD_spells_by_level,
+)
+from dnd_character.monsters import SRD_monsters
+from dnd_character.equipment import SRD_equipment
+from collections.abc import Mapping
+from types import MappingProxyType
+
+
+def freeze(value):
+    """Returns a deep read-only view of JSON-like data"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(val) for key, val in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(val) for val in value)
+    return value
+
+
+def thaw(value):
+    """Returns a private mutable copy of data made by freeze()"""
+    if isinstance(value, Mapping):
+        return {key: thaw(val) for key, val in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(val) for val in value]
+    return value
+
+
+SPELLS = freeze(SRD_spells)
+MONSTERS = freeze(SRD_monsters)
+EQUIPMENT = freeze(SRD_equipment)
+
+
+SPELL_LEVELS = range(10)
+
+
+def build_spell_index():
+    """
+    Returns read-only dict mapping (class index, spell level) to a tuple of
+    spell keys sorted by spell name
+    """
+    index = {}
+    for classs, class_spells in SRD_spells_by_class.items():
+        class_spells = set(class_spells)
+        for level in SPELL_LEVELS:
+            index[(classs, level)] = tuple(
+                sorted(
+                    class_spells.intersection(SRD_spells_by_level[level]),
+                    key=lambda key: (SRD_spells[key]["name"], key),
+                )
+            )
+    return MappingProxyType(index)
+
+
+SPELL_KEYS = build_spell_index()
+SPELL_CHOICES = MappingProxyType(
+    {
+        class_level: tuple((key, SRD_spells[key]["name"]) for key in keys)
+        for class_level, keys in SPELL_KEYS.items()
+    }
+)
+
+
+def spell_keys(classs, level):
+    """Returns tuple of the keys of spells of this level for this class"""
+    return SPELL_KEYS.get((classs, level), ())
+
+
+def spell_choices(classs, level):
+    """Returns tuple of (key, name) choices for a SelectField of these spells"""
+    return SPELL_CHOICES.get((classs, level), ())
+
+
+def spell_name(key):
+    return SPELLS[key]["name"]
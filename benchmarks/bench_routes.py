@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Times the busiest routes through the Flask test client against a large
+synthetic dataset (see dataset.py) and records latency and query counts
+into a JSON baseline. Pass --compare with an older baseline to see the change.
+
+    python benchmarks/bench_routes.py --output baseline.json
+    python benchmarks/bench_routes.py --compare baseline.json
+"""
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from sqlalchemy import event
+from argparse import ArgumentParser
+from dataset import add_arguments, generate_from_arguments
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+
+# (endpoint, url, id of the user who requests it)
+ROUTES = (
+    ("dashboard.index", "/", 2),
+    ("campaign.view_campaign", "/campaign/view/1", 1),
+    ("character.view_character", "/character/view/1", 2),
+    ("character.edit_character", "/character/edit/1", 2),
+    ("spells.list_spells", "/spells/list/wizard", 2),
+    ("main.rules_page", "/rules", 2),
+)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def login(client, user_id):
+    client.get("/account/logout")
+    client.post(
+        "/account/login",
+        data={"email": f"{user_id}@example.com", "password": "password"},
+    )
+
+
+def bench_route(client, db, url, repeat):
+    """Returns dict of latency statistics in milliseconds and the query count"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    # warm up caches and templates first
+    resp = client.get(url)
+    if resp.status_code != 200:
+        raise RuntimeError(f"{url} returned {resp.status_code}")
+    resp.data
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        # a streamed response only renders (and queries) as its body is read
+        client.get(url).data
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.get(url).data
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "url": url,
+        "queries": len(statements),
+        "mean_ms": statistics.mean(times),
+        "median_ms": statistics.median(times),
+        "p95_ms": percentile(times, 95),
+        "min_ms": min(times),
+    }
+
+
+def run(args):
+    db = plugins[0]
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app = init_app(app)
+    client = app.test_client()
+    results = {}
+    try:
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            dataset = generate_from_arguments(args)
+            print(f"Generated {dataset} in {time.perf_counter() - start:.1f}s")
+            with client:
+                user_id = None
+                for endpoint, url, route_user in ROUTES:
+                    if route_user != user_id:
+                        login(client, route_user)
+                        user_id = route_user
+                    results[endpoint] = bench_route(client, db, url, args.repeat)
+                    print(format_result(endpoint, results[endpoint]))
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+    return {
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "dataset": dataset,
+        "routes": results,
+    }
+
+
+def format_result(endpoint, result, previous=None):
+    line = (
+        f"{endpoint:<28} median {result['median_ms']:8.2f}ms  "
+        f"p95 {result['p95_ms']:8.2f}ms  queries {result['queries']:4}"
+    )
+    if previous:
+        change = (result["median_ms"] / previous["median_ms"] - 1) * 100
+        line += (
+            f"  ({change:+.0f}% median, "
+            f"{result['queries'] - previous['queries']:+} queries)"
+        )
+    return line
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the main routes")
+    add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=20, help="requests per route")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON baseline to compare the results to")
+    args = parser.parse_args()
+
+    baseline = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(baseline, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous["dataset"] != baseline["dataset"]:
+            print("Warning: the baseline used a different dataset", file=sys.stderr)
+        print(f"\nCompared to {args.compare}:")
+        for endpoint, result in baseline["routes"].items():
+            print(format_result(endpoint, result, previous["routes"].get(endpoint)))
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Generates a large synthetic dataset for benchmarks and load tests:
+thousands of users with characters of every class, and campaigns with
+hundreds of locations and scenes full of NPCs made from SRD monsters.
+
+User 1 is the gamemaster of campaign 1, the biggest campaign. User 2 plays
+in it with character 1. Every user's password is "password" and every email
+is "<user id>@example.com"
+"""
+from tabletop_story.models import (
+    db,
+    User,
+    GameCharacter,
+    GameCampaign,
+    CampaignLocation,
+    LocationScene,
+    SceneNPC,
+)
+from tabletop_story.dnd_campaign import NPC
+from dnd_character import Character
+from dnd_character.classes import CLASSES
+from dnd_character.monsters import SRD_monsters
+from argparse import ArgumentParser
+import random
+
+
+PASSWORD = "password"
+ALIGNMENTS = ("LG", "NG", "CG", "LN", "TN", "CN", "LE", "NE", "CE")
+
+
+def npc_templates():
+    """Returns list of (name, data string) for every usable SRD monster"""
+    templates = []
+    for monster in SRD_monsters.values():
+        try:
+            data = NPC.from_template(monster).as_dict()
+        except KeyError:
+            continue
+        templates.append((monster["name"], str(data)))
+    return templates
+
+
+def generate(
+    users=2000,
+    characters_per_user=2,
+    campaigns=50,
+    locations=200,
+    scenes=5,
+    npcs=3,
+    seed=0,
+):
+    """
+    Fills the database of the current app context. The first campaign has
+    `locations` locations with `scenes` scenes each, and each scene has up to
+    `npcs` NPCs. The other campaigns are a tenth of that size.
+    Returns dict of the numbers of created rows
+    """
+    rng = random.Random(seed)
+    # bcrypt is slow on purpose, so every user shares one hash
+    password = User(email=None, password=PASSWORD, is_admin=False).password
+    db.session.bulk_insert_mappings(
+        User,
+        [
+            {
+                "id": i,
+                "email": f"{i}@example.com",
+                "username": f"user {i}",
+                "password": password,
+                "is_admin": i == 1,
+            }
+            for i in range(1, users + 1)
+        ],
+    )
+
+    class_keys = list(CLASSES.keys())
+    characters = []
+    for i in range(users * characters_per_user):
+        # every class appears, and character 1 belongs to user 2
+        new_char = Character(
+            classs=CLASSES[class_keys[i % len(class_keys)]],
+            name=f"Character {i + 1}",
+            age=str(rng.randint(16, 300)),
+            gender="Unknown",
+            alignment=rng.choice(ALIGNMENTS),
+            description="A human",
+            biography="",
+        )
+        characters.append(
+            GameCharacter(
+                user_id=(i + 1) % users + 1,
+                name=new_char.name,
+                data=dict(new_char),
+            )
+        )
+    db.session.add_all(characters)
+    db.session.flush()
+
+    templates = npc_templates()
+    counts = {"locations": 0, "scenes": 0, "npcs": 0}
+    for campaign_num in range(campaigns):
+        size = 1 if campaign_num == 0 else 10
+        if campaign_num == 0:
+            gamemaster = 1
+            members = [characters[0]] + rng.sample(characters[1:], 5)
+        else:
+            gamemaster = rng.randint(1, users)
+            members = rng.sample(characters, 6)
+        campaign = GameCampaign(
+            name=f"Campaign {campaign_num + 1}",
+            gamemaster=gamemaster,
+            members=members,
+            active_location=0,
+        )
+        db.session.add(campaign)
+        db.session.flush()
+        for location_num in range(max(1, locations // size)):
+            location = CampaignLocation(
+                name=f"Location {location_num + 1}",
+                campaign_id=campaign.id,
+                description=f"Somewhere in {campaign.name}",
+            )
+            db.session.add(location)
+            db.session.flush()
+            counts["locations"] += 1
+            for scene_num in range(scenes):
+                scene = LocationScene(
+                    name=f"Scene {scene_num + 1}",
+                    location_id=location.id,
+                    description=f"Something happens in {location.name}",
+                )
+                db.session.add(scene)
+                db.session.flush()
+                counts["scenes"] += 1
+                for name, data in rng.sample(templates, rng.randint(0, npcs)):
+                    db.session.add(SceneNPC(name=name, scene_id=scene.id, data=data))
+                    counts["npcs"] += 1
+    db.session.commit()
+    counts.update(users=users, characters=len(characters), campaigns=campaigns)
+    return counts
+
+
+def add_arguments(parser):
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--characters-per-user", type=int, default=2)
+    parser.add_argument("--campaigns", type=int, default=50)
+    parser.add_argument("--locations", type=int, default=200)
+    parser.add_argument("--scenes", type=int, default=5)
+    parser.add_argument("--npcs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def generate_from_arguments(args):
+    return generate(
+        users=args.users,
+        characters_per_user=args.characters_per_user,
+        campaigns=args.campaigns,
+        locations=args.locations,
+        scenes=args.scenes,
+        npcs=args.npcs,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    from tabletop_story.__init__ import create_app
+    import os
+
+    parser = ArgumentParser(description="Fill a new database with a large dataset")
+    parser.add_argument("db", help="path of the new SQLite database file")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} already exists")
+
+    app = create_app()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + os.path.abspath(
+        args.db
+    )
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        print(generate_from_arguments(args))
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Simulates whole game tables playing at once against a running server,
+then reports throughput, latency percentiles and errors per route.
+
+Each table is one campaign: the gamemaster advances combat and the campaign
+page polls NPC cards, while every player refreshes their character sheet.
+Sessions log in through the login form, so use a database made by
+dataset.py (every password is "password") and pass its path with --db
+to find the campaigns' gamemasters, players and NPCs.
+
+    python benchmarks/dataset.py /tmp/large.db
+    DATABASE_URI=sqlite+pysqlite:////tmp/large.db uwsgi --http :5000 \\
+        --processes 5 -w tabletop_story.run:app
+    python benchmarks/loadtest.py --db /tmp/large.db --tables 4 --duration 60
+"""
+from argparse import ArgumentParser
+from collections import defaultdict
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from threading import Event, Lock, Thread
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urlsplit
+import urllib.request
+import json
+import random
+import re
+import sqlite3
+import time
+
+
+PASSWORD = "password"
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+ID = re.compile(r"/[0-9]+")
+
+
+class InsecureCookiePolicy(DefaultCookiePolicy):
+    """The app marks its cookies as secure, but local servers use plain HTTP"""
+
+    def return_ok_secure(self, cookie, request):
+        return True
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Redirects are followed by Session so each hop is timed on its own"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = Lock()
+
+    def add(self, route, latency, ok):
+        with self._lock:
+            self.latencies[route].append(latency)
+            if not ok:
+                self.errors[route] += 1
+
+    def reset(self):
+        with self._lock:
+            self.latencies.clear()
+            self.errors.clear()
+
+    def summary(self, duration):
+        """Returns dict of statistics per route"""
+        summary = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            summary[route] = {
+                "requests": len(latencies),
+                "errors": self.errors[route],
+                "error_rate": self.errors[route] / len(latencies),
+                "throughput": len(latencies) / duration,
+                "mean_ms": sum(latencies) * 1000 / len(latencies),
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "max_ms": latencies[-1] * 1000,
+            }
+        return summary
+
+
+def percentile(sorted_values, percent):
+    return sorted_values[
+        min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    ]
+
+
+class Session:
+    """One browser: a cookie jar and a user who is logged in"""
+
+    def __init__(self, base_url, results):
+        self.base_url = base_url.rstrip("/")
+        self.results = results
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar(InsecureCookiePolicy())),
+            NoRedirect,
+        )
+
+    def request(self, path, data=None, follow=True):
+        """
+        Requests the path and records its latency under the path with its ids
+        replaced, e.g. /character/view/<id>. Redirects are recorded separately.
+        Returns tuple of (status code, body) of the last response
+        """
+        url = self.base_url + path
+        while True:
+            route = ID.sub("/<id>", urlsplit(url).path)
+            start = time.perf_counter()
+            try:
+                with self.opener.open(
+                    url, None if data is None else urlencode(data).encode()
+                ) as response:
+                    status, body, location = response.status, response.read(), None
+            except HTTPError as e:
+                status, body = e.code, e.read()
+                location = e.headers.get("Location")
+            except URLError:
+                status, body, location = 0, b"", None
+            self.results.add(route, time.perf_counter() - start, status in (200, 302))
+            if status != 302 or not follow or location is None:
+                return status, body
+            url = location if "://" in location else self.base_url + location
+            data = None
+
+    def login(self, user_id):
+        status, body = self.request("/account/login")
+        token = CSRF_TOKEN.search(body.decode("utf-8"))
+        status, body = self.request(
+            "/account/login",
+            data={
+                "csrf_token": token.group(1) if token else "",
+                "email": f"{user_id}@example.com",
+                "password": PASSWORD,
+            },
+            follow=False,
+        )
+        if status != 302:
+            raise RuntimeError(f"User {user_id} could not log in")
+
+
+def find_tables(db_path, tables):
+    """
+    Returns list of dicts describing the first campaigns with members in
+    the database: the gamemaster, players and a scene with NPCs
+    """
+    connection = sqlite3.connect(db_path)
+    found = []
+    for campaign_id, gamemaster in connection.execute(
+        "SELECT id, gamemaster FROM game_campaign ORDER BY id"
+    ):
+        players = connection.execute(
+            "SELECT game_character.id, game_character.user_id FROM campaign_member "
+            "JOIN game_character ON game_character.id = campaign_member.character_id "
+            "WHERE campaign_member.campaign_id = ?",
+            (campaign_id,),
+        ).fetchall()
+        scene = connection.execute(
+            'SELECT location_scene.location_id, location_scene.id FROM "sceneNPC" '
+            'JOIN location_scene ON location_scene.id = "sceneNPC".scene_id '
+            "JOIN campaign_location ON campaign_location.id = location_scene.location_id "
+            "WHERE campaign_location.campaign_id = ? LIMIT 1",
+            (campaign_id,),
+        ).fetchone()
+        if not players or scene is None:
+            continue
+        npcs = [
+            row[0]
+            for row in connection.execute(
+                'SELECT id FROM "sceneNPC" WHERE scene_id = ?', (scene[1],)
+            )
+        ]
+        found.append(
+            {
+                "campaign_id": campaign_id,
+                "gamemaster": gamemaster,
+                "players": players,
+                "location_id": scene[0],
+                "scene_id": scene[1],
+                "npcs": npcs,
+            }
+        )
+        if len(found) == tables:
+            break
+    connection.close()
+    return found
+
+
+def gamemaster(session, stop, rng, table, interval):
+    """Starts combat in the table's scene if needed, then advances the turn"""
+    campaign_id = table["campaign_id"]
+    session.request(f"/campaign/location/{campaign_id}/activate/{table['location_id']}")
+    session.request(
+        f"/location/scene/{table['location_id']}/activate/{table['scene_id']}"
+    )
+    # the next turn fails (as a bad request) if combat is not active
+    status, _ = session.request(f"/campaign/combat/{campaign_id}/next")
+    if status != 200:
+        session.request(f"/campaign/combat/{campaign_id}/toggle")
+    while not stop.is_set():
+        session.request(f"/campaign/combat/{campaign_id}/next")
+        stop.wait(rng.uniform(0.5, 1.5) * interval)
+
+
+def npc_card_poller(session, stop, rng, table, interval):
+    while not stop.is_set():
+        for npc_id in table["npcs"]:
+            session.request(f"/scene/npc/get/{npc_id}/card")
+        stop.wait(rng.uniform(0.5, 1.5) * interval)
+
+
+def player(session, stop, rng, table, character_id, interval):
+    while not stop.is_set():
+        session.request(f"/character/view/{character_id}")
+        if rng.random() < 0.3:
+            session.request(f"/campaign/view/{table['campaign_id']}")
+        stop.wait(rng.uniform(0.5, 1.5) * interval)
+
+
+def run(args):
+    tables = find_tables(args.db, args.tables)
+    if len(tables) < args.tables:
+        raise SystemExit(f"Only found {len(tables)} campaigns with players and NPCs")
+    results = Results()
+    stop = Event()
+    workers = []
+    rng = random.Random(args.seed)
+
+    def start(target, user_id, *target_args):
+        session = Session(args.url, results)
+        session.login(user_id)
+        thread = Thread(
+            target=target,
+            args=(session, stop, random.Random(rng.random()), *target_args),
+            daemon=True,
+        )
+        workers.append(thread)
+
+    for table in tables:
+        start(gamemaster, table["gamemaster"], table, args.gm_interval)
+        start(npc_card_poller, table["gamemaster"], table, args.poll_interval)
+        for character_id, user_id in table["players"][: args.players]:
+            start(player, user_id, table, character_id, args.player_interval)
+    print(f"{len(workers)} sessions at {len(tables)} tables for {args.duration}s")
+    for thread in workers:
+        thread.start()
+    # starting combat and cold caches are not part of the measurement
+    stop.wait(args.warmup)
+    results.reset()
+    started = time.perf_counter()
+    stop.wait(args.duration)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    return results.summary(time.perf_counter() - started)
+
+
+def print_summary(summary):
+    print(
+        f"{'route':<28}{'requests':>9}{'req/s':>8}{'errors':>8}"
+        f"{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    )
+    for route, stats in summary.items():
+        print(
+            f"{route:<28}{stats['requests']:>9}{stats['throughput']:>8.1f}"
+            f"{stats['error_rate']:>8.1%}{stats['p50_ms']:>7.0f}ms"
+            f"{stats['p95_ms']:>7.0f}ms{stats['p99_ms']:>7.0f}ms{stats['max_ms']:>7.0f}ms"
+        )
+    total = sum(stats["throughput"] for stats in summary.values())
+    print(f"Total throughput: {total:.1f} requests per second")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Simulate game tables playing at once")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--db", required=True, help="the server's SQLite database")
+    parser.add_argument("--tables", type=int, default=1, help="campaigns in play")
+    parser.add_argument("--players", type=int, default=6, help="players per table")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument(
+        "--gm-interval", type=float, default=2, help="seconds between turns"
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=5, help="seconds between NPC polls"
+    )
+    parser.add_argument(
+        "--player-interval",
+        type=float,
+        default=3,
+        help="seconds between character sheet refreshes",
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=2, help="seconds before measuring"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    summary = run(args)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
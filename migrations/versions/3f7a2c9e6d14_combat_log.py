@@ -0,0 +1,142 @@
+"""add combat_event and combat_snapshot tables and campaign_combat.round
+
+Revision ID: 3f7a2c9e6d14
+Revises: 9d2e6a4c1f58
+Create Date: 2026-10-18 18:10:00.000000
+
+"""
+from alembic import op
+import json
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f7a2c9e6d14"
+down_revision = "9d2e6a4c1f58"
+branch_labels = None
+depends_on = None
+
+
+CHARACTER_TYPE = 0
+
+campaign_combat = sa.table(
+    "campaign_combat",
+    sa.column("campaign_id", sa.Integer),
+    sa.column("scene_id", sa.Integer),
+    sa.column("active", sa.Boolean),
+    sa.column("turn_index", sa.Integer),
+    sa.column("round", sa.Integer),
+)
+campaign_combatant = sa.table(
+    "campaign_combatant",
+    sa.column("id", sa.Integer),
+    sa.column("campaign_id", sa.Integer),
+    sa.column("combatant_type", sa.Integer),
+    sa.column("combatant_id", sa.Integer),
+    sa.column("dex", sa.Integer),
+    sa.column("initiative", sa.Integer),
+    sa.column("dex_modifier", sa.Integer),
+    sa.column("tiebreak", sa.Float),
+)
+combat_snapshot = sa.table(
+    "combat_snapshot",
+    sa.column("campaign_id", sa.Integer),
+    sa.column("event_id", sa.Integer),
+    sa.column("data", sa.Text),
+)
+
+
+def upgrade():
+    with op.batch_alter_table("campaign_combat") as batch_op:
+        batch_op.add_column(sa.Column("round", sa.Integer(), nullable=True))
+    op.execute(campaign_combat.update().values(round=1))
+    with op.batch_alter_table("campaign_combat") as batch_op:
+        batch_op.alter_column("round", existing_type=sa.Integer(), nullable=False)
+
+    op.create_table(
+        "combat_event",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("campaign_id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(length=16), nullable=False),
+        sa.Column("data", sa.Text(), nullable=False),
+        sa.Column("round", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["campaign_id"], ["game_campaign.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_combat_event_campaign_id"),
+        "combat_event",
+        ["campaign_id"],
+        unique=False,
+    )
+    op.create_table(
+        "combat_snapshot",
+        sa.Column("campaign_id", sa.Integer(), nullable=False),
+        sa.Column("event_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("data", sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(["campaign_id"], ["game_campaign.id"]),
+        sa.PrimaryKeyConstraint("campaign_id", "event_id"),
+    )
+
+    # each existing combat becomes the snapshot its log starts from, in the
+    # format of dnd_campaign.CombatLog.snapshot
+    connection = op.get_bind()
+    snapshots = {
+        row["campaign_id"]: {
+            "event_id": 0,
+            "scene_id": row["scene_id"],
+            "active": bool(row["active"]),
+            "characters": [],
+            "npcs": [],
+            "turn_sequence": [],
+            "turn_index": row["turn_index"],
+            "round": 1,
+            "hp": {},
+            "undo": [],
+            "redo": [],
+        }
+        for row in connection.execute(sa.select([campaign_combat])).fetchall()
+    }
+    rolls = {}
+    for row in connection.execute(
+        sa.select([campaign_combatant]).order_by(campaign_combatant.c.id)
+    ).fetchall():
+        snapshot = snapshots.get(row["campaign_id"])
+        if snapshot is None:
+            continue
+        roster = "characters" if row["combatant_type"] == CHARACTER_TYPE else "npcs"
+        snapshot[roster].append([row["combatant_id"], row["dex"]])
+        if snapshot["active"] and row["initiative"] is not None:
+            rolls.setdefault(row["campaign_id"], []).append(
+                [
+                    row["combatant_id"],
+                    row["combatant_type"],
+                    row["initiative"],
+                    row["dex_modifier"],
+                    row["tiebreak"],
+                ]
+            )
+    for campaign_id, snapshot in snapshots.items():
+        snapshot["turn_sequence"] = sorted(
+            rolls.get(campaign_id, []), key=lambda roll: (-roll[2], -roll[3], roll[4])
+        )
+    if snapshots:
+        op.bulk_insert(
+            combat_snapshot,
+            [
+                {
+                    "campaign_id": campaign_id,
+                    "event_id": 0,
+                    "data": json.dumps(snapshot, separators=(",", ":")),
+                }
+                for campaign_id, snapshot in snapshots.items()
+            ],
+        )
+
+
+def downgrade():
+    op.drop_table("combat_snapshot")
+    op.drop_index(op.f("ix_combat_event_campaign_id"), table_name="combat_event")
+    op.drop_table("combat_event")
+    with op.batch_alter_table("campaign_combat") as batch_op:
+        batch_op.drop_column("round")
@@ -0,0 +1,191 @@
+"""move GameCampaign.combat_data into campaign_combat and campaign_combatant tables
+
+Revision ID: 5b8f3e1a9c27
+Revises: e4a9c1d7b2f6
+Create Date: 2026-10-18 16:40:00.000000
+
+"""
+from alembic import op
+from ast import literal_eval
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b8f3e1a9c27"
+down_revision = "e4a9c1d7b2f6"
+branch_labels = None
+depends_on = None
+
+
+CHARACTER_TYPE = 0
+NPC_TYPE = 1
+
+game_campaign = sa.table(
+    "game_campaign",
+    sa.column("id", sa.Integer),
+    sa.column("combat_data", sa.String),
+)
+campaign_combat = sa.table(
+    "campaign_combat",
+    sa.column("campaign_id", sa.Integer),
+    sa.column("scene_id", sa.Integer),
+    sa.column("active", sa.Boolean),
+    sa.column("turn_index", sa.Integer),
+)
+campaign_combatant = sa.table(
+    "campaign_combatant",
+    sa.column("id", sa.Integer),
+    sa.column("campaign_id", sa.Integer),
+    sa.column("combatant_type", sa.Integer),
+    sa.column("combatant_id", sa.Integer),
+    sa.column("dex", sa.Integer),
+    sa.column("initiative", sa.Integer),
+    sa.column("dex_modifier", sa.Integer),
+    sa.column("tiebreak", sa.Float),
+)
+
+
+def combatant_rows(campaign_id, combat):
+    """Returns list of campaign_combatant rows for the dict of an old combat_data"""
+    dex = {}
+    roster = []
+    for combatant_type, key in ((CHARACTER_TYPE, "characters"), (NPC_TYPE, "npcs")):
+        for combatant_id, dexterity in combat.get(key, []):
+            dex[(combatant_type, combatant_id)] = dexterity
+            roster.append((combatant_type, combatant_id, dexterity))
+    if not combat.get("active"):
+        return [
+            {
+                "campaign_id": campaign_id,
+                "combatant_type": combatant_type,
+                "combatant_id": combatant_id,
+                "dex": dexterity,
+            }
+            for combatant_type, combatant_id, dexterity in roster
+        ]
+    # the old rolls weren't saved, so the tiebreak keeps the old turn order
+    return [
+        {
+            "campaign_id": campaign_id,
+            "combatant_type": roll[1],
+            "combatant_id": roll[0],
+            "dex": dex.get((roll[1], roll[0]), 10),
+            "initiative": 0,
+            "dex_modifier": 0,
+            "tiebreak": float(i),
+        }
+        for i, roll in enumerate(combat.get("turn_sequence", []))
+    ]
+
+
+def upgrade():
+    op.create_table(
+        "campaign_combat",
+        sa.Column("campaign_id", sa.Integer(), nullable=False),
+        sa.Column("scene_id", sa.Integer(), nullable=False),
+        sa.Column("active", sa.Boolean(), nullable=False),
+        sa.Column("turn_index", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["campaign_id"], ["game_campaign.id"]),
+        sa.PrimaryKeyConstraint("campaign_id"),
+    )
+    op.create_table(
+        "campaign_combatant",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("campaign_id", sa.Integer(), nullable=False),
+        sa.Column("combatant_type", sa.Integer(), nullable=False),
+        sa.Column("combatant_id", sa.Integer(), nullable=False),
+        sa.Column("dex", sa.Integer(), nullable=False),
+        sa.Column("initiative", sa.Integer(), nullable=True),
+        sa.Column("dex_modifier", sa.Integer(), nullable=True),
+        sa.Column("tiebreak", sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(["campaign_id"], ["game_campaign.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_campaign_combatant_campaign_id"),
+        "campaign_combatant",
+        ["campaign_id"],
+        unique=False,
+    )
+
+    connection = op.get_bind()
+    headers = []
+    combatants = []
+    for campaign_id, combat_data in connection.execute(
+        sa.select([game_campaign.c.id, game_campaign.c.combat_data])
+    ).fetchall():
+        combat = literal_eval(combat_data)
+        headers.append(
+            {
+                "campaign_id": campaign_id,
+                "scene_id": int(combat.get("scene_id", 0)),
+                "active": bool(combat.get("active")),
+                "turn_index": combat.get("turn_index", 0),
+            }
+        )
+        combatants.extend(combatant_rows(campaign_id, combat))
+    if headers:
+        op.bulk_insert(campaign_combat, headers)
+    if combatants:
+        op.bulk_insert(campaign_combatant, combatants)
+
+    with op.batch_alter_table("game_campaign") as batch_op:
+        batch_op.drop_column("combat_data")
+
+
+def downgrade():
+    with op.batch_alter_table("game_campaign") as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "combat_data",
+                sa.String(length=1024),
+                nullable=False,
+                server_default=str({"scene_id": 0, "active": False}),
+            )
+        )
+
+    connection = op.get_bind()
+    combats = {
+        row["campaign_id"]: {
+            "scene_id": row["scene_id"],
+            "characters": [],
+            "npcs": [],
+            "turn_sequence": [],
+            "turn_index": row["turn_index"],
+            "active": bool(row["active"]),
+        }
+        for row in connection.execute(sa.select([campaign_combat])).fetchall()
+    }
+    rolls = {}
+    for row in connection.execute(
+        sa.select([campaign_combatant]).order_by(campaign_combatant.c.id)
+    ).fetchall():
+        combat = combats.get(row["campaign_id"])
+        if combat is None:
+            continue
+        roster = "characters" if row["combatant_type"] == CHARACTER_TYPE else "npcs"
+        combat[roster].append((row["combatant_id"], row["dex"]))
+        if combat["active"] and row["initiative"] is not None:
+            rolls.setdefault(row["campaign_id"], []).append(
+                (
+                    -row["initiative"],
+                    -row["dex_modifier"],
+                    row["tiebreak"],
+                    (row["combatant_id"], row["combatant_type"]),
+                )
+            )
+    for campaign_id, combat in combats.items():
+        combat["turn_sequence"] = [
+            roll[-1] for roll in sorted(rolls.get(campaign_id, []))
+        ]
+        connection.execute(
+            game_campaign.update()
+            .where(game_campaign.c.id == campaign_id)
+            .values(combat_data=str(combat))
+        )
+
+    op.drop_index(
+        op.f("ix_campaign_combatant_campaign_id"), table_name="campaign_combatant"
+    )
+    op.drop_table("campaign_combatant")
+    op.drop_table("campaign_combat")
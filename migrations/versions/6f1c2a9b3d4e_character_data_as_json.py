@@ -0,0 +1,91 @@
+"""store GameCharacter data as a JSON object with a row version
+
+Revision ID: 6f1c2a9b3d4e
+Revises:
+Create Date: 2026-10-18 12:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import json
+from ast import literal_eval
+
+
+# revision identifiers, used by Alembic.
+revision = "6f1c2a9b3d4e"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+game_character = sa.table(
+    "game_character",
+    sa.column("id", sa.Integer),
+    sa.column("data_keys", sa.String),
+    sa.column("data_vals", sa.String),
+    sa.column("data", sa.Text),
+    sa.column("version", sa.Integer),
+)
+
+
+def upgrade():
+    with op.batch_alter_table("game_character") as batch_op:
+        batch_op.add_column(sa.Column("data", sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column("version", sa.Integer(), nullable=True))
+
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(
+            [
+                game_character.c.id,
+                game_character.c.data_keys,
+                game_character.c.data_vals,
+            ]
+        )
+    ).fetchall()
+    for row_id, data_keys, data_vals in rows:
+        data = dict(zip(data_keys[2:-2].split("', '"), literal_eval(data_vals)))
+        connection.execute(
+            game_character.update()
+            .where(game_character.c.id == row_id)
+            .values(data=json.dumps(data, separators=(",", ":")), version=1)
+        )
+
+    with op.batch_alter_table("game_character") as batch_op:
+        batch_op.alter_column("data", existing_type=sa.Text(), nullable=False)
+        batch_op.alter_column("version", existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column("data_keys")
+        batch_op.drop_column("data_vals")
+
+
+def downgrade():
+    with op.batch_alter_table("game_character") as batch_op:
+        batch_op.add_column(sa.Column("data_keys", sa.String(1024), nullable=True))
+        batch_op.add_column(sa.Column("data_vals", sa.String(4096), nullable=True))
+
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select([game_character.c.id, game_character.c.data])
+    ).fetchall()
+    for row_id, data in rows:
+        data = json.loads(data)
+        for key in ("cantrips_known", "spells_known", "spell_slots"):
+            if isinstance(data.get(key), dict):
+                data[key] = {int(level): val for level, val in data[key].items()}
+        connection.execute(
+            game_character.update()
+            .where(game_character.c.id == row_id)
+            .values(
+                data_keys=str(list(data.keys())), data_vals=str(list(data.values()))
+            )
+        )
+
+    with op.batch_alter_table("game_character") as batch_op:
+        batch_op.alter_column(
+            "data_keys", existing_type=sa.String(1024), nullable=False
+        )
+        batch_op.alter_column(
+            "data_vals", existing_type=sa.String(4096), nullable=False
+        )
+        batch_op.drop_column("version")
+        batch_op.drop_column("data")
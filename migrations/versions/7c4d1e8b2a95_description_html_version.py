@@ -0,0 +1,40 @@
+"""keep the version of user_markdown which rendered each description_html
+
+Revision ID: 7c4d1e8b2a95
+Revises: 3f7a2c9e6d14
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7c4d1e8b2a95"
+down_revision = "3f7a2c9e6d14"
+branch_labels = None
+depends_on = None
+
+
+# existing HTML was rendered without the URL scheme allowlist, so it is
+# deleted, and rows are rendered when they're viewed until their next edit
+TABLES = ("campaign_location", "location_scene")
+
+
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(
+                sa.Column("description_html_version", sa.Integer(), nullable=True)
+            )
+        op.execute(
+            sa.table(table, sa.column("description_html", sa.Text))
+            .update()
+            .values(description_html=None)
+        )
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("description_html_version")
@@ -0,0 +1,36 @@
+"""add row versions to game_campaign and campaign_combat
+
+Revision ID: 9d2e6a4c1f58
+Revises: 5b8f3e1a9c27
+Create Date: 2026-10-18 17:25:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "9d2e6a4c1f58"
+down_revision = "5b8f3e1a9c27"
+branch_labels = None
+depends_on = None
+
+
+TABLES = ("game_campaign", "campaign_combat")
+
+
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column("version", sa.Integer(), nullable=True))
+        op.execute(
+            sa.table(table, sa.column("version", sa.Integer)).update().values(version=1)
+        )
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column("version", existing_type=sa.Integer(), nullable=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("version")
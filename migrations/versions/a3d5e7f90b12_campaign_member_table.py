@@ -0,0 +1,87 @@
+"""replace GameCampaign.character1..character6 with a campaign_member table
+
+Revision ID: a3d5e7f90b12
+Revises: 6f1c2a9b3d4e
+Create Date: 2026-10-18 13:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a3d5e7f90b12"
+down_revision = "6f1c2a9b3d4e"
+branch_labels = None
+depends_on = None
+
+
+SLOTS = [f"character{i}" for i in range(1, 7)]
+
+game_campaign = sa.table(
+    "game_campaign",
+    sa.column("id", sa.Integer),
+    *[sa.column(slot, sa.Integer) for slot in SLOTS],
+)
+
+
+def upgrade():
+    campaign_member = op.create_table(
+        "campaign_member",
+        sa.Column("campaign_id", sa.Integer(), nullable=False),
+        sa.Column("character_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["campaign_id"], ["game_campaign.id"]),
+        sa.ForeignKeyConstraint(["character_id"], ["game_character.id"]),
+        sa.PrimaryKeyConstraint("campaign_id", "character_id"),
+    )
+    op.create_index(
+        op.f("ix_campaign_member_character_id"),
+        "campaign_member",
+        ["character_id"],
+        unique=False,
+    )
+
+    connection = op.get_bind()
+    members = []
+    for row in connection.execute(sa.select([game_campaign])).fetchall():
+        character_ids = {row[slot] for slot in SLOTS if row[slot] is not None}
+        members.extend(
+            {"campaign_id": row["id"], "character_id": character_id}
+            for character_id in sorted(character_ids)
+        )
+    if members:
+        op.bulk_insert(campaign_member, members)
+
+    with op.batch_alter_table("game_campaign") as batch_op:
+        for slot in SLOTS:
+            batch_op.drop_column(slot)
+
+
+def downgrade():
+    with op.batch_alter_table("game_campaign") as batch_op:
+        for slot in SLOTS:
+            batch_op.add_column(sa.Column(slot, sa.Integer(), nullable=True))
+
+    # only the first six members of each campaign fit into the old columns
+    campaign_member = sa.table(
+        "campaign_member",
+        sa.column("campaign_id", sa.Integer),
+        sa.column("character_id", sa.Integer),
+    )
+    connection = op.get_bind()
+    slots = {}
+    for campaign_id, character_id in connection.execute(
+        sa.select(
+            [campaign_member.c.campaign_id, campaign_member.c.character_id]
+        ).order_by(campaign_member.c.campaign_id, campaign_member.c.character_id)
+    ).fetchall():
+        slots.setdefault(campaign_id, []).append(character_id)
+    for campaign_id, character_ids in slots.items():
+        connection.execute(
+            game_campaign.update()
+            .where(game_campaign.c.id == campaign_id)
+            .values(dict(zip(SLOTS, character_ids[:6])))
+        )
+
+    op.drop_index(op.f("ix_campaign_member_character_id"), table_name="campaign_member")
+    op.drop_table("campaign_member")
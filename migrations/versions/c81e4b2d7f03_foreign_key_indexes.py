@@ -0,0 +1,35 @@
+"""index the foreign key columns used by filter_by
+
+Revision ID: c81e4b2d7f03
+Revises: a3d5e7f90b12
+Create Date: 2026-10-18 13:55:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c81e4b2d7f03"
+down_revision = "a3d5e7f90b12"
+branch_labels = None
+depends_on = None
+
+
+INDEXES = (
+    ("sceneNPC", "scene_id"),
+    ("location_scene", "location_id"),
+    ("campaign_location", "campaign_id"),
+    ("game_character", "user_id"),
+    ("game_campaign", "gamemaster"),
+)
+
+
+def upgrade():
+    for table, column in INDEXES:
+        op.create_index(op.f(f"ix_{table}_{column}"), table, [column], unique=False)
+
+
+def downgrade():
+    for table, column in reversed(INDEXES):
+        op.drop_index(op.f(f"ix_{table}_{column}"), table_name=table)
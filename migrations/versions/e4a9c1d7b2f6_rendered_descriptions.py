@@ -0,0 +1,32 @@
+"""keep the rendered HTML of location and scene descriptions
+
+Revision ID: e4a9c1d7b2f6
+Revises: c81e4b2d7f03
+Create Date: 2026-10-18 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e4a9c1d7b2f6"
+down_revision = "c81e4b2d7f03"
+branch_labels = None
+depends_on = None
+
+
+# existing rows are rendered when they're viewed until their next edit
+TABLES = ("campaign_location", "location_scene")
+
+
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column("description_html", sa.Text(), nullable=True))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("description_html")
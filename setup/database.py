@@ -76,11 +76,11 @@ def prompt_deletion(func, uri):
 
 def reset_db():
     db.create_all()
-    GameCharacter.__table__.drop(db.engine)
-    GameCampaign.__table__.drop(db.engine)
-    CampaignLocation.__table__.drop(db.engine)
-    LocationScene.__table__.drop(db.engine)
-    SceneNPC.__table__.drop(db.engine)
+    # every table, so no membership or combat rows outlive their campaign
+    db.metadata.drop_all(
+        bind=db.engine,
+        tables=[table for table in db.metadata.sorted_tables if table.name != "user"],
+    )
     db.create_all()
     db.session.commit()
     print("Dropped all tables except User")
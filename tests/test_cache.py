@@ -0,0 +1,109 @@
+import os
+import tempfile
+import pytest
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.models import (
+    User,
+    GameCampaign,
+    CampaignLocation,
+    LocationScene,
+    SceneNPC,
+)
+from tabletop_story.dnd_campaign import NPC
+from tabletop_story.cache import FragmentCache, fragment_cache
+from dnd_character.monsters import SRD_monsters
+
+
+@pytest.fixture
+def client():
+    global app, db, bcrypt, login_manager
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app = init_app(app)
+    client = app.test_client()
+    fragment_cache.clear()
+    with app.app_context():
+        with client:
+            db.create_all()
+            db.session.add(
+                User(
+                    email="1@example.com",
+                    username="1",
+                    password="password",
+                    is_admin=False,
+                )
+            )
+            db.session.add(GameCampaign(name="test", gamemaster=1, active_location=0))
+            db.session.add(CampaignLocation(name="location", campaign_id=1))
+            db.session.add(LocationScene(name="scene", location_id=1))
+            zombie = NPC.from_template(SRD_monsters["zombie"]).as_dict()
+            db.session.add(SceneNPC(name="zombie", scene_id=1, data=str(zombie)))
+            db.session.commit()
+            client.post(
+                "/account/login",
+                data={"email": "1@example.com", "password": "password"},
+                follow_redirects=True,
+            )
+            yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def test_lru_eviction_by_size():
+    cache = FragmentCache(max_bytes=10)
+    cache.set("a", b"1234")
+    cache.set("b", "1234")
+    cache.get("a")
+    cache.set("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+    assert cache.size == 8
+    cache.set("too big", b"12345678901")
+    assert cache.get("too big") is None
+    cache.delete("a")
+    assert cache.size == 4 and len(cache) == 1
+
+
+def test_size_counts_encoded_bytes():
+    cache = FragmentCache(max_bytes=100)
+    cache.set("dragon", "🐉")
+    assert cache.size == 4
+
+
+def test_npc_card_is_cached(client):
+    first = client.get("/scene/npc/get/1/card")
+    hits = fragment_cache.hits
+    second = client.get("/scene/npc/get/1/card")
+    assert fragment_cache.hits == hits + 1
+    assert first.data == second.data
+    assert "Suggested XP reward: 50" in second.get_json()["html"]
+
+
+def test_npc_card_changes_after_edit(client):
+    client.get("/scene/npc/get/1/card")
+    data = {
+        field: value
+        for field, value in SceneNPC.query.get(1).as_dict().items()
+        if not isinstance(value, list)
+    }
+    data.update(
+        name="Zed",
+        description="Slower than most",
+        actions="",
+        abilities="",
+        proficiencies="",
+    )
+    resp = client.post("/scene/npc/edit/1/", data=data)
+    assert resp.status_code == 302
+    card = client.get("/scene/npc/get/1/card").get_json()
+    assert card["name"] == "Zed"
+    assert "Slower than most" in card["html"]
+
+
+def test_npc_attribute(client):
+    assert client.get("/scene/npc/get/1/hit_points").get_json() == 22
@@ -0,0 +1,433 @@
+import os
+import tempfile
+import pytest
+from sqlalchemy import event
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.models import (
+    User,
+    GameCharacter,
+    GameCampaign,
+    CampaignLocation,
+    LocationScene,
+    SceneNPC,
+    CombatEvent,
+    CombatSnapshot,
+)
+from tabletop_story.dnd_campaign import NPC, NPC_TYPE
+from tabletop_story.dnd_campaign.combat_log import SNAPSHOT_INTERVAL
+from dnd_character.classes import Fighter
+from dnd_character.monsters import SRD_monsters
+
+
+@pytest.fixture
+def client():
+    global app, db, bcrypt, login_manager
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app = init_app(app)
+    client = app.test_client()
+    with app.app_context():
+        with client:
+            db.create_all()
+            for i in (1, 2):
+                db.session.add(
+                    User(
+                        email=f"{i}@example.com",
+                        username=f"{i}",
+                        password="password",
+                        is_admin=False,
+                    )
+                )
+            thor = Fighter(name="thor", experience=255, alignment="TN")
+            character = GameCharacter(user_id=2, name=thor.name, data=dict(thor))
+            db.session.add(character)
+            db.session.add(
+                GameCampaign(
+                    name="test", gamemaster=1, members=[character], active_location=0
+                )
+            )
+            db.session.commit()
+            yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def login(client, user_id):
+    client.post(
+        "/account/login",
+        data={"email": f"{user_id}@example.com", "password": "password"},
+        follow_redirects=True,
+    )
+
+
+def add_locations(campaign_id, locations, scenes, npcs):
+    zombie = NPC.from_template(SRD_monsters["zombie"]).as_dict()
+    for i in range(locations):
+        location = CampaignLocation(name=f"location {i}", campaign_id=campaign_id)
+        db.session.add(location)
+        db.session.flush()
+        for j in range(scenes):
+            scene = LocationScene(name=f"scene {j}", location_id=location.id)
+            db.session.add(scene)
+            db.session.flush()
+            for k in range(npcs):
+                db.session.add(
+                    SceneNPC(name=f"zombie {k}", scene_id=scene.id, data=str(zombie))
+                )
+    db.session.commit()
+    return location.id, scene.id
+
+
+def count_queries(client, url):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        resp = client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    assert resp.status_code == 200
+    return len(statements)
+
+
+def start_combat(client, location_id, scene_id):
+    client.get(f"/campaign/location/1/activate/{location_id}")
+    client.get(f"/location/scene/{location_id}/activate/{scene_id}")
+    client.get("/campaign/combat/1/toggle")
+
+
+def test_gamemaster_view_campaign_query_count_is_flat(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 1)
+    start_combat(client, location_id, scene_id)
+    small = count_queries(client, "/campaign/view/1")
+    location_id, scene_id = add_locations(1, 6, 5, 4)
+    start_combat(client, location_id, scene_id)
+    big = count_queries(client, "/campaign/view/1")
+    assert small == big
+
+
+def test_gamemaster_view_campaign_shows_tree(client):
+    login(client, 1)
+    add_locations(1, 2, 2, 2)
+    resp = client.get("/campaign/view/1")
+    assert resp.data.count(b"Scene: <a") == 4
+    assert resp.data.count(b'onclick="update(') == 8
+
+
+def test_player_view_campaign_shows_combat(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 2)
+    start_combat(client, location_id, scene_id)
+    client.get("/account/logout")
+    login(client, 2)
+    resp = client.get("/campaign/view/1")
+    assert resp.status_code == 200
+    assert b"zombie 1" in resp.data
+    assert b"thor" in resp.data
+
+
+def test_npcs_join_and_leave_combat_without_rerolling(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 3)
+    start_combat(client, location_id, scene_id)
+    before = GameCampaign.query.get(1).get_combat().turn_sequence
+    assert len(before) == 4
+    resp = client.post(
+        f"/scene/npc/{scene_id}/create",
+        data={"name": "late zombie", "template": "zombie"},
+    )
+    assert resp.status_code == 302
+    npc = SceneNPC.query.filter_by(name="late zombie").first()
+    sequence = GameCampaign.query.get(1).get_combat().turn_sequence
+    assert [each for each in sequence if each.id != npc.id or each.type != 1] == before
+    assert len(sequence) == 5
+    removed = next(each for each in before if each.type == 1)
+    client.post(f"/scene/npc/delete/{removed.id}", data={})
+    sequence = GameCampaign.query.get(1).get_combat().turn_sequence
+    assert removed not in sequence and len(sequence) == 4
+
+
+def test_npcs_copied_and_moved_join_and_leave_combat(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 2, 2)
+    other_scene_id = scene_id - 1
+    start_combat(client, location_id, scene_id)
+    before = GameCampaign.query.get(1).get_combat().turn_sequence
+    assert len(before) == 3
+    moved = next(each for each in before if each.type == NPC_TYPE)
+    resp = client.post(f"/scene/npc/move/{moved.id}", data={"scene": other_scene_id})
+    assert resp.status_code == 302
+    assert SceneNPC.query.get(moved.id).scene_id == other_scene_id
+    sequence = GameCampaign.query.get(1).get_combat().turn_sequence
+    assert moved not in sequence and len(sequence) == 2
+    resp = client.post(f"/scene/npc/copy/{moved.id}", data={"scene": scene_id})
+    assert resp.status_code == 302
+    copy = SceneNPC.query.filter_by(scene_id=scene_id).order_by(SceneNPC.id.desc())
+    copy = copy.first()
+    assert copy.id != moved.id and copy.data == SceneNPC.query.get(moved.id).data
+    sequence = GameCampaign.query.get(1).get_combat().turn_sequence
+    assert len(sequence) == 3
+    assert (NPC_TYPE, copy.id) in {(each.type, each.id) for each in sequence}
+    # the copied NPC's HP is recorded like any late joiner's
+    assert f"{NPC_TYPE}:{copy.id}" in GameCampaign.query.get(1).combat_log().hp
+
+
+def test_scenes_and_locations_are_deleted_with_their_children(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 2, 2, 2)
+    resp = client.post(f"/location/scene/delete/{scene_id}", data={"submit": True})
+    assert resp.status_code == 302
+    assert LocationScene.query.get(scene_id) is None
+    assert SceneNPC.query.filter_by(scene_id=scene_id).count() == 0
+    assert LocationScene.query.filter_by(location_id=location_id).count() == 1
+    other_scene_id = scene_id - 1
+    resp = client.post(
+        f"/campaign/location/delete/{location_id}", data={"submit": True}
+    )
+    assert resp.status_code == 302
+    assert CampaignLocation.query.get(location_id) is None
+    assert LocationScene.query.filter_by(location_id=location_id).count() == 0
+    assert SceneNPC.query.filter_by(scene_id=other_scene_id).count() == 0
+    # the other location is untouched
+    assert LocationScene.query.count() == 2 and SceneNPC.query.count() == 4
+
+
+def test_next_turn_is_one_update(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 300)
+    start_combat(client, location_id, scene_id)
+    assert len(GameCampaign.query.get(1).get_combat().turn_sequence) == 301
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        for _ in range(302):
+            assert client.get("/campaign/combat/1/next").status_code == 302
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    writes = [
+        statement for statement in statements if not statement.startswith("SELECT")
+    ]
+    updates = [write for write in writes if write.startswith("UPDATE")]
+    events = [write for write in writes if write.startswith("INSERT INTO combat_event")]
+    snapshots = [
+        write for write in writes if write.startswith("INSERT INTO combat_snapshot")
+    ]
+    assert len(updates) == 302
+    assert all(update.startswith("UPDATE campaign_combat SET") for update in updates)
+    # each turn appends to the combat log, which is snapshotted as it grows
+    assert len(events) == 302
+    assert len(snapshots) == 12
+    assert len(writes) == len(updates) + len(events) + len(snapshots)
+    assert not any(
+        "FROM campaign_combat" in statement
+        for statement in statements
+        if statement.startswith("SELECT")
+    )
+    # the turn wrapped around to the top of the sequence
+    assert GameCampaign.query.get(1).get_combat().turn_index == 1
+
+
+def test_next_turn_needs_active_combat(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 1)
+    assert client.get("/campaign/combat/1/next").status_code != 302
+    start_combat(client, location_id, scene_id)
+    client.get("/campaign/combat/1/toggle")
+    assert client.get("/campaign/combat/1/next").status_code != 302
+    combat = GameCampaign.query.get(1).get_combat()
+    assert not combat.active and combat.turn_sequence == []
+    assert len(combat.npcs) == 1 and len(combat.characters) == 1
+
+
+def combat_state():
+    db.session.expire_all()
+    combat = GameCampaign.query.get(1).get_combat()
+    return combat.turn_index, combat.round, combat.active
+
+
+def test_combat_can_be_undone_and_redone(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 2)
+    start_combat(client, location_id, scene_id)
+    for _ in range(4):
+        client.get("/campaign/combat/1/next")
+    assert combat_state() == (1, 2, True)
+    for _ in range(2):
+        assert client.get("/campaign/combat/1/undo").status_code == 302
+    assert combat_state() == (2, 1, True)
+    client.get("/campaign/combat/1/redo")
+    assert combat_state() == (0, 2, True)
+    # a new event clears what could be redone
+    client.get("/campaign/combat/1/toggle")
+    resp = client.get("/campaign/combat/1/redo", follow_redirects=True)
+    assert b"There is nothing to redo." in resp.data
+    client.get("/campaign/combat/1/undo")
+    assert combat_state() == (0, 2, True)
+    # the log agrees with the tables
+    campaign = GameCampaign.query.get(1)
+    assert campaign.combat_log().combat.turn_sequence == (
+        campaign.get_combat().turn_sequence
+    )
+    client.get("/account/logout")
+    login(client, 2)
+    assert client.get("/campaign/combat/1/undo").status_code == 403
+
+
+def test_hp_change_is_undone(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 1)
+    start_combat(client, location_id, scene_id)
+    npc = SceneNPC.query.filter_by(scene_id=scene_id).one()
+    data = npc.as_dict()
+    old_hp = data["hit_points"]
+    data["hit_points"] = 1
+    npc.data = str(data)
+    GameCampaign.record_hp_change(NPC_TYPE, npc.id, old_hp, 1)
+    db.session.commit()
+    assert GameCampaign.query.get(1).combat_log().hp[f"{NPC_TYPE}:{npc.id}"] == 1
+    client.get("/campaign/combat/1/undo")
+    db.session.expire_all()
+    assert SceneNPC.query.get(npc.id).as_dict()["hit_points"] == old_hp
+    client.get("/campaign/combat/1/redo")
+    db.session.expire_all()
+    assert SceneNPC.query.get(npc.id).as_dict()["hit_points"] == 1
+
+
+def test_combat_log_is_snapshotted(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 3)
+    start_combat(client, location_id, scene_id)
+    for _ in range(60):
+        client.get("/campaign/combat/1/next")
+    campaign = GameCampaign.query.get(1)
+    events = CombatEvent.query.filter_by(campaign_id=1).count()
+    snapshots = CombatSnapshot.query.filter_by(campaign_id=1).all()
+    assert len(snapshots) == events // SNAPSHOT_INTERVAL
+    log = campaign.combat_log()
+    assert log.event_id == events
+    assert (log.combat.turn_index, log.combat.round) == combat_state()[:2]
+
+
+def test_combat_round_is_replayed(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 2)
+    start_combat(client, location_id, scene_id)
+    for _ in range(5):
+        client.get("/campaign/combat/1/next")
+    client.get("/account/logout")
+    login(client, 2)
+    resp = client.get("/campaign/combat/1/replay")
+    assert resp.status_code == 200
+    assert b"Round 1 of 2" in resp.data
+    assert b"Combat began and initiative was rolled" in resp.data
+    assert resp.data.count(b"Next turn") == 2
+    assert b"zombie 1" in resp.data and b"thor" in resp.data
+    resp = client.get("/campaign/combat/1/replay/2")
+    assert resp.data.count(b"Next turn") == 3
+    assert client.get("/campaign/combat/1/replay/3").status_code == 404
+
+
+def test_view_campaign_portraits_share_a_sprite_sheet(client):
+    login(client, 2)
+    resp = client.get("/campaign/view/1")
+    assert resp.data.count(b"background-image: url(/character/portraits?") == 1
+    assert b"/character/portrait/" not in resp.data
+
+
+def test_location_description_is_rendered_on_save(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 0)
+    resp = client.post(
+        f"/campaign/location/edit/{location_id}/",
+        data={"name": "Tavern", "description": "A *rowdy* <b>place</b>"},
+    )
+    assert resp.status_code == 302
+    location = CampaignLocation.query.get(location_id)
+    assert (
+        location.description_html
+        == "<p>A <em>rowdy</em> &lt;b&gt;place&lt;/b&gt;</p>\n"
+    )
+    resp = client.get(f"/campaign/location/view/{location_id}")
+    assert b"A <em>rowdy</em> &lt;b&gt;place&lt;/b&gt;" in resp.data
+
+
+def test_unsaved_scene_description_is_rendered_when_viewed(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 0)
+    # e.g. a row from before description_html existed
+    db.session.execute(
+        LocationScene.__table__.update().values(
+            description="**Ambush**", description_html=None
+        )
+    )
+    db.session.commit()
+    resp = client.get(f"/location/scene/view/{scene_id}")
+    assert b"<strong>Ambush</strong>" in resp.data
+
+
+def test_description_rendered_by_old_markdown_is_rendered_again(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 0)
+    # e.g. HTML stored before links were checked for unsafe schemes
+    db.session.execute(
+        CampaignLocation.__table__.update().values(
+            description="[x](JaVaScRiPt:alert(1))",
+            description_html='<p><a href="JaVaScRiPt:alert(1)">x</a></p>',
+            description_html_version=1,
+        )
+    )
+    db.session.commit()
+    resp = client.get(f"/campaign/location/view/{location_id}")
+    assert b'<a href="#harmful-link">x</a>' in resp.data
+    assert b"JaVaScRiPt" not in resp.data
+
+
+def test_has_member_checks_the_users_characters(client):
+    campaign = GameCampaign.query.get(1)
+    # user 2 plays thor, while the gamemaster has no characters
+    assert campaign.has_member(2)
+    assert not campaign.has_member(1)
+    login(client, 2)
+    assert client.get("/campaign/view/1").status_code == 200
+    campaign.members = []
+    db.session.commit()
+    assert not campaign.has_member(2)
+    assert client.get("/campaign/view/1").status_code == 403
+    assert client.get("/campaign/combat/1/replay").status_code == 403
+
+
+def test_deleted_npc_is_not_restored_by_undo(client):
+    login(client, 1)
+    location_id, scene_id = add_locations(1, 1, 1, 2)
+    start_combat(client, location_id, scene_id)
+    npc = SceneNPC.query.filter_by(scene_id=scene_id).first()
+    npc_id = npc.id
+    resp = client.post(f"/scene/npc/delete/{npc_id}", data={"submit": True})
+    assert resp.status_code == 302
+    assert client.get("/campaign/combat/1/undo").status_code == 302
+    db.session.expire_all()
+    campaign = GameCampaign.query.get(1)
+    combat = campaign.get_combat()
+    assert (NPC_TYPE, npc_id) not in {
+        (each.type, each.id) for each in combat.turn_sequence
+    }
+    assert None not in campaign.combatants(combat)
+    assert len(combat.turn_sequence) == 2
+    # replaying the log agrees, and the undo can be redone
+    assert campaign.combat_log().combat.turn_sequence == combat.turn_sequence
+    assert client.get("/campaign/combat/1/redo").status_code == 302
+    db.session.expire_all()
+    assert len(GameCampaign.query.get(1).get_combat().turn_sequence) == 2
@@ -44,8 +44,7 @@ def test_character_mutation(client):
     db_thor = GameCharacter(
         user_id=1,
         name=thor.name,
-        data_keys=str(thor.keys()),
-        data_vals=str(thor.values()),
+        data=dict(thor),
     )
     db.session.add(db_thor)
     db.session.commit()
@@ -58,8 +57,7 @@ def test_character_mutation_with_class(client):
     db_thor = GameCharacter(
         user_id=1,
         name=thor.name,
-        data_keys=str(thor.keys()),
-        data_vals=str(thor.values()),
+        data=dict(thor),
     )
     db.session.add(db_thor)
     db.session.commit()
@@ -72,8 +70,7 @@ def test_character_mutation_with_experience(client):
     db_thor = GameCharacter(
         user_id=1,
         name=thor.name,
-        data_keys=str(thor.keys()),
-        data_vals=str(thor.values()),
+        data=dict(thor),
     )
     db.session.add(db_thor)
     db.session.commit()
@@ -85,3 +82,51 @@ def test_character_mutation_with_experience(client):
         == new_thor_character.experience.to_next_level
         == 45
     )
+
+
+def test_character_mutation_with_spells_known(client):
+    thor = Character(name="thor", classs=CLASSES["wizard"])
+    thor.spells_known = {0: ["light"], 1: ["sleep"]}
+    db_thor = GameCharacter(
+        user_id=1,
+        name=thor.name,
+        data=dict(thor),
+    )
+    db.session.add(db_thor)
+    db.session.commit()
+    new_thor = GameCharacter.query.first()
+    assert new_thor.character.spells_known == {0: ["light"], 1: ["sleep"]}
+
+
+def test_character_data_cache_returns_copies(client):
+    thor = Character(name="thor", classs=CLASSES["fighter"])
+    db_thor = GameCharacter(
+        user_id=1,
+        name=thor.name,
+        data=dict(thor),
+    )
+    db.session.add(db_thor)
+    db.session.commit()
+    data = db_thor.as_dict()
+    data["inventory"].clear()
+    assert db_thor.as_dict() == dict(thor)
+
+
+def test_character_data_cache_invalidated_by_update(client):
+    thor = Character(name="thor", experience=255)
+    db_thor = GameCharacter(
+        user_id=1,
+        name=thor.name,
+        data=dict(thor),
+    )
+    db.session.add(db_thor)
+    db.session.commit()
+    version = db_thor.version
+    db_thor.as_dict()
+    data = dict(db_thor.character)
+    data["experience"] = 900
+    db_thor.update_data(data)
+    db.session.add(db_thor)
+    db.session.commit()
+    assert db_thor.version == version + 1
+    assert db_thor.character.experience == 900
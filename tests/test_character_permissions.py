@@ -60,8 +60,7 @@ def add_character(user_id):
     db_thor = GameCharacter(
         user_id=user_id,
         name=thor.name,
-        data_keys=str(thor.keys()),
-        data_vals=str(thor.values()),
+        data=dict(thor),
     )
     db.session.add(db_thor)
     db.session.commit()
@@ -70,7 +69,10 @@ def add_character(user_id):
 
 def add_campaign(user_id, player_id):
     test = GameCampaign(
-        name="test", gamemaster=user_id, character1=player_id, active_location=0
+        name="test",
+        gamemaster=user_id,
+        members=[GameCharacter.query.get(player_id)],
+        active_location=0,
     )
     db.session.add(test)
     db.session.commit()
@@ -177,3 +179,59 @@ def test_gamemaster_cant_edit_other_gamemasters_character(client):
     add_campaign(k, k)
     resp = client.get(f"/character/edit/{k}")
     assert resp.status_code == 403
+
+
+def test_gamemaster_can_edit_seventh_character(client):
+    login(client, 1)
+    campaign_id = add_campaign(1, 1)
+    campaign = GameCampaign.query.get(campaign_id)
+    for _ in range(6):
+        character = GameCharacter.query.get(add_character(add_user()))
+        campaign.members.append(character)
+    db.session.commit()
+    assert len(campaign.characters()) == 7
+    resp = client.get(f"/character/edit/{campaign.characters()[-1]}")
+    assert resp.status_code == 200
+
+
+def test_player_sees_campaign_on_dashboard(client):
+    k = add_user()
+    add_character(k)
+    add_campaign(k, 1)
+    login(client, 1)
+    resp = client.get("/")
+    assert b"/campaign/view/1" in resp.data
+
+
+def test_player_can_view_campaign(client):
+    k = add_user()
+    add_campaign(k, 1)
+    login(client, 1)
+    resp = client.get("/campaign/view/1")
+    assert resp.status_code == 200
+
+
+def test_user_cant_view_unrelated_campaign(client):
+    k = add_user()
+    add_campaign(k, add_character(k))
+    login(client, 1)
+    resp = client.get("/campaign/view/1")
+    assert resp.status_code == 403
+
+
+def test_gamemaster_adds_and_removes_character_with_secret(client):
+    login(client, 1)
+    k = add_user()
+    character_id = add_character(k)
+    campaign_id = add_campaign(1, 1)
+    uid = str(GameCharacter.query.get(character_id).character.uid)
+    client.post(
+        f"/campaign/edit/{campaign_id}/",
+        data={"name": "test", "new_character": character_id, "new_character_uid": uid},
+    )
+    assert GameCampaign.query.get(campaign_id).characters() == [1, character_id]
+    client.post(
+        f"/campaign/edit/{campaign_id}/",
+        data={"name": "test", "remove_member_1": "y"},
+    )
+    assert GameCampaign.query.get(campaign_id).characters() == [character_id]
@@ -0,0 +1,303 @@
+import itertools
+import os
+import tempfile
+import time
+import pytest
+from PIL import Image, ImageChops
+from itsdangerous import URLSafeSerializer
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.blueprints import charimg
+from tabletop_story.blueprints.charimg import layer_atlas, PortraitCache
+from tabletop_story.models import User
+
+
+@pytest.fixture
+def client(tmp_path):
+    global app, db, bcrypt, login_manager
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app.config["PORTRAIT_CACHE_DIR"] = str(tmp_path)
+    app = init_app(app)
+    client = app.test_client()
+    with app.app_context():
+        with client:
+            db.create_all()
+            yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def login(client):
+    db.session.add(
+        User(
+            email="1@example.com",
+            username="1",
+            password="password",
+            is_admin=False,
+        )
+    )
+    db.session.commit()
+    client.post(
+        "/account/login",
+        data={"email": "1@example.com", "password": "password"},
+        follow_redirects=True,
+    )
+
+
+def test_atlas_only_has_layers():
+    layers = layer_atlas.load()
+    assert "body0" in layers and "hatwizard" in layers
+    assert all(image.mode == "RGBA" for image in layers.values())
+    assert not any(name[0].isdigit() or "head" in name[1:] for name in layers)
+
+
+def test_composite_matches_pasting_from_disk():
+    names = ["body1", "headoval", "faceneutral", "hairnancy", "hatwizard"]
+    expected = Image.open(os.path.join(charimg.path, "body1.png"))
+    for name in names[1:]:
+        layer = Image.open(os.path.join(charimg.path, f"{name}.png"))
+        expected.paste(layer, (0, 0), layer)
+    composite = layer_atlas.composite(names)
+    assert ImageChops.difference(composite, expected).getbbox() is None
+    # the atlas's own layers are never drawn on
+    assert layer_atlas["body1"].tobytes() != composite.tobytes()
+
+
+def test_design_values_are_validated():
+    assert charimg.design_values([1, "headoval", "faceneutral", None, "None"]) == (
+        "1",
+        "headoval",
+        "faceneutral",
+        "None",
+        "None",
+    )
+    for design in (
+        ["9", "headoval", "faceneutral", "None", "None"],
+        ["0", "faceneutral", "faceneutral", "None", "None"],
+        ["0", "headoval", "../../../etc/passwd", "None", "None"],
+        ["0", "headoval", "faceneutral", "None", "0headovalfaceneutralNoneNone"],
+        ["0", "headoval", "faceneutral", "None", ["hatelf"]],
+        ["0", "headoval", "faceneutral", "None"],
+    ):
+        with pytest.raises(ValueError):
+            charimg.design_values(design)
+
+
+def test_portrait_cache_saves_variants(tmp_path):
+    cache = PortraitCache(str(tmp_path))
+    design = charimg.design_values(["2", "headsquare", "facesmirk", "None", "hatelf"])
+    name = charimg.portrait_name(design)
+    assert name == f"2-headsquare-facesmirk-None-hatelf-{layer_atlas.version}.png"
+    assert charimg.design_from_portrait_name(name) == design
+    directory, filename = cache.get(design)
+    assert (directory, filename) == (str(tmp_path), name[:-4] + "-full.png")
+    assert cache.get(design) == (directory, filename)
+    assert (cache.hits, cache.misses) == (1, 1)
+    expected = charimg.composite_portrait(design)
+    with Image.open(tmp_path / filename) as image:
+        assert image.size == (480, 640)
+        # a palette changes the artwork very little
+        difference = ImageChops.difference(image.convert("RGBA"), expected)
+        assert max(high for low, high in difference.getextrema()) < 48
+    _, filename = cache.get(design, "small", "webp")
+    with Image.open(tmp_path / filename) as image:
+        assert (image.format, image.size) == ("WEBP", (120, 160))
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_portrait_cache_evicts_least_recently_used(tmp_path):
+    cache = PortraitCache(str(tmp_path))
+    filenames = [
+        cache.get(
+            charimg.design_values([body, "headoval", "faceneutral", "None", "None"])
+        )[1]
+        for body in ("0", "1", "2")
+    ]
+    for age, filename in zip((300, 100, 200), filenames):
+        os.utime(tmp_path / filename, (time.time() - age, time.time() - age))
+    sizes = {filename: os.path.getsize(tmp_path / filename) for filename in filenames}
+    cache.max_bytes = sizes[filenames[1]] + sizes[filenames[2]]
+    cache.evict()
+    assert sorted(path.name for path in tmp_path.glob("*.png")) == sorted(filenames[1:])
+    cache.max_bytes = sizes[filenames[1]]
+    cache.evict()
+    assert [path.name for path in tmp_path.glob("*.png")] == [filenames[1]]
+
+
+def test_design_from_portrait_name_rejects_unknown_names():
+    layer_atlas.load()
+    for name in (
+        "0-headoval-faceneutral-None-None.png",
+        "0-headoval-faceneutral-None-None-0123456789.png",
+        f"0-headoval-hatelf-None-None-{layer_atlas.version}.png",
+        f"../0-headoval-faceneutral-None-None-{layer_atlas.version}.png",
+    ):
+        assert charimg.design_from_portrait_name(name) is None
+
+
+def test_edited_portrait_is_served(client, tmp_path):
+    resp = client.post(
+        "/character/img", json=["3", "headcircle", "faceshocked", "hairwings", "None"]
+    )
+    assert resp.status_code == 200
+    url = resp.get_json()
+    assert url.startswith("/character/portrait/3-headcircle-")
+    assert url.endswith(".png?size=medium")
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.mimetype == "image/png"
+    assert resp.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert "Accept" in resp.headers["Vary"]
+    resp.close()
+    resp = client.get(url, headers={"Accept": "image/avif,image/webp,*/*"})
+    assert resp.mimetype == "image/webp"
+    resp.close()
+    assert client.get(url, headers={"Accept": "*/*"}).mimetype == "image/png"
+    # evicted portraits are made again
+    for path in tmp_path.glob("*-medium.png"):
+        os.remove(path)
+    resp = client.get(url)
+    assert resp.status_code == 200
+    resp.close()
+    assert len(list(tmp_path.glob("*-medium.png"))) == 1
+
+
+def test_invalid_portraits_are_rejected(client, tmp_path):
+    for data in (["0", "headoval", "../hack", "None", "None"], {"body": "0"}, None):
+        resp = client.post("/character/img", json=data)
+        assert resp.status_code != 200
+    assert client.get("/character/portrait/..%2F..%2Fapp.py").status_code == 404
+    assert client.get("/character/portrait/body0.png").status_code == 404
+    name = charimg.charimg("0", "headoval", "faceneutral", "None", "None")
+    assert client.get(f"/character/portrait/{name}?size=huge").status_code == 404
+    assert not list(tmp_path.glob("*.png"))
+
+
+def test_sprite_sheet_is_served(client, tmp_path):
+    names = [
+        charimg.charimg(body, "headoval", "faceneutral", "None", "None")
+        for body in ("0", "1", "2")
+    ]
+    sheet = charimg.SpriteSheet(names + names[:1], "small")
+    assert sheet.names == tuple(names)
+    with app.test_request_context():
+        url = sheet.url()
+        assert "background-position: 50% 0" in sheet.style(names[1])
+        offsets_url = charimg.SpriteSheet([names[1]], "small").url(
+            "character.get_sprite_sheet_offsets"
+        )
+    assert client.get(url).status_code != 200
+    login(client)
+    resp = client.get(offsets_url)
+    assert resp.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert resp.get_json()["offsets"] == {
+        names[1]: {"x": 0, "y": 0, "width": 120, "height": 160}
+    }
+    resp = client.get(url, headers={"Accept": "image/webp,*/*"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "image/webp"
+    resp.close()
+    with Image.open(tmp_path / f"{sheet.key}.webp") as image:
+        assert image.size == (360, 160)
+    resp = client.get(url)
+    assert resp.mimetype == "image/png"
+    resp.close()
+    # the sheet is cut from the same portraits which are served alone
+    with Image.open(tmp_path / f"{sheet.key}.png") as image:
+        sprite = image.convert("RGBA").crop((120, 0, 240, 160))
+    _, filename = charimg.portrait_cache.get(sheet.designs[1], "small")
+    with Image.open(tmp_path / filename) as image:
+        difference = ImageChops.difference(sprite, image.convert("RGBA"))
+        assert max(high for low, high in difference.getextrema()) < 48
+
+
+def test_invalid_sprite_sheets_are_rejected(client, tmp_path):
+    login(client)
+    name = charimg.charimg("0", "headoval", "faceneutral", "None", "None")
+    with app.test_request_context():
+        serializer = charimg.sprite_sheet_serializer()
+        signed = charimg.SpriteSheet([name]).token()
+    forged = URLSafeSerializer("not the secret key", salt="sprite-sheet")
+    for query in (
+        "",
+        f"portrait={name}&size=medium",
+        f"sheet={signed[:-1]}",
+        f"sheet={forged.dumps([[name], 'medium'])}",
+        f"sheet={serializer.dumps([[name], 'huge'])}",
+        f"sheet={serializer.dumps([[name, 'body0.png'], 'medium'])}",
+        f"sheet={serializer.dumps({'names': [name]})}",
+        "sheet="
+        + serializer.dumps(
+            [
+                [
+                    charimg.charimg(*design)
+                    for design in itertools.islice(charimg.all_designs(), 33)
+                ],
+                "medium",
+            ]
+        ),
+    ):
+        assert client.get(f"/character/portraits?{query}").status_code == 404
+        assert client.get(f"/character/portraits.json?{query}").status_code == 404
+    assert charimg.SpriteSheet.for_page([]) is None
+    assert not list(tmp_path.glob("*.png"))
+
+
+def test_all_designs_matches_the_layers():
+    designs = list(charimg.all_designs())
+    assert len(designs) == 6 * 3 * 9 * 4 * 6
+    for design in designs[:: len(designs) // 20]:
+        assert charimg.design_values(design) == design
+
+
+def test_pregenerated_portraits_are_not_composited(client, tmp_path, monkeypatch):
+    designs = [
+        ("0", "headoval", "faceneutral", "None", "None"),
+        ("5", "headcircle", "facecloud", "hairwings", "hatcrown"),
+    ]
+    monkeypatch.setattr(charimg, "all_designs", lambda: iter(designs))
+    pregenerated = tmp_path / "pregenerated"
+    pregenerated.mkdir()
+    (pregenerated / f"0-old-{layer_atlas.version}-full.png").write_bytes(b"")
+    assert charimg.pregenerate(str(pregenerated), processes=1) == (2, 2)
+    assert charimg.pregenerate(str(pregenerated), processes=1) == (0, 2)
+    assert sorted(path.name for path in pregenerated.iterdir()) == sorted(
+        [
+            filename
+            for design in designs
+            for filename in charimg.all_variants(charimg.portrait_name(design))
+        ]
+        + ["manifest.json"]
+    )
+
+    cache = charimg.portrait_cache
+    monkeypatch.setattr(cache, "pregenerated_directory", str(pregenerated))
+    cache.load_manifest()
+    try:
+        name = charimg.charimg(*designs[1])
+        resp = client.get(f"/character/portrait/{name}?size=small")
+        assert resp.status_code == 200
+        assert resp.data == (pregenerated / f"{name[:-4]}-small.png").read_bytes()
+        resp.close()
+        assert not list(tmp_path.glob("*.png"))
+        # portraits which weren't pregenerated are still composited
+        name = charimg.charimg("1", "headoval", "faceneutral", "None", "None")
+        client.get(f"/character/portrait/{name}").close()
+        assert os.path.exists(tmp_path / f"{name[:-4]}-full.png")
+    finally:
+        cache.pregenerated = frozenset()
+
+
+def test_manifest_of_old_artwork_is_ignored(tmp_path, monkeypatch):
+    (tmp_path / "manifest.json").write_text(
+        '{"version": "0000000000", "portraits": ["0-headoval-faceneutral-None-None-0000000000.png"]}'
+    )
+    cache = PortraitCache()
+    cache.pregenerated_directory = str(tmp_path)
+    cache.load_manifest()
+    assert cache.pregenerated == frozenset()
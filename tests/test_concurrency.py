@@ -0,0 +1,229 @@
+import os
+import tempfile
+import threading
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.models import (
+    User,
+    GameCharacter,
+    GameCampaign,
+    CampaignLocation,
+    LocationScene,
+    SceneNPC,
+)
+from tabletop_story import concurrency
+from tabletop_story.dnd_campaign import NPC
+from dnd_character.classes import Fighter
+from dnd_character.monsters import SRD_monsters
+
+
+@pytest.fixture
+def client():
+    global app, db, bcrypt, login_manager
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app = init_app(app)
+    client = app.test_client()
+    with app.app_context():
+        with client:
+            db.create_all()
+            db.session.add(
+                User(
+                    email="1@example.com",
+                    username="1",
+                    password="password",
+                    is_admin=False,
+                )
+            )
+            thor = Fighter(name="thor", experience=255, alignment="TN")
+            character = GameCharacter(user_id=1, name=thor.name, data=dict(thor))
+            location = CampaignLocation(name="location", campaign_id=1)
+            db.session.add_all(
+                [
+                    character,
+                    location,
+                    GameCampaign(
+                        name="test",
+                        gamemaster=1,
+                        members=[character],
+                        active_location=0,
+                    ),
+                ]
+            )
+            db.session.flush()
+            scene = LocationScene(name="scene", location_id=location.id)
+            db.session.add(scene)
+            db.session.flush()
+            zombie = NPC.from_template(SRD_monsters["zombie"]).as_dict()
+            for i in range(4):
+                db.session.add(
+                    SceneNPC(name=f"zombie {i}", scene_id=scene.id, data=str(zombie))
+                )
+            db.session.commit()
+            yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def login(client):
+    client.post(
+        "/account/login",
+        data={"email": "1@example.com", "password": "password"},
+        follow_redirects=True,
+    )
+
+
+def start_combat(client):
+    client.get("/campaign/location/1/activate/1")
+    client.get("/location/scene/1/activate/1")
+    client.get("/campaign/combat/1/toggle")
+
+
+def write_elsewhere(table):
+    """Increments a row's version outside of this session, like another worker"""
+    key = "id" if table == "game_campaign" else "campaign_id"
+    db.engine.execute(f"UPDATE {table} SET version = version + 1 WHERE {key} = 1")
+
+
+def test_stale_combat_write_is_rejected(client):
+    campaign = GameCampaign.query.get(1)
+    combat = campaign.get_combat()
+    write_elsewhere("campaign_combat")
+    combat.active = True
+    with pytest.raises(StaleDataError):
+        campaign.save_combat(combat)
+        db.session.commit()
+    db.session.rollback()
+    assert not GameCampaign.query.get(1).get_combat().active
+
+
+def test_stale_campaign_write_is_rejected(client):
+    campaign = GameCampaign.query.get(1)
+    write_elsewhere("game_campaign")
+    campaign.name = "renamed"
+    with pytest.raises(StaleDataError):
+        db.session.commit()
+    db.session.rollback()
+    assert GameCampaign.query.get(1).name == "test"
+
+
+def test_conflicting_request_is_retried(client, monkeypatch):
+    login(client)
+    client.get("/campaign/location/1/activate/1")
+    client.get("/location/scene/1/activate/1")
+    get_combat = GameCampaign.get_combat
+    conflicts = []
+
+    def get_combat_and_lose_a_race(self):
+        combat = get_combat(self)
+        if len(conflicts) < concurrency.MAX_ATTEMPTS - 1:
+            conflicts.append(combat)
+            write_elsewhere("campaign_combat")
+        return combat
+
+    monkeypatch.setattr(GameCampaign, "get_combat", get_combat_and_lose_a_race)
+    resp = client.get("/campaign/combat/1/toggle", follow_redirects=True)
+    assert resp.status_code == 200
+    assert resp.data.count(b"Combat has begun!") == 1
+    monkeypatch.undo()
+    combat = GameCampaign.query.get(1).get_combat()
+    assert combat.active and len(combat.turn_sequence) == 5
+
+
+def test_request_gives_up_after_bounded_retries(client, monkeypatch):
+    login(client)
+    client.get("/campaign/location/1/activate/1")
+    get_combat = GameCampaign.get_combat
+    attempts = []
+
+    def get_combat_and_always_lose(self):
+        combat = get_combat(self)
+        attempts.append(combat)
+        write_elsewhere("campaign_combat")
+        return combat
+
+    monkeypatch.setattr(GameCampaign, "get_combat", get_combat_and_always_lose)
+    resp = client.get("/location/scene/1/activate/1")
+    assert resp.status_code == 409
+    assert len(attempts) == concurrency.MAX_ATTEMPTS
+    monkeypatch.undo()
+    assert GameCampaign.query.get(1).get_combat().scene_id == 0
+
+
+def test_concurrent_turn_advances_all_count(client):
+    login(client)
+    start_combat(client)
+    version = GameCampaign.query.get(1).combat_state.version
+    statuses = []
+
+    def gamemaster():
+        with app.app_context(), app.test_client() as worker:
+            login(worker)
+            for _ in range(10):
+                statuses.append(worker.get("/campaign/combat/1/next").status_code)
+
+    threads = [threading.Thread(target=gamemaster) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses == [302] * 40
+    db.session.expire_all()
+    combat_state = GameCampaign.query.get(1).combat_state
+    assert combat_state.turn_index == 40 % 5
+    assert combat_state.version == version + 40
+
+
+def test_nested_views_are_retried_as_a_whole(client, monkeypatch, caplog):
+    login(client)
+
+    def set_combat_and_always_lose(self, scene_id, characters):
+        raise StaleDataError("another worker changed the combat")
+
+    monkeypatch.setattr(GameCampaign, "set_combat", set_combat_and_always_lose)
+    # activating a scene also activates its location, within the same retries
+    with caplog.at_level("INFO", logger="tabletop_story"):
+        resp = client.get("/location/scene/1/activate/1")
+    assert resp.status_code == 409
+    conflicts = [
+        record.args for record in caplog.records if "Write conflict" in record.msg
+    ]
+    assert conflicts == [
+        ("activate_location_scene_post", attempt)
+        for attempt in range(1, concurrency.MAX_ATTEMPTS + 1)
+    ]
+
+
+def test_stale_inventory_write_is_retried(client, monkeypatch):
+    login(client)
+    clubs = [
+        item["index"] for item in GameCharacter.query.get(1).character.inventory
+    ].count("club")
+    update_data = GameCharacter.update_data
+    conflicts = []
+
+    def update_data_and_lose_a_race(self, data):
+        if not conflicts:
+            # e.g., the gamemaster changing this character's HP in combat
+            conflicts.append(data)
+            db.engine.execute(
+                "UPDATE game_character SET version = version + 1 WHERE id = 1"
+            )
+        update_data(self, data)
+
+    monkeypatch.setattr(GameCharacter, "update_data", update_data_and_lose_a_race)
+    resp = client.post(
+        "/character/edit/1/inventory",
+        data={"new_item": "club", "submit_add": True},
+    )
+    assert resp.status_code == 302
+    assert len(conflicts) == 1
+    monkeypatch.undo()
+    inventory = GameCharacter.query.get(1).character.inventory
+    assert [item["index"] for item in inventory].count("club") == clubs + 1
@@ -1,6 +1,7 @@
 import pytest
 from ast import literal_eval
-from tabletop_story.dnd_campaign import Combat, NPC
+from tabletop_story.dnd_campaign import Combat, CombatLog, NPC, NPC_TYPE
+from tabletop_story.dnd_campaign import combat as combat_module
 from dnd_character import Character
 from dnd_character.monsters import SRD_monsters
 
@@ -69,3 +70,168 @@ def test_dnd_campaign_serialization(combat):
 def test_dnd_campaign_serialization_active(combat):
     combat.active = True
     test_dnd_campaign_serialization(combat)
+
+
+def test_dnd_campaign_turn_sequence_follows_tie_break_rules(monkeypatch):
+    monkeypatch.setattr(combat_module, "randint", lambda low, high: 10)
+    c = Combat(characters=[(1, 10), (2, 14)], npcs=[(1, 12), (2, 14)])
+    c.active = True
+    # same roll, so the higher dex modifier goes first, then the random tiebreak
+    assert [(each.type, each.id) for each in c.turn_sequence[2:]] == [(1, 1), (0, 1)]
+    assert {(each.type, each.id) for each in c.turn_sequence[:2]} == {(0, 2), (1, 2)}
+    assert c.turn_sequence == sorted(c.turn_sequence, key=combat_module.turn_order)
+
+
+def test_dnd_campaign_duplicate_combatants_keep_their_turns():
+    c = Combat(characters=[(1, 10), (1, 10)], npcs=[(1, 10)] * 300)
+    c.active = True
+    assert len(c.turn_sequence) == 302
+    assert c.turn_sequence == sorted(c.turn_sequence, key=combat_module.turn_order)
+
+
+def test_dnd_campaign_add_combatant_keeps_the_current_turn(combat):
+    combat.active = True
+    before = list(combat.turn_sequence)
+    for _ in range(5):
+        combat.next()
+    current = combat.turn_sequence[combat.turn_index]
+    for i in range(20):
+        combatant = combat.add_combatant(100 + i, NPC_TYPE, 30)
+        assert combat.turn_sequence[combat.turn_index] == current
+    assert combatant in combat.turn_sequence
+    assert (119, 30) in combat.npcs
+    # nobody else rolled again
+    assert [each for each in combat.turn_sequence if each.id < 100] == before
+    assert combat.turn_sequence == sorted(
+        combat.turn_sequence, key=combat_module.turn_order
+    )
+
+
+def test_dnd_campaign_remove_combatant(combat):
+    combat.active = True
+    for _ in range(3):
+        combat.next()
+    current = combat.turn_sequence[combat.turn_index]
+    following = combat.turn_sequence[combat.turn_index + 1]
+    removed = combat.turn_sequence[0]
+    combat.remove_combatant(removed.id, removed.type)
+    assert combat.turn_sequence[combat.turn_index] == current
+    combat.remove_combatant(current.id, current.type)
+    assert combat.turn_sequence[combat.turn_index] == following
+    assert len(combat.turn_sequence) == 10
+    roster = combat.npcs if removed.type == NPC_TYPE else combat.characters
+    assert removed.id not in [each.id for each in roster]
+
+
+def test_dnd_campaign_old_turn_sequence_is_loaded():
+    c = Combat(active=True, npcs=[(1, 10)], turn_sequence=[(1, 1), (2, 0)])
+    assert [tuple(each[:2]) for each in c.turn_sequence] == [(1, 1), (2, 0)]
+    c.next()
+    assert c.turn_index == 1
+
+
+def combat_log_state(log):
+    """The parts of a CombatLog which undo and redo restore"""
+    state = log.snapshot()
+    for key in ("event_id", "undo", "redo"):
+        del state[key]
+    state["characters"].sort()
+    state["npcs"].sort()
+    return state
+
+
+def test_dnd_campaign_combat_log_undo_and_redo_are_inverses(combat):
+    log = CombatLog()
+    events = [
+        ("scene", {"scene_id": 1, "characters": combat.characters, "npcs": combat.npcs})
+    ]
+    combat.active = True
+    events.append(("start", {"turn_sequence": combat.turn_sequence, "hp": {"1:0": 22}}))
+    events.extend([("next", {})] * 13)
+    events.append(
+        ("add", {"id": 50, "type": NPC_TYPE, "roll": [50, NPC_TYPE, 30], "dex": 30})
+    )
+    events.append(("hp", {"id": 0, "type": NPC_TYPE, "old": 22, "new": 7}))
+    states = []
+    for event_id, (kind, data) in enumerate(events, 1):
+        log.apply(event_id, kind, data)
+        states.append(combat_log_state(log))
+    removed = log.combat.turn_sequence[3]
+    events.append(
+        (
+            "remove",
+            {
+                "id": removed.id,
+                "type": removed.type,
+                "rolls": [removed],
+                "roster": [
+                    each
+                    for each in (
+                        log.combat.npcs
+                        if removed.type == NPC_TYPE
+                        else log.combat.characters
+                    )
+                    if each.id == removed.id
+                ],
+                "turn_index": log.combat.turn_index,
+            },
+        )
+    )
+    log.apply(len(events), *events[-1])
+    states.append(combat_log_state(log))
+    assert log.combat.round == 2
+    assert log.hp == {"1:0": 7}
+    assert len(log.combat.turn_sequence) == 12
+
+    event_id = len(events)
+    while log.undo:
+        event = log.undo[-1]
+        kind, data = events[event - 1]
+        event_id += 1
+        log.apply(event_id, "undo", {"event": event, "kind": kind, "data": data})
+        assert combat_log_state(log) == combat_log_state(
+            CombatLog().replay(
+                (i, kind, data) for i, (kind, data) in enumerate(events[: event - 1], 1)
+            )
+        )
+    # the scene can't be undone
+    assert combat_log_state(log) == states[0]
+    while log.redo:
+        event = log.redo[-1]
+        kind, data = events[event - 1]
+        event_id += 1
+        log.apply(event_id, "redo", {"event": event, "kind": kind, "data": data})
+        assert combat_log_state(log) == states[event - 1]
+    assert log.undo == list(range(2, len(events) + 1))
+
+
+def test_dnd_campaign_combat_log_new_event_clears_redo(combat):
+    log = CombatLog().replay(
+        [
+            (1, "scene", {"scene_id": 1, "characters": [], "npcs": combat.npcs}),
+            (2, "start", {"turn_sequence": [[0, NPC_TYPE, 5]], "hp": {}}),
+            (
+                3,
+                "undo",
+                {
+                    "event": 2,
+                    "kind": "start",
+                    "data": {"turn_sequence": [[0, NPC_TYPE, 5]], "hp": {}},
+                },
+            ),
+        ]
+    )
+    assert log.redo == [2] and not log.combat.active
+    log.apply(4, "hp", {"id": 0, "type": NPC_TYPE, "old": 22, "new": 20})
+    assert log.redo == [] and log.undo == [4]
+
+
+def test_dnd_campaign_combat_log_snapshot_round_trip(combat):
+    combat.active = True
+    log = CombatLog(combat=combat, hp={"1:0": 3}, undo=[4, 5], event_id=5)
+    log.apply(6, "next", {})
+    snapshot = literal_eval(str(log.snapshot()))
+    restored = CombatLog.from_snapshot(snapshot)
+    assert restored.snapshot() == log.snapshot()
+    assert restored.combat.turn_sequence == combat.turn_sequence
+    assert restored.combat.turn_index == 1 and restored.undo == [4, 5, 6]
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import pytest
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.models import (
+    User,
+    GameCampaign,
+    CampaignLocation,
+    LocationScene,
+    SceneNPC,
+)
+from tabletop_story.dnd_campaign import NPC
+from tabletop_story.cache import fragment_cache
+from dnd_character.monsters import SRD_monsters
+
+
+@pytest.fixture
+def client():
+    global app, db, bcrypt, login_manager
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app = init_app(app)
+    client = app.test_client()
+    fragment_cache.clear()
+    with app.app_context():
+        with client:
+            db.create_all()
+            db.session.add(
+                User(
+                    email="1@example.com",
+                    username="1",
+                    password="password",
+                    is_admin=False,
+                )
+            )
+            db.session.add(GameCampaign(name="test", gamemaster=1, active_location=0))
+            db.session.add(CampaignLocation(name="location", campaign_id=1))
+            db.session.add(LocationScene(name="scene", location_id=1))
+            zombie = NPC.from_template(SRD_monsters["zombie"]).as_dict()
+            db.session.add(SceneNPC(name="zombie", scene_id=1, data=str(zombie)))
+            db.session.commit()
+            yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def login(client):
+    client.post(
+        "/account/login",
+        data={"email": "1@example.com", "password": "password"},
+        follow_redirects=True,
+    )
+
+
+def test_spell_card_not_modified(client):
+    resp = client.get("/spells/get/fireball")
+    assert resp.status_code == 200
+    assert resp.headers["Cache-Control"] == "public, max-age=86400"
+    etag = resp.headers["ETag"]
+    lookups = fragment_cache.hits + fragment_cache.misses
+    resp = client.get("/spells/get/fireball", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.data == b""
+    assert resp.headers["ETag"] == etag
+    assert fragment_cache.hits + fragment_cache.misses == lookups
+
+
+def test_etag_depends_on_url(client):
+    fireball = client.get("/monsters/get/zombie/card").headers["ETag"]
+    resp = client.get("/monsters/get/goblin/card", headers={"If-None-Match": fireball})
+    assert resp.status_code == 200
+    assert resp.get_json()["name"] == "Goblin"
+
+
+def test_pages_depend_on_login(client):
+    resp = client.get("/rules")
+    assert resp.headers["Cache-Control"] == "private, no-cache"
+    etag = resp.headers["ETag"]
+    assert client.get("/rules", headers={"If-None-Match": etag}).status_code == 304
+    login(client)
+    resp = client.get("/rules", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+def test_missing_spell_is_not_cached(client):
+    resp = client.get("/spells/view/nonsense")
+    assert resp.status_code == 404
+    assert "ETag" not in resp.headers
+
+
+def test_npc_card_etag_changes_with_data(client):
+    login(client)
+    resp = client.get("/scene/npc/get/1/card")
+    assert resp.headers["Cache-Control"] == "private, no-cache"
+    etag = resp.headers["ETag"]
+    resp = client.get("/scene/npc/get/1/card", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    npc = SceneNPC.query.get(1)
+    npc.data = npc.data.replace("22", "23")
+    db.session.commit()
+    resp = client.get("/scene/npc/get/1/card", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+def test_npc_card_still_requires_gamemaster(client):
+    assert client.get("/scene/npc/get/1/card").status_code != 200
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import logging
+import pytest
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.models import User
+from tabletop_story.instrumentation import sql_instrumentation
+
+
+@pytest.fixture
+def client():
+    global app, db, bcrypt, login_manager
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app.config["SQL_INSTRUMENTATION"] = True
+    app.config["SLOW_REQUEST_QUERIES"] = 1
+    app = init_app(app)
+    client = app.test_client()
+    sql_instrumentation.reset()
+    with app.app_context():
+        with client:
+            db.create_all()
+            for i, is_admin in ((1, True), (2, False)):
+                db.session.add(
+                    User(
+                        email=f"{i}@example.com",
+                        username=f"{i}",
+                        password="password",
+                        is_admin=is_admin,
+                    )
+                )
+            db.session.commit()
+            yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def login(client, user_id):
+    # not following the redirect, which would count a request to the dashboard
+    client.post(
+        "/account/login",
+        data={"email": f"{user_id}@example.com", "password": "password"},
+    )
+
+
+def test_statements_counted_per_endpoint(client):
+    login(client, 2)
+    client.get("/")
+    client.get("/")
+    stats = dict(sql_instrumentation.snapshot())["dashboard.index"]
+    assert stats.requests == 2
+    assert stats.statements >= 4
+    assert stats.slowest_statement.startswith("SELECT")
+
+
+def test_slow_request_logged(client, caplog):
+    login(client, 2)
+    with caplog.at_level(logging.WARNING):
+        client.get("/")
+    assert "(dashboard.index)" in caplog.text
+
+
+def test_admin_can_view_sql_stats(client):
+    login(client, 1)
+    client.get("/")
+    resp = client.get("/admin/sql")
+    assert resp.status_code == 200
+    assert b"dashboard.index" in resp.data
+
+
+def test_user_cant_view_sql_stats(client):
+    login(client, 2)
+    resp = client.get("/admin/sql")
+    assert resp.status_code == 403
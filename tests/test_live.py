@@ -0,0 +1,188 @@
+import os
+import json
+import tempfile
+import pytest
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.models import (
+    User,
+    GameCharacter,
+    GameCampaign,
+    CampaignLocation,
+    LocationScene,
+    SceneNPC,
+)
+from tabletop_story.live import live_updates
+from tabletop_story.dnd_campaign import NPC
+from dnd_character.classes import Fighter
+from dnd_character.monsters import SRD_monsters
+
+
+@pytest.fixture
+def client():
+    global app, db, bcrypt, login_manager
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    live_dir = tempfile.TemporaryDirectory()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app.config["LIVE_UPDATES"] = True
+    app.config["LIVE_DB"] = os.path.join(live_dir.name, "live.db")
+    app.config["LIVE_POLL_SECONDS"] = 0.01
+    app.config["LIVE_STREAM_SECONDS"] = 0
+    app = init_app(app)
+    # streams which an earlier test left open don't count against this one
+    live_updates._open_streams = 0
+    client = app.test_client()
+    with app.app_context():
+        with client:
+            db.create_all()
+            for i in (1, 2, 3):
+                db.session.add(
+                    User(
+                        email=f"{i}@example.com",
+                        username=f"{i}",
+                        password="password",
+                        is_admin=False,
+                    )
+                )
+            thor = Fighter(name="thor", experience=255, alignment="TN")
+            character = GameCharacter(user_id=2, name=thor.name, data=dict(thor))
+            location = CampaignLocation(name="location", campaign_id=1)
+            db.session.add_all(
+                [
+                    character,
+                    location,
+                    GameCampaign(
+                        name="test",
+                        gamemaster=1,
+                        members=[character],
+                        active_location=0,
+                    ),
+                ]
+            )
+            db.session.flush()
+            scene = LocationScene(name="scene", location_id=location.id)
+            db.session.add(scene)
+            db.session.flush()
+            zombie = NPC.from_template(SRD_monsters["zombie"]).as_dict()
+            for i in range(2):
+                db.session.add(
+                    SceneNPC(name=f"zombie {i}", scene_id=scene.id, data=str(zombie))
+                )
+            db.session.commit()
+            yield client
+    # the other tests run without live updates
+    app.config["LIVE_UPDATES"] = False
+    live_updates.init_app(app)
+    live_dir.cleanup()
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def login(client, user_id):
+    client.post(
+        "/account/login",
+        data={"email": f"{user_id}@example.com", "password": "password"},
+        follow_redirects=True,
+    )
+
+
+def start_combat(client):
+    client.get("/campaign/location/1/activate/1")
+    client.get("/location/scene/1/activate/1")
+    client.get("/campaign/combat/1/toggle")
+
+
+def published(since=0):
+    return [json.loads(data) for _, data in live_updates.updates(1, since)]
+
+
+def read_events(body):
+    """Returns list of the data of each SSE message in a response body"""
+    return [
+        json.loads(line[len("data: ") :])
+        for line in body.decode("utf-8").split("\n")
+        if line.startswith("data: ")
+    ]
+
+
+def test_each_change_is_published_once(client):
+    login(client, 1)
+    start_combat(client)
+    states = published()
+    # the location, the scene, and the start of combat
+    assert len(states) == 3
+    assert states[0]["location_id"] == 1 and states[0]["scene_id"] == 0
+    assert states[1]["scene_id"] == 1 and not states[1]["active"]
+    assert states[2]["active"] and len(states[2]["turn_sequence"]) == 3
+    since = live_updates.last_id()
+    client.get("/campaign/combat/1/next")
+    (state,) = published(since)
+    assert state["turn_index"] == 1 and state["round"] == 1
+    assert {each["name"] for each in state["turn_sequence"]} == {
+        "thor",
+        "zombie 0",
+        "zombie 1",
+    }
+
+
+def test_rolled_back_changes_are_not_published(client):
+    login(client, 1)
+    start_combat(client)
+    since = live_updates.last_id()
+    assert GameCampaign.query.get(1).next_turn()
+    db.session.rollback()
+    GameCampaign.query.get(1).name = "renamed"
+    db.session.commit()
+    assert published(since) == []
+
+
+def test_stream_sends_the_current_state_then_updates(client):
+    login(client, 1)
+    start_combat(client)
+    campaign = GameCampaign.query.get(1)
+    since = live_updates.last_id()
+    live_updates.stream_seconds = 5
+    stream = live_updates.stream(1, since, campaign.live_state())
+    assert next(stream).startswith("retry: ")
+    first = read_events(next(stream).encode("utf-8"))
+    assert first[0]["turn_index"] == 0
+    client.get("/campaign/combat/1/next")
+    client.get("/campaign/combat/1/next")
+    # only the latest of the waiting notifications is sent
+    message = next(stream)
+    assert message.startswith(f"id: {live_updates.last_id()}\n")
+    assert read_events(message.encode("utf-8"))[0]["turn_index"] == 2
+    stream.close()
+
+
+def test_stream_is_for_the_gamemaster_and_members(client):
+    login(client, 1)
+    start_combat(client)
+    resp = client.get("/campaign/live/1")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    assert read_events(resp.data)[0]["active"]
+    client.get("/account/logout")
+    login(client, 2)
+    assert client.get("/campaign/live/1").status_code == 200
+    assert b"new EventSource" in client.get("/campaign/view/1").data
+    client.get("/account/logout")
+    login(client, 3)
+    assert client.get("/campaign/live/1").status_code == 403
+    assert client.get("/campaign/live/2").status_code == 404
+
+
+def test_streams_are_capped_per_worker(client):
+    login(client, 1)
+    live_updates.max_streams = 1
+    first = client.get("/campaign/live/1", buffered=False)
+    assert first.status_code == 200
+    resp = client.get("/campaign/live/1")
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"]
+    first.close()
+    assert client.get("/campaign/live/1").status_code == 200
@@ -0,0 +1,49 @@
+from tabletop_story.markup import MarkdownMemo, srd_markdown, user_markdown
+
+
+def test_memo_is_bounded_lru():
+    calls = []
+
+    def markdown(text):
+        calls.append(text)
+        return f"<p>{text}</p>"
+
+    memo = MarkdownMemo(markdown, maxsize=2)
+    assert memo("a") == "<p>a</p>"
+    memo("b")
+    memo("a")
+    memo("c")
+    assert calls == ["a", "b", "c"]
+    assert memo.hits == 1 and memo.misses == 3
+    memo("b")
+    assert calls == ["a", "b", "c", "b"]
+
+
+def test_user_markdown_escapes_html():
+    html = user_markdown("*hi* <script>alert(1)</script> [x](javascript:alert(1))")
+    assert "<em>hi</em>" in html
+    assert "<script>" not in html
+    assert "javascript:" not in html
+
+
+def test_user_markdown_only_links_safe_schemes():
+    for url in (
+        "JaVaScRiPt:alert(1)",
+        "java%0ascript:alert(1)",
+        "&#106;avascript:alert(1)",
+        " VBScript:msgbox(1)",
+        "data:text/html,x",
+    ):
+        for markdown in (f"[x]({url})", f"![x]({url})"):
+            html = user_markdown(markdown)
+            assert "#harmful-link" in html
+            assert "script:" not in html.lower()
+    html = user_markdown(
+        "[a](https://example.com) [b](MAILTO:a@example.com) [c](/page#top) [d](?q=a:b)"
+    )
+    for url in ("https://example.com", "MAILTO:a@example.com", "/page#top", "?q=a:b"):
+        assert f'href="{url}"' in html
+
+
+def test_srd_markdown_keeps_html():
+    assert "<br>" in srd_markdown("line<br>break")
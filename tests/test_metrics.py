@@ -0,0 +1,132 @@
+import os
+import tempfile
+import pytest
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.models import User
+from tabletop_story.metrics import Metrics, metrics, quantile
+
+
+@pytest.fixture
+def client():
+    global app, db, bcrypt, login_manager
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    metrics_fd, metrics_path = tempfile.mkstemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app.config["METRICS"] = True
+    app.config["METRICS_DB"] = metrics_path
+    app = init_app(app)
+    client = app.test_client()
+    with app.app_context():
+        with client:
+            db.create_all()
+            for i, is_admin in ((1, True), (2, False)):
+                db.session.add(
+                    User(
+                        email=f"{i}@example.com",
+                        username=f"{i}",
+                        password="password",
+                        is_admin=is_admin,
+                    )
+                )
+            db.session.commit()
+            yield client
+    metrics.path = None
+    os.close(db_fd)
+    os.unlink(db_path)
+    os.close(metrics_fd)
+    os.unlink(metrics_path)
+
+
+def login(client, user_id):
+    client.post(
+        "/account/login",
+        data={"email": f"{user_id}@example.com", "password": "password"},
+        follow_redirects=True,
+    )
+
+
+def test_latency_histogram_per_endpoint(client):
+    login(client, 2)
+    client.get("/about")
+    client.get("/about")
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    text = resp.data.decode("utf-8")
+    assert "# TYPE tabletop_request_duration_seconds histogram" in text
+    assert (
+        'tabletop_request_duration_seconds_bucket{endpoint="main.about_page",le="+Inf"} 2'
+        in text
+    )
+    assert (
+        'tabletop_request_duration_seconds_count{endpoint="main.about_page"} 2' in text
+    )
+    assert 'tabletop_db_statements_total{endpoint="dashboard.index"}' in text
+
+
+def test_workers_are_aggregated(client):
+    client.get("/")
+    # another worker process publishing into the same database
+    worker = Metrics()
+    worker.path = metrics.path
+    for _ in range(3):
+        worker.observe(
+            "tabletop_request_duration_seconds", 0.02, endpoint="dashboard.index"
+        )
+    worker.increment("tabletop_charimg_generated_total", 2)
+    worker.flush()
+    text = client.get("/metrics").data.decode("utf-8")
+    assert (
+        'tabletop_request_duration_seconds_count{endpoint="dashboard.index"} 4' in text
+    )
+    assert "tabletop_charimg_generated_total 2" in text
+
+
+def test_inf_bucket_counts_every_flush(client):
+    for _ in range(2):
+        for seconds in (0.001, 30.0):
+            metrics.observe("tabletop_request_duration_seconds", seconds, endpoint="x")
+        metrics.flush()
+    counters, histograms = metrics.read()
+    assert counters[("tabletop_request_duration_seconds_count", 'endpoint="x"')] == 4
+    cumulative = histograms[("tabletop_request_duration_seconds", 'endpoint="x"')]
+    assert cumulative[0] == (0.005, 2)
+    assert cumulative[-1] == (float("inf"), 4)
+    with metrics.connect() as connection:
+        rows = connection.execute(
+            "SELECT count(*) FROM bucket WHERE labels = 'endpoint=\"x\"'"
+        ).fetchone()
+    assert rows == (2,)
+
+
+def test_large_counters_are_exact(client):
+    metrics.increment("tabletop_charimg_generated_total", 3703704)
+    metrics.observe("tabletop_request_duration_seconds", 0.1234567891, endpoint="x")
+    text = metrics.render()
+    assert "tabletop_charimg_generated_total 3703704\n" in text
+    assert 'tabletop_request_duration_seconds_sum{endpoint="x"} 0.1234567891\n' in text
+
+
+def test_metrics_forbidden_from_other_hosts(client):
+    remote = {"REMOTE_ADDR": "203.0.113.1"}
+    assert client.get("/metrics", environ_base=remote).status_code == 403
+    login(client, 1)
+    assert client.get("/metrics", environ_base=remote).status_code == 200
+
+
+def test_admin_can_view_latency(client):
+    login(client, 1)
+    client.get("/")
+    resp = client.get("/admin/metrics")
+    assert resp.status_code == 200
+    assert b"dashboard.index" in resp.data
+
+
+def test_quantile_interpolates_inside_bucket():
+    cumulative = [(0.1, 0), (0.2, 10), (float("inf"), 10)]
+    assert quantile(0.5, cumulative) == pytest.approx(0.15)
+    assert quantile(0.95, [(0.1, 0), (float("inf"), 0)]) is None
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import pytest
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.models import User
+from tabletop_story.profiling import request_profiler
+
+
+@pytest.fixture
+def client():
+    global app, db, bcrypt, login_manager, profile_dir
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    profile_dir = tempfile.mkdtemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app.config["PROFILE_DIR"] = profile_dir
+    app.config["PROFILE_KEEP"] = 2
+    app = init_app(app)
+    client = app.test_client()
+    with app.app_context():
+        with client:
+            db.create_all()
+            for i, is_admin in ((1, True), (2, False)):
+                db.session.add(
+                    User(
+                        email=f"{i}@example.com",
+                        username=f"{i}",
+                        password="password",
+                        is_admin=is_admin,
+                    )
+                )
+            db.session.commit()
+            yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+    shutil.rmtree(profile_dir)
+
+
+def login(client, user_id):
+    client.post(
+        "/account/login",
+        data={"email": f"{user_id}@example.com", "password": "password"},
+        follow_redirects=True,
+    )
+
+
+def test_admin_request_is_profiled(client):
+    login(client, 1)
+    resp = client.get("/?profile=1")
+    assert resp.status_code == 200
+    name = resp.headers["X-Profile-Id"]
+    assert os.path.exists(os.path.join(profile_dir, f"{name}.html"))
+    profiles = request_profiler.recent()
+    assert profiles[0]["endpoint"] == "dashboard.index"
+    resp = client.get("/admin/profiles")
+    assert resp.status_code == 200
+    assert b"dashboard.index" in resp.data
+    resp = client.get(f"/admin/profiles/{name}")
+    assert resp.status_code == 200
+    assert b"dashboard.index" in resp.data
+
+
+def test_profile_download(client):
+    login(client, 1)
+    name = client.get("/", headers={"X-Profile": "1"}).headers["X-Profile-Id"]
+    # .prof from cProfile, or .pyisession when pyinstrument is installed
+    ext = request_profiler.recent()[0]["download"]
+    assert os.path.exists(os.path.join(profile_dir, f"{name}{ext}"))
+    resp = client.get(f"/admin/profiles/{name}{ext}")
+    assert resp.status_code == 200
+    assert "attachment" in resp.headers["Content-Disposition"]
+    assert ext.encode("utf-8") in client.get("/admin/profiles").data
+
+
+def test_oldest_profiles_are_pruned(client):
+    login(client, 1)
+    names = [client.get("/?profile=1").headers["X-Profile-Id"] for _ in range(3)]
+    assert [meta["name"] for meta in request_profiler.recent()] == names[:0:-1]
+    assert not os.path.exists(os.path.join(profile_dir, f"{names[0]}.html"))
+
+
+def test_user_cant_profile(client):
+    login(client, 2)
+    resp = client.get("/?profile=1")
+    assert "X-Profile-Id" not in resp.headers
+    assert os.listdir(profile_dir) == []
+    assert client.get("/admin/profiles").status_code == 403
+
+
+def test_invalid_profile_name(client):
+    login(client, 1)
+    assert client.get("/admin/profiles/..%2Fsecret").status_code == 404
@@ -0,0 +1,163 @@
+"""
+Runs EXPLAIN QUERY PLAN on every query issued by the main routes,
+so that a missing index fails here instead of on a big production table
+"""
+import os
+import tempfile
+import pytest
+from sqlalchemy import event
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.models import (
+    User,
+    GameCharacter,
+    GameCampaign,
+    CampaignLocation,
+    LocationScene,
+    SceneNPC,
+)
+from tabletop_story.dnd_campaign import NPC
+from dnd_character.classes import Fighter
+from dnd_character.monsters import SRD_monsters
+
+
+@pytest.fixture
+def client():
+    global app, db, bcrypt, login_manager
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app = init_app(app)
+    client = app.test_client()
+    with app.app_context():
+        with client:
+            db.create_all()
+            create_campaign()
+            yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def create_campaign():
+    """A gamemaster (user 1) running a campaign for two players (users 2 and 3)"""
+    for i in (1, 2, 3):
+        db.session.add(
+            User(
+                email=f"{i}@example.com",
+                username=f"{i}",
+                password="password",
+                is_admin=False,
+            )
+        )
+    characters = []
+    for i in (2, 3):
+        thor = Fighter(name=f"thor {i}", experience=255, alignment="TN")
+        characters.append(GameCharacter(user_id=i, name=thor.name, data=dict(thor)))
+    db.session.add_all(characters)
+    campaign = GameCampaign(
+        name="test", gamemaster=1, members=characters, active_location=0
+    )
+    db.session.add(campaign)
+    db.session.flush()
+    zombie = NPC.from_template(SRD_monsters["zombie"]).as_dict()
+    for i in range(2):
+        location = CampaignLocation(name=f"location {i}", campaign_id=campaign.id)
+        db.session.add(location)
+        db.session.flush()
+        for j in range(2):
+            scene = LocationScene(name=f"scene {j}", location_id=location.id)
+            db.session.add(scene)
+            db.session.flush()
+            db.session.add(SceneNPC(name="zombie", scene_id=scene.id, data=str(zombie)))
+    db.session.commit()
+
+
+def login(client, user_id):
+    client.post(
+        "/account/login",
+        data={"email": f"{user_id}@example.com", "password": "password"},
+        follow_redirects=True,
+    )
+
+
+def capture_selects(client, urls):
+    """Returns list of (statement, parameters) for every SELECT issued by the urls"""
+    selects = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        for url in urls:
+            resp = client.get(url)
+            assert resp.status_code == 200, url
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    return selects
+
+
+def table_scans(selects):
+    """
+    Runs EXPLAIN QUERY PLAN for each captured SELECT.
+    Returns list of (statement, plan detail) for every full table scan
+    """
+    scans = []
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for statement, parameters in selects:
+            for row in cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters):
+                detail = row[-1]
+                if detail.startswith("SCAN") and "CONSTANT ROW" not in detail:
+                    scans.append((statement, detail))
+    finally:
+        connection.close()
+    return scans
+
+
+def assert_no_table_scans(client, urls):
+    selects = capture_selects(client, urls)
+    assert selects
+    scans = table_scans(selects)
+    assert not scans, "\n\n".join(
+        f"{detail}\n{statement}" for statement, detail in scans
+    )
+
+
+def test_gamemaster_routes_use_indexes(client):
+    login(client, 1)
+    client.get("/campaign/location/1/activate/1")
+    client.get("/location/scene/1/activate/1")
+    client.get("/campaign/combat/1/toggle")
+    assert_no_table_scans(
+        client,
+        [
+            "/",
+            "/campaign/view/1",
+            "/campaign/edit/1/",
+            "/campaign/location/view/1",
+            "/location/scene/view/1",
+            "/scene/npc/view/1",
+            "/scene/npc/get/1/card",
+            "/character/view/1",
+            "/character/edit/1",
+        ],
+    )
+
+
+def test_player_routes_use_indexes(client):
+    login(client, 2)
+    assert_no_table_scans(
+        client,
+        [
+            "/",
+            "/campaign/view/1",
+            "/character/view/1",
+            "/character/edit/1",
+        ],
+    )
@@ -255,3 +255,26 @@ def test_user_create_fighter(user_logged_in_client):
     assert request.url == "http://localhost/character/edit/1"
     resp = user_logged_in_client.get("/character/view/1")
     assert resp.status_code == 200
+
+
+def test_rules_page_is_streamed(client):
+    resp = client.get("/rules")
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert nav_selected_bytes("/rules") in resp.data
+    assert b'id="cover"' in resp.data
+    assert b'data-src="/rules/traps"' in resp.data
+
+
+def test_rules_section_fragment(client):
+    resp = client.get("/rules/traps")
+    assert resp.status_code == 200
+    assert b"<h" in resp.data and b"<html" not in resp.data
+    assert client.get("/rules/nonsense").status_code == 404
+
+
+def test_rules_page_shows_flashed_message(client):
+    with client.session_transaction() as session:
+        session["_flashes"] = [("message", "Hello")]
+    assert b"Hello" in client.get("/rules").data
+    assert b"Hello" not in client.get("/rules").data
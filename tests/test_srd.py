@@ -0,0 +1,95 @@
+import os
+import tempfile
+import pytest
+from dnd_character.spellcasting import spells_for_class_level, SRD_spells
+from dnd_character.monsters import SRD_monsters
+from tabletop_story.__init__ import create_app
+from tabletop_story.app import init_app, plugins
+from tabletop_story.cache import fragment_cache
+from tabletop_story.srd import (
+    SPELL_KEYS,
+    MONSTERS,
+    spell_keys,
+    spell_choices,
+    spell_name,
+    thaw,
+)
+
+
+@pytest.fixture
+def client():
+    global app, db, bcrypt, login_manager
+    app = create_app()
+    db, migrate, bcrypt, login_manager = plugins
+    db_fd, db_path = tempfile.mkstemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite+pysqlite:///" + db_path
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["TESTING"] = True
+    app = init_app(app)
+    client = app.test_client()
+    fragment_cache.clear()
+    with app.app_context():
+        with client:
+            db.create_all()
+            yield client
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+@pytest.mark.parametrize("classs", ["bard", "cleric", "wizard", "paladin"])
+def test_spell_index_matches_srd(classs):
+    for level in range(10):
+        assert set(spell_keys(classs, level)) == spells_for_class_level(classs, level)
+
+
+def test_spell_index_is_sorted_by_name():
+    names = [name for key, name in spell_choices("wizard", 1)]
+    assert names == sorted(names)
+    assert spell_keys("wizard", 1)[0] == spell_choices("wizard", 1)[0][0]
+
+
+def test_spell_index_is_read_only():
+    with pytest.raises(TypeError):
+        SPELL_KEYS[("wizard", 0)] = ()
+    assert isinstance(spell_keys("wizard", 0), tuple)
+
+
+def test_spell_index_for_classes_without_spells():
+    assert spell_keys("fighter", 1) == ()
+    assert spell_choices("nobody", 0) == ()
+
+
+def test_spell_name():
+    assert spell_name("fire-bolt") == SRD_spells["fire-bolt"]["name"]
+
+
+def test_srd_views_are_read_only():
+    with pytest.raises(TypeError):
+        MONSTERS["zombie"]["name"] = "Zed"
+    zombie = thaw(MONSTERS["zombie"])
+    zombie["name"] = "Zed"
+    assert MONSTERS["zombie"]["name"] == "Zombie"
+    assert zombie["actions"] == SRD_monsters["zombie"]["actions"]
+
+
+def test_spell_card_does_not_modify_srd(client):
+    resp = client.get("/spells/get/fire-bolt")
+    assert resp.status_code == 200
+    assert "Fire Bolt" in resp.get_json()["html"]
+    assert "html" not in SRD_spells["fire-bolt"]
+
+
+def test_monster_card_is_rendered_once(client):
+    first = client.get("/monsters/get/zombie/card").get_json()
+    misses = fragment_cache.misses
+    second = client.get("/monsters/get/zombie/card").get_json()
+    assert fragment_cache.misses == misses
+    assert first == second
+    assert "Zombie" in first["html"]
+    assert "html" not in SRD_monsters["zombie"]
+
+
+def test_monster_attribute(client):
+    assert client.get("/monsters/get/zombie/name").get_json() == "Zombie"
+    assert client.get("/monsters/get/zombie/nonsense").status_code >= 400
+    assert client.get("/monsters/get/nobody/card").status_code == 404
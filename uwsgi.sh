@@ -6,4 +6,4 @@ else
     port="$1"
 fi
 
-uwsgi --socket 0.0.0.0:$port --protocol=http -w tabletop_story.run:app
+uwsgi --socket 0.0.0.0:$port --protocol=http --enable-threads --threads 8 -w tabletop_story.run:app